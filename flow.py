@@ -2,6 +2,8 @@ from pocketflow import Flow
 # Import all node classes from nodes.py
 from nodes import (
     FetchRepo,
+    DeduplicateFiles,
+    RankFiles,
     IdentifyAbstractions,
     AnalyzeRelationships,
     OrderChapters,
@@ -14,6 +16,8 @@ def create_tutorial_flow():
 
     # Instantiate nodes
     fetch_repo = FetchRepo()
+    deduplicate_files = DeduplicateFiles()
+    rank_files = RankFiles()
     identify_abstractions = IdentifyAbstractions(max_retries=5, wait=20)
     analyze_relationships = AnalyzeRelationships(max_retries=5, wait=20)
     order_chapters = OrderChapters(max_retries=5, wait=20)
@@ -21,7 +25,9 @@ def create_tutorial_flow():
     combine_tutorial = CombineTutorial()
 
     # Connect nodes in sequence based on the design
-    fetch_repo >> identify_abstractions
+    fetch_repo >> deduplicate_files
+    deduplicate_files >> rank_files
+    rank_files >> identify_abstractions
     identify_abstractions >> analyze_relationships
     analyze_relationships >> order_chapters
     order_chapters >> write_chapters
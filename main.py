@@ -3,6 +3,8 @@ import os
 import argparse
 # Import the function that creates the flow
 from flow import create_tutorial_flow
+from utils import deadlines, llm_metrics
+from utils.compaction import COMPACTION_LEVELS, DEFAULT_LEVELS
 
 dotenv.load_dotenv()
 
@@ -35,6 +37,22 @@ DEFAULT_EXCLUDE_PATTERNS = {
     "*.log"
 }
 
+# Compaction level per node ("abstractions", "relationships", "chapters") from --compact
+def parse_compaction(values):
+    """Turn --compact values ("LEVEL" or "NODE=LEVEL") into a level per node."""
+    compaction = dict(DEFAULT_LEVELS)
+    for value in values or []:
+        node, _, level = value.rpartition("=")
+        nodes = [node] if node else list(DEFAULT_LEVELS)
+        if level not in COMPACTION_LEVELS or any(n not in DEFAULT_LEVELS for n in nodes):
+            raise argparse.ArgumentTypeError(
+                f"invalid --compact value '{value}': expected LEVEL or NODE=LEVEL with LEVEL in "
+                f"{', '.join(COMPACTION_LEVELS)} and NODE in {', '.join(DEFAULT_LEVELS)}")
+        for n in nodes:
+            compaction[n] = level
+    return compaction
+
+
 # --- Main Function ---
 def main():
     parser = argparse.ArgumentParser(description="Generate a tutorial for a GitHub codebase or local directory.")
@@ -45,51 +63,111 @@ def main():
     source_group.add_argument("--dir", help="Path to local directory.")
 
     parser.add_argument("-n", "--name", help="Project name (optional, derived from repo/directory if omitted).")
-    parser.add_argument("-t", "--token", help="GitHub personal access token (optional, reads from GITHUB_TOKEN env var if not provided).")
+    parser.add_argument("-t", "--token", nargs="+", help="GitHub personal access token(s) (optional, reads from GITHUB_TOKENS or GITHUB_TOKEN env vars if not provided). Several tokens are rotated by remaining quota.")
     parser.add_argument("-o", "--output", default="output", help="Base directory for output (default: ./output).")
     parser.add_argument("-i", "--include", nargs="+", help="Include file patterns (e.g. '*.py' '*.js'). Defaults to common code files if not specified.")
     parser.add_argument("-e", "--exclude", nargs="+", help="Exclude file patterns (e.g. 'tests/*' 'docs/*'). Defaults to test/build directories if not specified.")
     parser.add_argument("-s", "--max-size", type=int, default=100000, help="Maximum file size in bytes (default: 100000, about 100KB).")
+    parser.add_argument("--skip-large-files", action="store_true", help="Skip files above --max-size instead of keeping an outline of their declarations (default: outline)")
+    parser.add_argument("--crawl-workers", type=int, default=8, help="Number of concurrent workers used while crawling (default: 8)")
+    parser.add_argument("--crawl-strategy", choices=["auto", "contents", "trees", "tarball"], default="auto", help="How to fetch GitHub repositories; 'auto' picks one from a size pre-flight (default: auto)")
+    # Git-backed local crawling: enumerate tracked files from the index, optionally at another commit
+    parser.add_argument("--git-index", action="store_true", help="With --dir, crawl only files tracked in the git index instead of walking the directory")
+    parser.add_argument("--git-ref", help="With --dir, read files from this commit, branch or tag of the git repository without checking it out (implies --git-index)")
+    # Content classifier: reject binary, minified, generated and lockfile content while crawling
+    parser.add_argument("--no-content-filter", action="store_true", help="Keep binary, minified, generated, vendored and lockfile content that matches the patterns (default: rejected while crawling)")
+    # Duplicate collapsing: send one representative per cluster of identical / near-identical files
+    parser.add_argument("--no-dedup", action="store_true", help="Disable collapsing of duplicate and near-duplicate files (default: enabled)")
+    parser.add_argument("--near-dup-threshold", type=float, default=0.85, help="Minimum estimated similarity (0-1) for two files to be collapsed as near-duplicates; above 1 collapses exact duplicates only (default: 0.85)")
+    # Context budget: above it, prompts carry the highest-ranked files (import centrality, entry points, ...)
+    parser.add_argument("--max-context-chars", type=int, help="Character budget for the file contents sent when identifying abstractions and relationships; the most important files are picked first (default: no limit)")
+    parser.add_argument("--history-days", type=int, default=365, help="With --max-context-chars, also rank git sources (--dir repositories and SSH clones) by churn and recency over this many days of history; 0 disables (default: 365)")
+    # Chapter context budget: above it, chapters get the code slices most relevant to their abstraction
+    parser.add_argument("--chapter-context-chars", type=int, default=40000, help="Character budget for the code in each chapter prompt; when an abstraction's files exceed it, only the functions and classes that best match the abstraction (from any file) are sent; 0 sends full files (default: 40000)")
+    # Compaction of file contents in prompts: repeated license headers, whitespace and optionally comments
+    parser.add_argument("--compact", nargs="+", metavar="[NODE=]LEVEL", help="Compaction of file contents in prompts: 'off', 'whitespace' (drop license headers repeated across files, trailing whitespace and blank-line runs) or 'comments' (also strip comments, keeping docstrings and doc comments). Set it per node with abstractions=, relationships= or chapters= (default: whitespace for every node; comments only when asked for)")
     # Add language parameter for multi-language support
     parser.add_argument("--language", default="english", help="Language for the generated tutorial (default: english)")
     # Add use_cache parameter to control LLM caching
     parser.add_argument("--no-cache", action="store_true", help="Disable LLM response caching (default: caching enabled)")
+    # Add no-crawl-cache parameter to control the on-disk blob cache used by the GitHub crawler
+    parser.add_argument("--no-crawl-cache", action="store_true", help="Disable reuse of previously downloaded file contents (default: crawl cache enabled)")
+    # Time budgets: every LLM request gets a timeout derived from what is left of them
+    parser.add_argument("--llm-timeout", type=float, default=deadlines.DEFAULT_CALL_TIMEOUT, help=f"Timeout in seconds for a single LLM request (default: {deadlines.DEFAULT_CALL_TIMEOUT:.0f})")
+    parser.add_argument("--node-budget", type=float, help="Time budget in seconds for the LLM calls of each step, retries included (default: no limit)")
+    parser.add_argument("--run-budget", type=float, help="Wall-clock budget in seconds for the whole run; once it is spent, no further LLM request is started and the run stops (default: no limit)")
     # Add max_abstraction_num parameter to control the number of abstractions
     parser.add_argument("--max-abstractions", type=int, default=10, help="Maximum number of abstractions to identify (default: 10)")
 
     args = parser.parse_args()
+    try:
+        compaction = parse_compaction(args.compact)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    # The run's clock starts here, so crawling counts against --run-budget too
+    deadlines.configure(run_seconds=args.run_budget, node_seconds=args.node_budget, call_timeout=args.llm_timeout)
 
-    # Get GitHub token from argument or environment variable if using repo
-    github_token = None
+    if (args.git_index or args.git_ref) and not args.dir:
+        parser.error("--git-index and --git-ref require --dir")
+
+    # Get GitHub tokens from argument or environment variables if using repo
+    # (each value may hold several comma-separated tokens)
+    github_tokens = []
     if args.repo:
-        github_token = args.token or os.environ.get('GITHUB_TOKEN')
-        if not github_token:
+        token_values = args.token or [os.environ.get('GITHUB_TOKENS', ''), os.environ.get('GITHUB_TOKEN', '')]
+        for value in token_values:
+            for token in value.split(","):
+                if token.strip() and token.strip() not in github_tokens:
+                    github_tokens.append(token.strip())
+        if not github_tokens:
             print("Warning: No GitHub token provided. You might hit rate limits for public repositories.")
+        elif len(github_tokens) > 1:
+            print(f"Using a pool of {len(github_tokens)} GitHub tokens.")
 
     # Initialize the shared dictionary with inputs
     shared = {
         "repo_url": args.repo,
         "local_dir": args.dir,
         "project_name": args.name, # Can be None, FetchRepo will derive it
-        "github_token": github_token,
+        "github_token": github_tokens[0] if github_tokens else None,
+        "github_tokens": github_tokens,
         "output_dir": args.output, # Base directory for CombineTutorial output
 
         # Add include/exclude patterns and max file size
         "include_patterns": set(args.include) if args.include else DEFAULT_INCLUDE_PATTERNS,
         "exclude_patterns": set(args.exclude) if args.exclude else DEFAULT_EXCLUDE_PATTERNS,
         "max_file_size": args.max_size,
+        "outline_large_files": not args.skip_large_files,
+        "crawl_workers": args.crawl_workers,
+        "crawl_strategy": args.crawl_strategy,
+        "use_git_index": args.git_index or bool(args.git_ref),
+        "git_ref": args.git_ref,
+        "content_filter": not args.no_content_filter,
+        "dedup_files": not args.no_dedup,
+        "near_duplicate_threshold": args.near_dup_threshold,
+        "max_context_chars": args.max_context_chars,
+        "history_days": args.history_days,
+        "chapter_context_chars": args.chapter_context_chars,
+        "compaction": compaction,
 
         # Add language for multi-language support
         "language": args.language,
         
         # Add use_cache flag (inverse of no-cache flag)
         "use_cache": not args.no_cache,
+
+        # Add use_crawl_cache flag (inverse of no-crawl-cache flag)
+        "use_crawl_cache": not args.no_crawl_cache,
         
         # Add max_abstraction_num parameter
         "max_abstraction_num": args.max_abstractions,
 
         # Outputs will be populated by the nodes
         "files": [],
+        "file_duplicates": {},
+        "file_history": None,
+        "file_scores": None,
         "abstractions": [],
         "relationships": {},
         "chapter_order": [],
@@ -105,7 +183,14 @@ def main():
     tutorial_flow = create_tutorial_flow()
 
     # Run the flow
-    tutorial_flow.run(shared)
+    try:
+        tutorial_flow.run(shared)
+    except deadlines.DeadlineExceeded as e:
+        print(f"Stopped: {e}")
+        raise SystemExit(1)
+    finally:
+        # Per-node LLM metrics (e.g. cascade escalation rates), if any were recorded
+        llm_metrics.print_summary()
 
 if __name__ == "__main__":
     main()
@@ -2,21 +2,57 @@ import os
 import re
 import yaml
 from pocketflow import Node, BatchNode
-from utils.crawl_github_files import crawl_github_files
-from utils.call_llm import call_llm
-from utils.crawl_local_files import crawl_local_files
+from utils.crawl_github_files import iter_github_files
+from utils.call_llm import call_llm, call_llm_cascade
+from utils import deadlines
+from utils.crawl_local_files import iter_local_files
+from utils.crawl_git_index import iter_git_index
+from utils.file_store import FileStore
+from utils.context_builder import ContextBuilder
+from utils.compaction import DEFAULT_LEVELS, Compactor
+from utils.code_index import DEFAULT_CHAPTER_CONTEXT_CHARS, CodeIndex
+from utils.dedup import find_duplicates
+from utils.file_ranking import rank_files, select_by_score
+from utils.git_history import DEFAULT_WINDOW_DAYS, analyze_history, history_scores
+
+
+# Helper to pick the most important files that fit the context budget (all files without a budget)
+def select_for_context(files_data, indices, scores, budget, overhead=0):
+    if budget is not None:
+        budget = max(budget - overhead, 0)
+    # Each file also carries a header line in the prompt
+    return select_by_score(indices, scores, lambda i: files_data.stored_size(i) + 64, budget)
+
+
+# Helper to get the compactor and the compaction level of one node ("abstractions", "relationships", "chapters")
+def get_compaction(shared, node):
+    level = shared.get("compaction", {}).get(node, DEFAULT_LEVELS[node])
+    # One compactor per file store, so repeated headers are detected once and compacted texts are shared
+    if shared.get("compactor") is None or shared["compactor"].files is not shared["files"]:
+        shared["compactor"] = Compactor(shared["files"])
+    return shared["compactor"], level
+
+
+# Helper to map file indices onto the representatives of their duplicate clusters
+def resolve_duplicate_indices(indices, duplicates):
+    resolved = []
+    for i in indices:
+        i = duplicates.get(i, i)
+        if i not in resolved:
+            resolved.append(i)
+    return resolved
 
 
-# Helper to get content for specific file indices
-def get_content_for_indices(files_data, indices):
-    content_map = {}
-    for i in indices:
-        if 0 <= i < len(files_data):
-            path, content = files_data[i]
-            content_map[f"{i} # {path}"] = (
-                content  # Use index + path as key for context
-            )
-    return content_map
+# Mixin for the LLM nodes: retry waits end at the node's and the run's deadline, so once
+# a budget is spent the remaining retries fail at once instead of sleeping past it
+class DeadlineAwareRetries:
+    @property
+    def wait(self):
+        return deadlines.current().clamp_wait(type(self).__name__, self._wait)
+
+    @wait.setter
+    def wait(self, value):
+        self._wait = value
 
 
 class FetchRepo(Node):
@@ -42,63 +78,172 @@ class FetchRepo(Node):
             "repo_url": repo_url,
             "local_dir": local_dir,
             "token": shared.get("github_token"),
+            "tokens": shared.get("github_tokens"),
             "include_patterns": include_patterns,
             "exclude_patterns": exclude_patterns,
             "max_file_size": max_file_size,
             "use_relative_paths": True,
+            "use_crawl_cache": shared.get("use_crawl_cache", True),
+            "crawl_workers": shared.get("crawl_workers", 8),
+            "crawl_strategy": shared.get("crawl_strategy", "auto"),
+            "use_git_index": shared.get("use_git_index", False),
+            "git_ref": shared.get("git_ref"),
+            "content_filter": shared.get("content_filter", True),
+            "outline_large_files": shared.get("outline_large_files", False),
+            # History only feeds the file ranking, which runs with a context budget
+            "history_days": shared.get("history_days", DEFAULT_WINDOW_DAYS) if shared.get("max_context_chars") else None,
         }
 
     def exec(self, prep_res):
+        # Each crawler yields file records as they arrive, so files are consumed
+        # while the rest of the crawl is still running
         if prep_res["repo_url"]:
             print(f"Crawling repository: {prep_res['repo_url']}...")
-            result = crawl_github_files(
+            records = iter_github_files(
                 repo_url=prep_res["repo_url"],
                 token=prep_res["token"],
+                tokens=prep_res["tokens"],
+                include_patterns=prep_res["include_patterns"],
+                exclude_patterns=prep_res["exclude_patterns"],
+                max_file_size=prep_res["max_file_size"],
+                use_relative_paths=prep_res["use_relative_paths"],
+                use_blob_cache=prep_res["use_crawl_cache"],
+                use_http_cache=prep_res["use_crawl_cache"],
+                max_workers=prep_res["crawl_workers"],
+                strategy=prep_res["crawl_strategy"],
+                content_filter=prep_res["content_filter"],
+                outline_large_files=prep_res["outline_large_files"],
+                history_window_days=prep_res["history_days"],
+            )
+        elif prep_res["use_git_index"] or prep_res["git_ref"]:
+            print(f"Crawling git repository: {prep_res['local_dir']}...")
+            records = iter_git_index(
+                directory=prep_res["local_dir"],
+                ref=prep_res["git_ref"],
                 include_patterns=prep_res["include_patterns"],
                 exclude_patterns=prep_res["exclude_patterns"],
                 max_file_size=prep_res["max_file_size"],
                 use_relative_paths=prep_res["use_relative_paths"],
+                max_workers=prep_res["crawl_workers"],
+                content_filter=prep_res["content_filter"],
+                outline_large_files=prep_res["outline_large_files"],
             )
         else:
             print(f"Crawling directory: {prep_res['local_dir']}...")
 
-            result = crawl_local_files(
+            records = iter_local_files(
                 directory=prep_res["local_dir"],
                 include_patterns=prep_res["include_patterns"],
                 exclude_patterns=prep_res["exclude_patterns"],
                 max_file_size=prep_res["max_file_size"],
-                use_relative_paths=prep_res["use_relative_paths"]
+                use_relative_paths=prep_res["use_relative_paths"],
+                max_workers=prep_res["crawl_workers"],
+                content_filter=prep_res["content_filter"],
+                outline_large_files=prep_res["outline_large_files"],
             )
 
-        # Convert dict to list of tuples: [(path, content), ...]
-        files_list = list(result.get("files", {}).items())
-        if len(files_list) == 0:
+        # Store the stream in a FileStore: paths stay in memory, contents are loaded on demand
+        files_store = FileStore.from_records(records)
+        if len(files_store) == 0:
             raise (ValueError("Failed to fetch files"))
-        print(f"Fetched {len(files_list)} files.")
-        return files_list
+        print(f"Fetched {len(files_store)} files.")
+        return files_store
 
     def post(self, shared, prep_res, exec_res):
-        shared["files"] = exec_res  # List of (path, content) tuples
+        shared["files"] = exec_res  # FileStore, indexable like a list of (path, content) tuples
+        # SSH clones are deleted after the crawl, so their history is collected while crawling
+        shared["file_history"] = exec_res.stats.get("history")
 
 
-class IdentifyAbstractions(Node):
+class DeduplicateFiles(Node):
+    def prep(self, shared):
+        return (
+            shared["files"],
+            shared.get("dedup_files", True),
+            shared.get("near_duplicate_threshold", 0.85),
+        )
+
+    def exec(self, prep_res):
+        files_data, dedup_files, near_threshold = prep_res
+        if not dedup_files:
+            return {}, None
+        print("Detecting duplicate files...")
+        return find_duplicates(files_data, near_threshold)
+
+    def post(self, shared, prep_res, exec_res):
+        duplicates, stats = exec_res
+        # Collapsed file index -> representative file index; indices into shared["files"] stay valid
+        shared["file_duplicates"] = duplicates
+        if duplicates:
+            print(
+                f"Collapsed {len(duplicates)} duplicate files ({stats['exact_duplicates']} exact, "
+                f"{stats['near_duplicates']} near-duplicate) into {stats['clusters']} representatives."
+            )
+
+
+class RankFiles(Node):
+    def prep(self, shared):
+        return (
+            shared["files"],
+            shared.get("file_duplicates", {}),
+            shared.get("max_context_chars"),
+            shared.get("file_history"),
+            # Local directories are analyzed here; GitHub URLs have no local history
+            shared.get("local_dir") if not shared.get("repo_url") else None,
+            shared.get("history_days", DEFAULT_WINDOW_DAYS),
+            shared.get("git_ref"),  # History is read at the crawled ref, not at the working tree's HEAD
+        )
+
+    def exec(self, prep_res):
+        files_data, duplicates, max_context_chars, history, local_dir, history_days, git_ref = prep_res
+        if not max_context_chars:
+            return None  # Without a context budget every file is sent, so no ranking is needed
+        if history is None and local_dir and history_days:
+            print(f"Analyzing the last {history_days} days of git history...")
+            history = analyze_history(local_dir, history_days, ref=git_ref)
+        print("Ranking files by importance" + (" and git history..." if history else "..."))
+        scores, _ = rank_files(files_data, duplicates, history_scores(history) if history else None)
+        return scores
+
+    def post(self, shared, prep_res, exec_res):
+        shared["file_scores"] = exec_res  # Score per file index, or None
+        if exec_res:
+            top = sorted(range(len(exec_res)), key=lambda i: (-exec_res[i], i))[:5]
+            print("Most important files: " + ", ".join(shared["files"].path(i) for i in top))
+
+
+class IdentifyAbstractions(DeadlineAwareRetries, Node):
     def prep(self, shared):
         files_data = shared["files"]
+        duplicates = shared.get("file_duplicates", {})
+        scores = shared.get("file_scores")
+        max_context_chars = shared.get("max_context_chars")
         project_name = shared["project_name"]  # Get project name
         language = shared.get("language", "english")  # Get language
         use_cache = shared.get("use_cache", True)  # Get use_cache flag, default to True
         max_abstraction_num = shared.get("max_abstraction_num", 10)  # Get max_abstraction_num, default to 10
+        compactor, compaction = get_compaction(shared, "abstractions")
 
         # Helper to create context from files, respecting limits (basic example)
         def create_llm_context(files_data):
-            context = ""
+            builder = ContextBuilder(files_data, compactor, compaction)
             file_info = []  # Store tuples of (index, path)
-            for i, (path, content) in enumerate(files_data):
-                entry = f"--- File Index {i}: {path} ---\n{content}\n\n"
-                context += entry
+            # Only one representative per duplicate cluster is sent; its header names the others
+            collapsed = {}
+            for member, representative in sorted(duplicates.items()):
+                collapsed.setdefault(representative, []).append(files_data.path(member))
+            # Over the context budget, only the highest-ranked files are sent
+            candidates = [i for i in range(len(files_data)) if i not in duplicates]
+            selected = select_for_context(files_data, candidates, scores, max_context_chars)
+            if len(selected) < len(candidates):
+                print(f"Context budget: sending {len(selected)} of {len(candidates)} files, ranked by importance.")
+            for i in selected:
+                path = files_data.path(i)
+                label = f"{path} (duplicates: {', '.join(collapsed[i])})" if i in collapsed else path
+                builder.add_file(i, header=f"--- File Index {i}: {label} ---\n", trailer="\n\n")
                 file_info.append((i, path))
 
-            return context, file_info  # file_info is list of (index, path)
+            return builder.build(), file_info  # file_info is list of (index, path)
 
         context, file_info = create_llm_context(files_data)
         # Format file info for the prompt (comment is just a hint for LLM)
@@ -173,60 +318,64 @@ Format the output as a YAML list of dictionaries:
     - 5 # path/to/another.js
 # ... up to {max_abstraction_num} abstractions
 ```"""
-        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0))  # Use cache only if enabled and not retrying
-
-        # --- Validation ---
-        yaml_str = response.strip().split("```yaml")[1].split("```")[0].strip()
-        abstractions = yaml.safe_load(yaml_str)
-
-        if not isinstance(abstractions, list):
-            raise ValueError("LLM Output is not a list")
-
-        validated_abstractions = []
-        for item in abstractions:
-            if not isinstance(item, dict) or not all(
-                k in item for k in ["name", "description", "file_indices"]
-            ):
-                raise ValueError(f"Missing keys in abstraction item: {item}")
-            if not isinstance(item["name"], str):
-                raise ValueError(f"Name is not a string in item: {item}")
-            if not isinstance(item["description"], str):
-                raise ValueError(f"Description is not a string in item: {item}")
-            if not isinstance(item["file_indices"], list):
-                raise ValueError(f"file_indices is not a list in item: {item}")
-
-            # Validate indices
-            validated_indices = []
-            for idx_entry in item["file_indices"]:
-                try:
-                    if isinstance(idx_entry, int):
-                        idx = idx_entry
-                    elif isinstance(idx_entry, str) and "#" in idx_entry:
-                        idx = int(idx_entry.split("#")[0].strip())
-                    else:
-                        idx = int(str(idx_entry).strip())
-
-                    if not (0 <= idx < file_count):
+        def validate(response):
+            # --- Validation ---
+            yaml_str = response.strip().split("```yaml")[1].split("```")[0].strip()
+            abstractions = yaml.safe_load(yaml_str)
+
+            if not isinstance(abstractions, list):
+                raise ValueError("LLM Output is not a list")
+
+            validated_abstractions = []
+            for item in abstractions:
+                if not isinstance(item, dict) or not all(
+                    k in item for k in ["name", "description", "file_indices"]
+                ):
+                    raise ValueError(f"Missing keys in abstraction item: {item}")
+                if not isinstance(item["name"], str):
+                    raise ValueError(f"Name is not a string in item: {item}")
+                if not isinstance(item["description"], str):
+                    raise ValueError(f"Description is not a string in item: {item}")
+                if not isinstance(item["file_indices"], list):
+                    raise ValueError(f"file_indices is not a list in item: {item}")
+
+                # Validate indices
+                validated_indices = []
+                for idx_entry in item["file_indices"]:
+                    try:
+                        if isinstance(idx_entry, int):
+                            idx = idx_entry
+                        elif isinstance(idx_entry, str) and "#" in idx_entry:
+                            idx = int(idx_entry.split("#")[0].strip())
+                        else:
+                            idx = int(str(idx_entry).strip())
+
+                        if not (0 <= idx < file_count):
+                            raise ValueError(
+                                f"Invalid file index {idx} found in item {item['name']}. Max index is {file_count - 1}."
+                            )
+                        validated_indices.append(idx)
+                    except (ValueError, TypeError):
                         raise ValueError(
-                            f"Invalid file index {idx} found in item {item['name']}. Max index is {file_count - 1}."
+                            f"Could not parse index from entry: {idx_entry} in item {item['name']}"
                         )
-                    validated_indices.append(idx)
-                except (ValueError, TypeError):
-                    raise ValueError(
-                        f"Could not parse index from entry: {idx_entry} in item {item['name']}"
-                    )
 
-            item["files"] = sorted(list(set(validated_indices)))
-            # Store only the required fields
-            validated_abstractions.append(
-                {
-                    "name": item["name"],  # Potentially translated name
-                    "description": item[
-                        "description"
-                    ],  # Potentially translated description
-                    "files": item["files"],
-                }
-            )
+                item["files"] = sorted(list(set(validated_indices)))
+                # Store only the required fields
+                validated_abstractions.append(
+                    {
+                        "name": item["name"],  # Potentially translated name
+                        "description": item[
+                            "description"
+                        ],  # Potentially translated description
+                        "files": item["files"],
+                    }
+                )
+            return validated_abstractions
+
+        validated_abstractions = call_llm_cascade(
+            prompt, validate, use_cache=(use_cache and self.cur_retry == 0), node="IdentifyAbstractions"
+        )  # Use cache only if enabled and not retrying; a fast model first if a cascade is configured
 
         print(f"Identified {len(validated_abstractions)} abstractions.")
         return validated_abstractions
@@ -237,12 +386,16 @@ Format the output as a YAML list of dictionaries:
         )
 
 
-class AnalyzeRelationships(Node):
+class AnalyzeRelationships(DeadlineAwareRetries, Node):
     def prep(self, shared):
         abstractions = shared[
             "abstractions"
         ]  # Now contains 'files' list of indices, name/description potentially translated
         files_data = shared["files"]
+        duplicates = shared.get("file_duplicates", {})
+        scores = shared.get("file_scores")
+        max_context_chars = shared.get("max_context_chars")
+        compactor, compaction = get_compaction(shared, "relationships")
         project_name = shared["project_name"]  # Get project name
         language = shared.get("language", "english")  # Get language
         use_cache = shared.get("use_cache", True)  # Get use_cache flag, default to True
@@ -263,19 +416,24 @@ class AnalyzeRelationships(Node):
             abstraction_info_for_prompt.append(
                 f"{i} # {abstr['name']}"
             )  # Use potentially translated name here too
-            all_relevant_indices.update(abstr["files"])
+            all_relevant_indices.update(resolve_duplicate_indices(abstr["files"], duplicates))
 
         context += "\\nRelevant File Snippets (Referenced by Index and Path):\\n"
-        # Get content for relevant files using helper
-        relevant_files_content_map = get_content_for_indices(
-            files_data, sorted(list(all_relevant_indices))
+        # Over the context budget, keep the highest-ranked relevant files
+        relevant_indices = select_for_context(
+            files_data, sorted(list(all_relevant_indices)), scores, max_context_chars, overhead=len(context)
         )
-        # Format file content for context
-        file_context_str = "\\n\\n".join(
-            f"--- File: {idx_path} ---\\n{content}"
-            for idx_path, content in relevant_files_content_map.items()
+        # Format file content for relevant files, assembled from the file store in one pass
+        context = (
+            ContextBuilder(files_data, compactor, compaction)
+            .add_text(context)
+            .add_files(
+                relevant_indices,
+                header="--- File: {index} # {path} ---\\n",
+                separator="\\n\\n",
+            )
+            .build()
         )
-        context += file_context_str
 
         return (
             context,
@@ -344,56 +502,60 @@ relationships:
 
 Now, provide the YAML output:
 """
-        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0)) # Use cache only if enabled and not retrying
-
-        # --- Validation ---
-        yaml_str = response.strip().split("```yaml")[1].split("```")[0].strip()
-        relationships_data = yaml.safe_load(yaml_str)
+        def validate(response):
+            # --- Validation ---
+            yaml_str = response.strip().split("```yaml")[1].split("```")[0].strip()
+            relationships_data = yaml.safe_load(yaml_str)
 
-        if not isinstance(relationships_data, dict) or not all(
-            k in relationships_data for k in ["summary", "relationships"]
-        ):
-            raise ValueError(
-                "LLM output is not a dict or missing keys ('summary', 'relationships')"
-            )
-        if not isinstance(relationships_data["summary"], str):
-            raise ValueError("summary is not a string")
-        if not isinstance(relationships_data["relationships"], list):
-            raise ValueError("relationships is not a list")
-
-        # Validate relationships structure
-        validated_relationships = []
-        for rel in relationships_data["relationships"]:
-            # Check for 'label' key
-            if not isinstance(rel, dict) or not all(
-                k in rel for k in ["from_abstraction", "to_abstraction", "label"]
+            if not isinstance(relationships_data, dict) or not all(
+                k in relationships_data for k in ["summary", "relationships"]
             ):
                 raise ValueError(
-                    f"Missing keys (expected from_abstraction, to_abstraction, label) in relationship item: {rel}"
+                    "LLM output is not a dict or missing keys ('summary', 'relationships')"
                 )
-            # Validate 'label' is a string
-            if not isinstance(rel["label"], str):
-                raise ValueError(f"Relationship label is not a string: {rel}")
-
-            # Validate indices
-            try:
-                from_idx = int(str(rel["from_abstraction"]).split("#")[0].strip())
-                to_idx = int(str(rel["to_abstraction"]).split("#")[0].strip())
-                if not (
-                    0 <= from_idx < num_abstractions and 0 <= to_idx < num_abstractions
+            if not isinstance(relationships_data["summary"], str):
+                raise ValueError("summary is not a string")
+            if not isinstance(relationships_data["relationships"], list):
+                raise ValueError("relationships is not a list")
+
+            # Validate relationships structure
+            validated_relationships = []
+            for rel in relationships_data["relationships"]:
+                # Check for 'label' key
+                if not isinstance(rel, dict) or not all(
+                    k in rel for k in ["from_abstraction", "to_abstraction", "label"]
                 ):
                     raise ValueError(
-                        f"Invalid index in relationship: from={from_idx}, to={to_idx}. Max index is {num_abstractions-1}."
+                        f"Missing keys (expected from_abstraction, to_abstraction, label) in relationship item: {rel}"
                     )
-                validated_relationships.append(
-                    {
-                        "from": from_idx,
-                        "to": to_idx,
-                        "label": rel["label"],  # Potentially translated label
-                    }
-                )
-            except (ValueError, TypeError):
-                raise ValueError(f"Could not parse indices from relationship: {rel}")
+                # Validate 'label' is a string
+                if not isinstance(rel["label"], str):
+                    raise ValueError(f"Relationship label is not a string: {rel}")
+
+                # Validate indices
+                try:
+                    from_idx = int(str(rel["from_abstraction"]).split("#")[0].strip())
+                    to_idx = int(str(rel["to_abstraction"]).split("#")[0].strip())
+                    if not (
+                        0 <= from_idx < num_abstractions and 0 <= to_idx < num_abstractions
+                    ):
+                        raise ValueError(
+                            f"Invalid index in relationship: from={from_idx}, to={to_idx}. Max index is {num_abstractions-1}."
+                        )
+                    validated_relationships.append(
+                        {
+                            "from": from_idx,
+                            "to": to_idx,
+                            "label": rel["label"],  # Potentially translated label
+                        }
+                    )
+                except (ValueError, TypeError):
+                    raise ValueError(f"Could not parse indices from relationship: {rel}")
+            return relationships_data, validated_relationships
+
+        relationships_data, validated_relationships = call_llm_cascade(
+            prompt, validate, use_cache=(use_cache and self.cur_retry == 0), node="AnalyzeRelationships"
+        )  # Use cache only if enabled and not retrying; a fast model first if a cascade is configured
 
         print("Generated project summary and relationship details.")
         return {
@@ -407,7 +569,7 @@ Now, provide the YAML output:
         shared["relationships"] = exec_res
 
 
-class OrderChapters(Node):
+class OrderChapters(DeadlineAwareRetries, Node):
     def prep(self, shared):
         abstractions = shared["abstractions"]  # Name/description might be translated
         relationships = shared["relationships"]  # Summary/label might be translated
@@ -486,45 +648,49 @@ Output the ordered list of abstraction indices, including the name in a comment
 
 Now, provide the YAML output:
 """
-        response = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0)) # Use cache only if enabled and not retrying
-
-        # --- Validation ---
-        yaml_str = response.strip().split("```yaml")[1].split("```")[0].strip()
-        ordered_indices_raw = yaml.safe_load(yaml_str)
-
-        if not isinstance(ordered_indices_raw, list):
-            raise ValueError("LLM output is not a list")
-
-        ordered_indices = []
-        seen_indices = set()
-        for entry in ordered_indices_raw:
-            try:
-                if isinstance(entry, int):
-                    idx = entry
-                elif isinstance(entry, str) and "#" in entry:
-                    idx = int(entry.split("#")[0].strip())
-                else:
-                    idx = int(str(entry).strip())
-
-                if not (0 <= idx < num_abstractions):
+        def validate(response):
+            # --- Validation ---
+            yaml_str = response.strip().split("```yaml")[1].split("```")[0].strip()
+            ordered_indices_raw = yaml.safe_load(yaml_str)
+
+            if not isinstance(ordered_indices_raw, list):
+                raise ValueError("LLM output is not a list")
+
+            ordered_indices = []
+            seen_indices = set()
+            for entry in ordered_indices_raw:
+                try:
+                    if isinstance(entry, int):
+                        idx = entry
+                    elif isinstance(entry, str) and "#" in entry:
+                        idx = int(entry.split("#")[0].strip())
+                    else:
+                        idx = int(str(entry).strip())
+
+                    if not (0 <= idx < num_abstractions):
+                        raise ValueError(
+                            f"Invalid index {idx} in ordered list. Max index is {num_abstractions-1}."
+                        )
+                    if idx in seen_indices:
+                        raise ValueError(f"Duplicate index {idx} found in ordered list.")
+                    ordered_indices.append(idx)
+                    seen_indices.add(idx)
+
+                except (ValueError, TypeError):
                     raise ValueError(
-                        f"Invalid index {idx} in ordered list. Max index is {num_abstractions-1}."
+                        f"Could not parse index from ordered list entry: {entry}"
                     )
-                if idx in seen_indices:
-                    raise ValueError(f"Duplicate index {idx} found in ordered list.")
-                ordered_indices.append(idx)
-                seen_indices.add(idx)
 
-            except (ValueError, TypeError):
+            # Check if all abstractions are included
+            if len(ordered_indices) != num_abstractions:
                 raise ValueError(
-                    f"Could not parse index from ordered list entry: {entry}"
+                    f"Ordered list length ({len(ordered_indices)}) does not match number of abstractions ({num_abstractions}). Missing indices: {set(range(num_abstractions)) - seen_indices}"
                 )
+            return ordered_indices
 
-        # Check if all abstractions are included
-        if len(ordered_indices) != num_abstractions:
-            raise ValueError(
-                f"Ordered list length ({len(ordered_indices)}) does not match number of abstractions ({num_abstractions}). Missing indices: {set(range(num_abstractions)) - seen_indices}"
-            )
+        ordered_indices = call_llm_cascade(
+            prompt, validate, use_cache=(use_cache and self.cur_retry == 0), node="OrderChapters"
+        )  # Use cache only if enabled and not retrying; a fast model first if a cascade is configured
 
         print(f"Determined chapter order (indices): {ordered_indices}")
         return ordered_indices  # Return the list of indices
@@ -534,16 +700,20 @@ Now, provide the YAML output:
         shared["chapter_order"] = exec_res  # List of indices
 
 
-class WriteChapters(BatchNode):
+class WriteChapters(DeadlineAwareRetries, BatchNode):
     def prep(self, shared):
         chapter_order = shared["chapter_order"]  # List of indices
         abstractions = shared[
             "abstractions"
         ]  # List of {"name": str, "description": str, "files": [int]}
-        files_data = shared["files"]  # List of (path, content) tuples
+        files_data = shared["files"]  # FileStore of (path, content) tuples
+        duplicates = shared.get("file_duplicates", {})
+        compactor, compaction = get_compaction(shared, "chapters")
+        chapter_context_chars = shared.get("chapter_context_chars", DEFAULT_CHAPTER_CONTEXT_CHARS)
         project_name = shared["project_name"]
         language = shared.get("language", "english")
         use_cache = shared.get("use_cache", True)  # Get use_cache flag, default to True
+        code_index = None  # Built on first use, when a chapter's files exceed the budget
 
         # Get already written chapters to provide context
         # We store them temporarily during the batch run, not in shared memory yet
@@ -584,13 +754,27 @@ class WriteChapters(BatchNode):
                 abstraction_details = abstractions[
                     abstraction_index
                 ]  # Contains potentially translated name/desc
-                # Use 'files' (list of indices) directly
-                related_file_indices = abstraction_details.get("files", [])
-                # Get content using helper, passing indices
-                related_files_content_map = get_content_for_indices(
-                    files_data, related_file_indices
+                # Use 'files' (list of indices) directly; contents are loaded in exec
+                # and duplicates are sent once, as their cluster representative
+                related_file_indices = resolve_duplicate_indices(
+                    abstraction_details.get("files", []), duplicates
                 )
 
+                # Over the budget, send only the code slices most relevant to the abstraction
+                code_slices = None
+                full_size = sum(files_data.stored_size(j) + 64 for j in related_file_indices if 0 <= j < len(files_data))
+                if chapter_context_chars and full_size > chapter_context_chars:
+                    if code_index is None:
+                        print("Indexing code for chapter context...")
+                        code_index = CodeIndex(files_data, skip=duplicates)
+                    code_slices = code_index.select(
+                        f"{abstraction_details['name']} {abstraction_details.get('description', '')}",
+                        chapter_context_chars,
+                        [j for j in related_file_indices if 0 <= j < len(files_data)],
+                    )
+                    print(f"Chapter {i + 1}: sending {len(code_slices)} code slices instead of "
+                          f"{len(related_file_indices)} full files ({full_size} chars).")
+
                 # Get previous chapter info for transitions (uses potentially translated name)
                 prev_chapter = None
                 if i > 0:
@@ -608,7 +792,11 @@ class WriteChapters(BatchNode):
                         "chapter_num": i + 1,
                         "abstraction_index": abstraction_index,
                         "abstraction_details": abstraction_details,  # Has potentially translated name/desc
-                        "related_files_content_map": related_files_content_map,
+                        "related_file_indices": related_file_indices,
+                        "code_slices": code_slices,  # (file index, start line, end line), or None for full files
+                        "files_data": files_data,
+                        "compactor": compactor,
+                        "compaction": compaction,
                         "project_name": shared["project_name"],  # Add project name
                         "full_chapter_listing": full_chapter_listing,  # Add the full chapter listing (uses potentially translated names)
                         "chapter_filenames": chapter_filenames,  # Add chapter filenames mapping (uses potentially translated names)
@@ -641,11 +829,16 @@ class WriteChapters(BatchNode):
         use_cache = item.get("use_cache", True) # Read use_cache from item
         print(f"Writing chapter {chapter_num} for: {abstraction_name} using LLM...")
 
-        # Prepare file context string from the map
-        file_context_str = "\n\n".join(
-            f"--- File: {idx_path.split('# ')[1] if '# ' in idx_path else idx_path} ---\n{content}"
-            for idx_path, content in item["related_files_content_map"].items()
-        )
+        # Prepare file context string from this chapter's files (rendered blocks are reused across chapters)
+        builder = ContextBuilder(item["files_data"], item["compactor"], item["compaction"])
+        if item.get("code_slices") is None:
+            builder.add_files(item["related_file_indices"], header="--- File: {path} ---\n", separator="\n\n")
+        else:
+            for n, (file_index, start, end) in enumerate(item["code_slices"]):
+                separator = "\n\n" if n else ""
+                header = f"{separator}--- File: {item['files_data'].path(file_index)} (lines {start + 1}-{end}) ---\n"
+                builder.add_lines(file_index, start, end, header=header)
+        file_context_str = builder.build()
 
         # Get summary of chapters written *before* this one
         # Use the temporary instance variable
@@ -723,7 +916,7 @@ Instructions for the chapter (Generate content in {language.capitalize()} unless
 
 Now, directly provide a super beginner-friendly Markdown output (DON'T need ```markdown``` tags):
 """
-        chapter_content = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0)) # Use cache only if enabled and not retrying
+        chapter_content = call_llm(prompt, use_cache=(use_cache and self.cur_retry == 0), node="WriteChapters") # Use cache only if enabled and not retrying
         # Basic validation/cleanup
         actual_heading = f"# Chapter {chapter_num}: {abstraction_name}"  # Use potentially translated name
         if not chapter_content.strip().startswith(f"# Chapter {chapter_num}"):
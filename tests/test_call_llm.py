@@ -0,0 +1,23 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from utils import call_llm
+
+
+class HedgedCacheTest(unittest.TestCase):
+    def test_hedged_answer_is_served_from_the_cache(self):
+        cache_file = os.path.join(tempfile.mkdtemp(), "llm_cache.json")
+        failover = mock.Mock(return_value=(("OPENAI", "hedge-model"), "answer"))
+        with mock.patch.object(call_llm, "cache_file", cache_file), \
+                mock.patch.object(call_llm, "_get_failover", return_value=failover), \
+                mock.patch.object(call_llm, "resolve_route", return_value=None):
+            route = ("GEMINI", "primary-model")
+            self.assertEqual(call_llm.call_llm("prompt", route=route), "answer")
+            self.assertEqual(call_llm.call_llm("prompt", route=route), "answer")
+        self.assertEqual(failover.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from utils.content_classifier import ContentClassifier
+
+SOURCE = "def add(x, y):\n    return x + y\n" * 100
+
+
+class MinifiedCheckTest(unittest.TestCase):
+    def test_one_long_line_in_source_is_kept(self):
+        text = SOURCE + "ICON = 'data:image/png;base64," + "A" * 2500 + "'\n" + SOURCE
+        self.assertIsNone(ContentClassifier().reject_prefix("icons.py", text.encode(), complete=True))
+
+    def test_mostly_long_lines_are_minified(self):
+        text = ("var a=function(b){return b};" * 30 + "\n") * 8
+        self.assertEqual(ContentClassifier().reject_prefix("app.min.js", text.encode(), complete=True), "minified")
+
+    def test_readme_with_long_paragraphs_is_kept(self):
+        paragraph = "The crawler fetches the files of a repository and ranks them by relevance. " * 10
+        text = "# Project\n\n" + (paragraph + "\n\n") * 8
+        self.assertGreater(len(paragraph), 700)
+        self.assertIsNone(ContentClassifier().reject_prefix("README.md", text.encode(), complete=True))
+        self.assertIsNone(ContentClassifier().reject_prefix("docs/guide.rst", text.encode(), complete=True))
+
+    def test_single_line_bundle_is_minified(self):
+        self.assertEqual(ContentClassifier().reject_prefix("app.js", b"var a=1;" * 1000), "minified")
+
+
+class GeneratedCheckTest(unittest.TestCase):
+    def test_standard_headers_are_generated(self):
+        for header in ("// Code generated by protoc-gen-go. DO NOT EDIT.\n",
+                       "# Generated by the protocol buffer compiler.  DO NOT EDIT!\n",
+                       "/**\n * @generated\n */\n",
+                       "# This file is automatically generated by setup.py\n"):
+            text = header + SOURCE
+            self.assertEqual(ContentClassifier().reject_prefix("gen.py", text.encode(), complete=True), "generated")
+
+    def test_mentions_of_generated_code_are_kept(self):
+        for header in ('"""Helpers that load auto-generated protobuf stubs."""\n',
+                       "# Keep in sync: do not edit the table below by hand, run `make table`.\n",
+                       "// Wraps the code generated by protoc; see README for how to regenerate it.\n"):
+            text = header + SOURCE
+            self.assertIsNone(ContentClassifier().reject_prefix("helpers.py", text.encode(), complete=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
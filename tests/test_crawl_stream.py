@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from utils import crawl_github_files
+
+
+def make_response(status: int = 200, body: bytes = b"", json_body=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(json_body).encode() if json_body is not None else body
+    response._content_consumed = True
+    return response
+
+
+class CountingScheduler:
+    """Stands in for GitHubRequestScheduler: serves a flat repository and counts raw downloads."""
+
+    def __init__(self, file_count: int):
+        self.file_count = file_count
+        self.downloads = 0
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.pool = mock.Mock(snapshot=lambda: {})
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, params=None, timeout=None, paced=True, stream=False):
+        if url == "https://api.github.com/repos/o/r":
+            return make_response(json_body={"default_branch": "main", "size": 1})
+        if url == "https://api.github.com/repos/o/r/git/trees/main":
+            entries = [{"path": f"f{i}.py", "type": "blob", "size": 10, "sha": f"{i:040d}"}
+                       for i in range(self.file_count)]
+            return make_response(json_body={"tree": entries, "truncated": False})
+        if url.startswith("https://raw.githubusercontent.com/o/r/main/f"):
+            with self._lock:
+                self.downloads += 1
+            time.sleep(0.01)
+            return make_response(body=b"x = 1\n")
+        return make_response(404)
+
+
+class IterGithubFilesTest(unittest.TestCase):
+    def test_closing_the_generator_stops_the_crawl(self):
+        scheduler = CountingScheduler(file_count=10 * crawl_github_files.STREAM_QUEUE_SIZE)
+        with mock.patch.object(crawl_github_files, "GitHubRequestScheduler", lambda tokens: scheduler):
+            files = crawl_github_files.iter_github_files(
+                "https://github.com/o/r", strategy="trees", max_workers=4, use_blob_cache=False,
+                use_http_cache=False, content_filter=False)
+            self.assertEqual(len([next(files) for _ in range(3)]), 3)
+            files.close()
+            time.sleep(4 * crawl_github_files.STREAM_PUT_TIMEOUT)
+            downloads = scheduler.downloads
+            time.sleep(2 * crawl_github_files.STREAM_PUT_TIMEOUT)
+        # Queued downloads were dropped: only the buffered and the running ones were fetched
+        self.assertEqual(scheduler.downloads, downloads)
+        self.assertLessEqual(downloads, crawl_github_files.STREAM_QUEUE_SIZE + 3 + 2 * 4)
+
+    def test_returns_the_crawl_stats(self):
+        def crawl(repo_url, on_file=None, **kwargs):
+            on_file("a")
+            return {"stats": {"downloaded": 1}}
+
+        with mock.patch.object(crawl_github_files, "crawl_github_files", crawl):
+            files = crawl_github_files.iter_github_files("https://github.com/o/r")
+            self.assertEqual(next(files), "a")
+            with self.assertRaises(StopIteration) as stop:
+                next(files)
+        self.assertEqual(stop.exception.value, {"downloaded": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
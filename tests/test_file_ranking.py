@@ -0,0 +1,18 @@
+import unittest
+
+from utils.file_ranking import select_by_score
+
+
+class SelectByScoreTest(unittest.TestCase):
+    def test_spent_budget_keeps_only_the_top_file(self):
+        self.assertEqual(select_by_score([0, 1, 2], [0.9, 0.5, 0.1], lambda i: 100, 0), [0])
+
+    def test_budget_picks_highest_scores_in_original_order(self):
+        self.assertEqual(select_by_score([0, 1, 2], [0.1, 0.5, 0.9], lambda i: 100, 250), [1, 2])
+
+    def test_no_budget_keeps_everything(self):
+        self.assertEqual(select_by_score([0, 1, 2], [0.9, 0.5, 0.1], lambda i: 100, None), [0, 1, 2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from utils.blob_store import BlobMissingError, BlobStore, git_blob_sha
+from utils.file_records import FileRecord
+from utils.file_store import FileStore
+
+
+class BlobBackedFileTest(unittest.TestCase):
+    def setUp(self):
+        self.blob_store = BlobStore(tempfile.mkdtemp())
+        self.data = "print('héllo')\n".encode("utf-8")
+        self.sha = git_blob_sha(self.data)
+        self.blob_store.put(self.sha, self.data)
+        self.store = FileStore()
+        loader = mock.Mock(side_effect=lambda: self.blob_store.load_text(self.sha, "hello.py"))
+        self.loader = loader
+        self.store.add_record(FileRecord("hello.py", len(self.data), self.sha, self.data.decode("utf-8"),
+                                         loader, from_cache=True))
+
+    def test_stored_size_does_not_load_the_blob(self):
+        self.assertEqual(self.store.stored_size(0), len(self.data))
+        self.loader.assert_not_called()
+
+    def test_missing_blob_raises_a_clear_error(self):
+        os.remove(self.blob_store.path_for(self.sha))
+        with self.assertRaisesRegex(BlobMissingError, "hello.py"):
+            self.store.content(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from utils.git_history import analyze_history
+
+
+def git(directory, *args):
+    subprocess.run(["git", "-C", directory, "-c", "user.name=t", "-c", "user.email=t@example.com", *args],
+                   check=True, capture_output=True)
+
+
+class AnalyzeHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        git(self.repo, "init", "-q")
+        for name in ("first.py", "second.py"):
+            with open(os.path.join(self.repo, name), "w") as f:
+                f.write("x = 1\n")
+            git(self.repo, "add", name)
+            git(self.repo, "commit", "-q", "-m", f"Add {name}")
+        git(self.repo, "tag", "v1.0", "HEAD~1")
+
+    def test_history_is_read_at_the_given_ref(self):
+        self.assertEqual(sorted(analyze_history(self.repo, cache_dir=self.cache_dir)), ["first.py", "second.py"])
+        self.assertEqual(sorted(analyze_history(self.repo, cache_dir=self.cache_dir, ref="v1.0")), ["first.py"])
+
+    def test_unknown_ref_has_no_history(self):
+        self.assertIsNone(analyze_history(self.repo, cache_dir=self.cache_dir, ref="no-such-ref"))
+
+
+if __name__ == "__main__":
+    unittest.main()
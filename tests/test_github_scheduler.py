@@ -0,0 +1,41 @@
+import unittest
+from unittest import mock
+
+import requests
+
+from utils.github_scheduler import MAX_RATE_LIMIT_BODY_BYTES, GitHubRequestScheduler
+
+
+def make_response(status: int, headers: dict = None) -> mock.Mock:
+    response = mock.Mock(spec=requests.Response, status_code=status, headers=headers or {})
+    response.text_reads = mock.PropertyMock(return_value="API rate limit exceeded")
+    type(response).text = response.text_reads
+    return response
+
+
+class RateLimitedResponseTest(unittest.TestCase):
+    def get(self, responses, stream=False):
+        scheduler = GitHubRequestScheduler(max_retries=2)
+        scheduler._local.session = mock.Mock(get=mock.Mock(side_effect=responses))
+        with mock.patch("utils.github_scheduler.time.sleep"):
+            return scheduler.get("https://api.github.com/repos/o/r", stream=stream)
+
+    def test_rejected_response_is_closed_before_the_retry(self):
+        limited, ok = make_response(429, {"Retry-After": "1"}), make_response(200)
+        self.assertIs(self.get([limited, ok]), ok)
+        limited.close.assert_called_once()
+        ok.close.assert_not_called()
+
+    def test_large_streamed_body_is_not_read(self):
+        forbidden = make_response(403, {"Content-Length": str(MAX_RATE_LIMIT_BODY_BYTES + 1)})
+        self.assertIs(self.get([forbidden], stream=True), forbidden)
+        forbidden.text_reads.assert_not_called()
+
+    def test_small_streamed_rate_limit_body_is_classified(self):
+        limited, ok = make_response(403, {"Content-Length": "80"}), make_response(200)
+        self.assertIs(self.get([limited, ok], stream=True), ok)
+        limited.close.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import json
+import os
+import tempfile
+import unittest
+
+import requests
+
+from utils.http_cache import HttpMetadataCache
+
+
+def fake_fetch(body: bytes):
+    def fetch(url, headers=None, params=None, timeout=None):
+        response = requests.Response()
+        response.headers["ETag"] = '"v1"'
+        if (headers or {}).get("If-None-Match") == '"v1"':
+            response.status_code, response._content = 304, b""
+        else:
+            response.status_code, response._content = 200, body
+        return response
+    return fetch
+
+
+class HttpMetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def test_bodies_stay_out_of_the_index_and_replay_on_304(self):
+        cache = HttpMetadataCache(self.cache_dir)
+        cache.get("https://api.github.com/x", fetch=fake_fetch(b"payload"))
+        cache.save()
+        with open(cache.cache_file, encoding="utf-8") as f:
+            self.assertNotIn("payload", f.read())
+
+        response = HttpMetadataCache(self.cache_dir).get("https://api.github.com/x", fetch=fake_fetch(b"other"))
+        self.assertEqual((response.status_code, response.content), (200, b"payload"))
+
+    def test_least_recently_used_bodies_are_evicted_beyond_the_cap(self):
+        cache = HttpMetadataCache(self.cache_dir, max_bytes=10)
+        for url in ("a", "b", "c"):
+            cache.get(url, fetch=fake_fetch(b"12345"))
+        cache.save()
+        self.assertEqual(sorted(cache.entries), ["b", "c"])
+        self.assertFalse(os.path.exists(cache._body_path("a")))
+        with open(cache.cache_file, encoding="utf-8") as f:
+            self.assertEqual(sorted(json.load(f)), ["b", "c"])
+
+    def test_missing_body_file_is_fetched_without_validators(self):
+        cache = HttpMetadataCache(self.cache_dir)
+        cache.get("a", fetch=fake_fetch(b"payload"))
+        os.remove(cache._body_path("a"))
+        response = cache.get("a", fetch=fake_fetch(b"fresh"))
+        self.assertEqual((response.status_code, response.content), (200, b"fresh"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import time
+import unittest
+
+from utils.llm_failover import CircuitBreaker, CircuitOpenError, FailoverCaller
+
+PRIMARY = ("GENERIC", "primary")
+SECONDARY = ("GENERIC", "secondary")
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def test_rate_limited_trial_frees_the_half_open_breaker(self):
+        outcomes = [HTTPError(500), HTTPError(429), "ok"]
+
+        def call(provider, model, prompt, timeout):
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        caller = FailoverCaller(call, breaker=CircuitBreaker(failure_threshold=1, cooldown=0.05))
+        with self.assertRaises(HTTPError):
+            caller("prompt", PRIMARY)
+        with self.assertRaises(CircuitOpenError):
+            caller("prompt", PRIMARY)
+        time.sleep(0.06)
+        # The half-open trial is rate limited: no verdict on the route, so its trial slot is freed
+        with self.assertRaises(HTTPError):
+            caller("prompt", PRIMARY)
+        self.assertEqual(caller.breaker.state(PRIMARY), "half-open")
+        self.assertEqual(caller("prompt", PRIMARY), (PRIMARY, "ok"))
+        self.assertEqual(caller.breaker.state(PRIMARY), "closed")
+
+    def test_released_permit_frees_only_its_own_trial(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record_failure(SECONDARY)
+        time.sleep(0.06)
+        permit = breaker.allow(SECONDARY)
+        self.assertTrue(permit)
+        self.assertFalse(breaker.allow(SECONDARY))
+        # A closed-breaker permit does not touch another call's trial
+        breaker.release(SECONDARY, True)
+        self.assertFalse(breaker.allow(SECONDARY))
+        # A hedge cancelled before it started hands its trial back
+        breaker.release(SECONDARY, permit)
+        self.assertTrue(breaker.allow(SECONDARY))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+import requests
+
+from utils.llm_keys import LLMKeyPool
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"HTTP {status}", response=response)
+
+
+class AuthCooldownTest(unittest.TestCase):
+    def test_single_key_is_not_benched_by_a_rejection(self):
+        pool = LLMKeyPool("OPENROUTER", ["only-key"])
+        key = pool.acquire(model="m")
+        self.assertFalse(pool.release(key, http_error(403), model="m"))
+        self.assertEqual(pool.acquire(timeout=0, model="m"), "only-key")
+
+    def test_rejected_key_rests_for_that_model_only(self):
+        pool = LLMKeyPool("GEMINI", ["key-a", "key-b"])
+        self.assertEqual(pool.acquire(model="m1"), "key-a")
+        self.assertTrue(pool.release("key-a", http_error(401), model="m1"))
+        self.assertEqual(pool.acquire(timeout=0, model="m1"), "key-b")
+        self.assertEqual(pool.acquire(timeout=0, model="m2"), "key-a")
+
+    def test_last_key_usable_for_a_model_is_not_benched(self):
+        pool = LLMKeyPool("GEMINI", ["key-a", "key-b"])
+        pool.acquire(model="m")
+        self.assertTrue(pool.release("key-a", http_error(403), model="m"))
+        pool.acquire(model="m")
+        self.assertFalse(pool.release("key-b", http_error(403), model="m"))
+        self.assertEqual(pool.acquire(timeout=0, model="m"), "key-b")
+
+
+if __name__ == "__main__":
+    unittest.main()
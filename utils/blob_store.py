@@ -0,0 +1,101 @@
+"""
+Content-addressed blob store keyed by git blob SHA.
+
+GitHub reports the git blob ``sha`` of every file in the Contents and Trees
+APIs. That SHA depends only on the file bytes, so the same blob is shared by
+every branch, commit and fork that contains it. Storing downloaded bytes under
+their SHA lets later crawls reuse them instead of downloading them again.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Root directory for on-disk crawl caches (blobs, HTTP metadata, ...)
+DEFAULT_CACHE_DIR = os.getenv("CRAWL_CACHE_DIR", ".crawl_cache")
+
+
+def git_blob_sha(data: bytes) -> str:
+    """Compute the git blob SHA-1 of raw file bytes (same as `git hash-object`)."""
+    header = f"blob {len(data)}\0".encode("ascii")
+    return hashlib.sha1(header + data).hexdigest()
+
+
+class BlobMissingError(LookupError):
+    """Raised when a blob that a crawled file refers to is no longer in the store."""
+
+
+class BlobStore:
+    """
+    On-disk store of file contents addressed by git blob SHA.
+
+    Blobs live at ``<cache_dir>/blobs/<sha[:2]>/<sha[2:]>`` so a single store
+    can be shared by every crawl, regardless of repository or ref.
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.root = os.path.join(cache_dir or DEFAULT_CACHE_DIR, "blobs")
+
+    def path_for(self, sha: str) -> str:
+        return os.path.join(self.root, sha[:2], sha[2:])
+
+    def has(self, sha: str) -> bool:
+        return bool(sha) and os.path.exists(self.path_for(sha))
+
+    def get(self, sha: str):
+        """Return the stored bytes for `sha`, or None on a miss."""
+        if not sha:
+            return None
+        try:
+            with open(self.path_for(sha), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Failed to read blob {sha}: {e}")
+            return None
+
+    def load_text(self, sha: str, path: str = None) -> str:
+        """
+        Return the stored blob decoded as UTF-8 (invalid bytes replaced).
+
+        Raises:
+            BlobMissingError: If the blob was evicted or deleted since it was stored
+        """
+        data = self.get(sha)
+        if data is None:
+            raise BlobMissingError(
+                f"Blob {sha}{f' of {path}' if path else ''} is no longer in the crawl cache ({self.root}); "
+                f"it was removed after the crawl, so crawl the repository again")
+        return data.decode("utf-8", errors="replace")
+
+    def put(self, sha: str, data: bytes) -> bool:
+        """
+        Store `data` under `sha`.
+
+        The bytes are only stored if they hash to `sha`, so a truncated or
+        transformed download (e.g. a Git LFS pointer) never poisons the store.
+        Returns True if the blob is present in the store afterwards.
+        """
+        if not sha:
+            return False
+        if git_blob_sha(data) != sha:
+            logger.warning(f"Not caching blob {sha}: content hash mismatch")
+            return False
+        path = self.path_for(sha)
+        if os.path.exists(path):
+            return True
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so concurrent readers never see partial blobs
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"Failed to write blob {sha}: {e}")
+            return False
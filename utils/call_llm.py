@@ -1,15 +1,35 @@
 """
 LLM Wrapper - Supports multiple providers (Gemini, OpenAI, OpenRouter, and generic OpenAI-compatible APIs)
+
+Each node can be routed to its own provider and model (see `resolve_route`),
+e.g. a fast model for the structural steps and a strong one for chapters.
+Nodes with validated output can also cascade (see `call_llm_cascade`): a fast
+model answers first, and the node's own model only when validation fails.
+A node with a hedge route sends a duplicate request there when its own route
+is slow or failing (see utils/llm_failover.py). Every request has a timeout
+derived from the run's time budgets (see utils/deadlines.py), and requests to
+a provider are capped by an adaptive concurrency limit (see
+utils/llm_concurrency.py) and spread over the provider's API keys (see
+utils/llm_keys.py).
 """
 
 from google import genai
+from google.genai import types
 import os
+import re
 import logging
 import json
 import requests
 import sys
+import time
+import yaml
 from datetime import datetime
+from functools import lru_cache
 from dotenv import load_dotenv, find_dotenv
+from utils import deadlines, llm_metrics
+from utils.llm_concurrency import get_limiter
+from utils.llm_failover import FailoverCaller
+from utils.llm_keys import get_key_pool, keys_from_env
 
 # Load environment variables
 load_dotenv()
@@ -37,6 +57,18 @@ if not logger.handlers:
 # Simple cache configuration
 cache_file = "llm_cache.json"
 
+# Provider -> (env var holding its default model, fallback model)
+DEFAULT_MODELS = {
+    "GEMINI": ("GEMINI_MODEL", "gemini-2.5-pro-exp-03-25"),
+    "OPENROUTER": ("OPENROUTER_MODEL", "openai/gpt-3.5-turbo"),
+    "OPENAI": ("OPENAI_MODEL", "gpt-3.5-turbo"),
+    "GENERIC": ("LLM_MODEL", "llama2"),
+}
+# Per-node routes file (YAML or JSON), see resolve_route
+ROUTES_FILE = os.getenv("LLM_ROUTES_FILE", "llm_routes.yaml")
+# Hedging and circuit breakers shared by all calls of the run, see _get_failover
+_failover = None
+
 
 def load_cache() -> dict:
     """Load cache from disk."""
@@ -63,16 +95,16 @@ def get_llm_provider() -> str:
     Determine which LLM provider to use based on environment variables.
     
     Priority:
-    1. GEMINI_API_KEY or GEMINI_PROJECT_ID -> "GEMINI"
-    2. OPENROUTER_API_KEY -> "OPENROUTER"
-    3. OPENAI_API_KEY -> "OPENAI"
+    1. GEMINI_API_KEY(S) or GEMINI_PROJECT_ID -> "GEMINI"
+    2. OPENROUTER_API_KEY(S) -> "OPENROUTER"
+    3. OPENAI_API_KEY(S) -> "OPENAI"
     4. LLM_API_BASE_URL -> "GENERIC"
     """
-    if os.getenv("GEMINI_API_KEY") or os.getenv("GEMINI_PROJECT_ID"):
+    if keys_from_env("GEMINI") or os.getenv("GEMINI_PROJECT_ID"):
         return "GEMINI"
-    elif os.getenv("OPENROUTER_API_KEY"):
+    elif keys_from_env("OPENROUTER"):
         return "OPENROUTER"
-    elif os.getenv("OPENAI_API_KEY"):
+    elif keys_from_env("OPENAI"):
         return "OPENAI"
     elif os.getenv("LLM_API_BASE_URL"):
         return "GENERIC"
@@ -84,63 +116,245 @@ def get_llm_provider() -> str:
         )
 
 
-def call_llm(prompt: str, use_cache: bool = True) -> str:
+def _parse_route(value) -> tuple:
+    """Parse "PROVIDER:model", "PROVIDER", "model" or {"provider": ..., "model": ...} into (provider, model)."""
+    if isinstance(value, dict):
+        provider = value.get("provider")
+        return (provider.upper() if provider else None), value.get("model")
+    value = str(value).strip()
+    head, _, rest = value.partition(":")
+    if head.upper() in DEFAULT_MODELS:
+        return head.upper(), rest or None
+    return None, value or None  # Model names may contain ':' themselves (e.g. "llama3:8b")
+
+
+@lru_cache(maxsize=1)
+def _load_routes_file(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            routes = yaml.safe_load(f) or {}  # YAML is a superset of JSON
+        sections = {kind: routes.pop(kind, None) or {} for kind in ("cascade", "hedge")}
+        sections["route"] = routes
+        return {
+            kind: {str(node): _parse_route(route) for node, route in section.items()}
+            for kind, section in sections.items()
+        }
+    except Exception as e:
+        logger.warning(f"Failed to load LLM routes from {path}: {e}")
+        return {}
+
+
+def resolve_route(node: str = None, kind: str = "route"):
+    """
+    Provider and model to use for a node.
+
+    Routes come from the environment, `LLM_ROUTE_<NODE>` (node name in upper
+    snake case, e.g. `LLM_ROUTE_ORDER_CHAPTERS=OPENAI:gpt-4o-mini`), or from the
+    routes file (`LLM_ROUTES_FILE`, default `llm_routes.yaml`), mapping node
+    names and `default` to "PROVIDER:model" strings or {provider, model} maps.
+    The environment wins. Unrouted nodes use get_llm_provider() and that
+    provider's `*_MODEL` variable.
+
+    The fast first tier of a cascade and the secondary route for hedged
+    requests are configured the same way, with `LLM_CASCADE_<NODE>` /
+    `LLM_HEDGE_<NODE>` (and `_DEFAULT`) or a `cascade:` / `hedge:` section of
+    the routes file.
+
+    Args:
+        node: Node name, e.g. "OrderChapters" (None for the default route)
+        kind: "route" for the node's main route, "cascade" or "hedge"
+
+    Returns:
+        (provider, model) tuple, or None for a cascade or hedge route that is not configured
+    """
+    routes = _load_routes_file(ROUTES_FILE).get(kind, {})
+    provider, model = None, None
+    configured = False
+    for name in ("default", node):
+        if not name:
+            continue
+        env_value = os.getenv(f"LLM_{kind.upper()}_" + re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", name).upper())
+        route = _parse_route(env_value) if env_value else routes.get(name)
+        if route:
+            # A route naming only a model keeps the provider chosen so far, and vice versa
+            provider = route[0] or provider
+            model = route[1]
+            configured = True
+    if kind != "route" and not configured:
+        return None
+    provider = provider or get_llm_provider()
+    if provider not in DEFAULT_MODELS:
+        raise ValueError(f"Unknown LLM provider '{provider}' (expected one of: {', '.join(DEFAULT_MODELS)})")
+    if not model:
+        env_var, fallback = DEFAULT_MODELS[provider]
+        model = os.getenv(env_var, fallback)
+    return provider, model
+
+
+def call_llm(prompt: str, use_cache: bool = True, node: str = None, route: tuple = None) -> str:
     """
     Main LLM calling function that routes to the appropriate provider.
     
     Args:
         prompt: The prompt to send to the LLM
         use_cache: Whether to use caching (default: True)
+        node: Name of the calling node, used to pick its provider and model (see resolve_route)
+        route: (provider, model) to use instead of the node's route
         
     Returns:
         The LLM response text
     """
     logger.info(f"PROMPT: {prompt}")
 
+    # Get provider and model for this node
+    provider, model = route or resolve_route(node)
+    default_route = resolve_route() == (provider, model)
+    logger.info(f"ROUTE: {node or 'default'} -> {provider}/{model}")
+    # Cache entries are scoped by model, so switching a node's model does not reuse other models' answers
+    cache_key = f"[{provider}/{model}] {prompt}"
+
     # Check cache if enabled
     if use_cache:
         cache = load_cache()
-        if prompt in cache:
+        if cache_key in cache:
+            logger.info("CACHE HIT: Using cached response")
+            return cache[cache_key]
+        if default_route and prompt in cache:
+            # Entries written before caching was scoped by model belong to the default route
             logger.info("CACHE HIT: Using cached response")
             return cache[prompt]
 
-    # Get provider and call appropriate function
-    provider = get_llm_provider()
-    
-    if provider == "GEMINI":
-        response_text = _call_llm_gemini(prompt)
-    elif provider == "OPENROUTER":
-        response_text = _call_llm_openrouter(prompt)
-    elif provider == "OPENAI":
-        response_text = _call_llm_openai(prompt)
-    else:  # GENERIC - OpenAI-compatible API
-        response_text = _call_llm_generic(prompt)
-
-    logger.info(f"RESPONSE: {response_text}")
-
-    # Update cache if enabled
+    # A slow or failing route is hedged by / failed over to the node's hedge route, if any.
+    # The timeout is what is left of the node's and the run's budgets (raises once they are spent)
+    (answered_provider, answered_model), response_text = _get_failover()(
+        prompt, (provider, model), resolve_route(node, kind="hedge"), node=node,
+        timeout=deadlines.timeout_for(node),
+    )
+
+    logger.info(f"RESPONSE ({answered_provider}/{answered_model}): {response_text}")
+
+    # Update cache if enabled; a hedge's answer is stored under the key this call looks up
+    # (its primary route), so the next identical call is served from the cache
     if use_cache:
         cache = load_cache()
-        cache[prompt] = response_text
+        cache[cache_key] = response_text
         save_cache(cache)
 
     return response_text
 
 
-def _call_llm_gemini(prompt: str) -> str:
+def call_llm_cascade(prompt: str, validate, use_cache: bool = True, node: str = None):
+    """
+    Call the node's fast cascade model first and escalate to its own model only
+    if the fast answer fails validation (or the fast call fails).
+
+    Without a cascade route for the node, this is `validate(call_llm(...))`.
+    Every call counts in the "cascade_calls" metric and every escalation in
+    "cascade_escalations" (see utils/llm_metrics.py).
+
+    Args:
+        prompt: The prompt to send to the LLM
+        validate: Parses and validates a response, raising on invalid output; its result is returned
+        use_cache: Whether to use caching (default: True)
+        node: Name of the calling node
+
+    Returns:
+        The value returned by `validate`
+    """
+    fast = resolve_route(node, kind="cascade")
+    strong = resolve_route(node)
+    if fast is None or fast == strong:
+        return validate(call_llm(prompt, use_cache=use_cache, node=node))
+
+    llm_metrics.increment("cascade_calls", node)
+    try:
+        return validate(call_llm(prompt, use_cache=use_cache, node=node, route=fast))
+    except deadlines.DeadlineExceeded:
+        raise
+    except Exception as e:
+        llm_metrics.increment("cascade_escalations", node)
+        logger.info(f"CASCADE: {node} output from {fast[0]}/{fast[1]} rejected ({e}), escalating to {strong[0]}/{strong[1]}")
+        print(f"{node}: fast model output rejected ({e}); retrying with {strong[1]}...")
+        return validate(call_llm(prompt, use_cache=use_cache, node=node))
+
+
+def _get_failover() -> FailoverCaller:
+    global _failover
+    if _failover is None:
+        # Looked up at call time, so the provider function can be swapped (e.g. by a stub)
+        _failover = FailoverCaller.from_env(
+            lambda provider, model, prompt, timeout: _limited_call(provider, model, prompt, timeout)
+        )
+    return _failover
+
+
+def _limited_call(provider: str, model: str, prompt: str, timeout: float = None) -> str:
+    """Call the provider within its adaptive concurrency limit; waiting for a slot counts against `timeout`."""
+    waiting_since = time.monotonic()
+    # Latencies are compared between calls to the same model with prompts of similar size
+    with get_limiter(provider).slot(timeout, latency_key=(model, len(prompt).bit_length())):
+        if timeout is not None:
+            timeout = max(timeout - (time.monotonic() - waiting_since), 0.1)
+        return _call_provider(provider, model, prompt, timeout)
+
+
+def _call_provider(provider: str, model: str, prompt: str, timeout: float = None) -> str:
+    """
+    Send one prompt to `model` on `provider`, giving up after `timeout` seconds.
+
+    The request uses the provider's key with the most headroom; if that key is
+    rate-limited or rejected, it is put to rest and the prompt goes out again
+    with one of the other keys.
+    """
+    pool = get_key_pool(provider)
+    end = None if timeout is None else time.monotonic() + timeout
+    tried = []
+    while True:
+        api_key = pool.acquire(None if end is None else max(end - time.monotonic(), 0), exclude=tried, model=model)
+        remaining = None if end is None else max(end - time.monotonic(), 0.1)
+        try:
+            if provider == "GEMINI":
+                response_text = _call_llm_gemini(prompt, model, remaining, api_key)
+            elif provider == "OPENROUTER":
+                response_text = _call_llm_openrouter(prompt, model, remaining, api_key)
+            elif provider == "OPENAI":
+                response_text = _call_llm_openai(prompt, model, remaining, api_key)
+            else:  # GENERIC - OpenAI-compatible API
+                response_text = _call_llm_generic(prompt, model, remaining, api_key)
+        except Exception as e:
+            if not pool.release(api_key, e, model) or len(tried) + 1 >= len(pool):
+                raise
+            tried.append(api_key)
+            continue
+        pool.release(api_key, model=model)
+        return response_text
+
+
+def _requests_timeout(timeout: float):
+    """(connect, read) timeout for `requests`; the read timeout bounds the wait for the response."""
+    timeout = timeout or deadlines.DEFAULT_CALL_TIMEOUT
+    return min(deadlines.CONNECT_TIMEOUT, timeout), timeout
+
+
+def _call_llm_gemini(prompt: str, model: str = None, timeout: float = None, api_key: str = None) -> str:
     """Call Google Gemini API."""
+    # The SDK takes its timeout in milliseconds
+    http_options = types.HttpOptions(timeout=int((timeout or deadlines.DEFAULT_CALL_TIMEOUT) * 1000))
     if os.getenv("GEMINI_PROJECT_ID"):
         client = genai.Client(
             vertexai=True,
             project=os.getenv("GEMINI_PROJECT_ID"),
-            location=os.getenv("GEMINI_LOCATION", "us-central1")
+            location=os.getenv("GEMINI_LOCATION", "us-central1"),
+            http_options=http_options,
         )
-    elif os.getenv("GEMINI_API_KEY"):
-        client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+    elif api_key or os.getenv("GEMINI_API_KEY"):
+        client = genai.Client(api_key=api_key or os.getenv("GEMINI_API_KEY"), http_options=http_options)
     else:
         raise ValueError("Either GEMINI_PROJECT_ID or GEMINI_API_KEY must be set")
     
-    model = os.getenv("GEMINI_MODEL", "gemini-2.5-pro-exp-03-25")
+    model = model or os.getenv("GEMINI_MODEL", "gemini-2.5-pro-exp-03-25")
     response = client.models.generate_content(
         model=model,
         contents=[prompt]
@@ -148,20 +362,21 @@ def _call_llm_gemini(prompt: str) -> str:
     return response.text
 
 
-def _call_llm_openai(prompt: str) -> str:
+def _call_llm_openai(prompt: str, model: str = None, timeout: float = None, api_key: str = None) -> str:
     """Call OpenAI API directly."""
     try:
         from openai import OpenAI
     except ImportError:
         raise ImportError("OpenAI package not installed. Run: pip install openai")
     
-    api_key = os.getenv("OPENAI_API_KEY")
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise ValueError("OPENAI_API_KEY environment variable not set")
     
-    model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+    model = model or os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
     
-    client = OpenAI(api_key=api_key)
+    # No SDK retries: they would outlast the timeout, and the nodes retry failed calls themselves
+    client = OpenAI(api_key=api_key, timeout=timeout or deadlines.DEFAULT_CALL_TIMEOUT, max_retries=0)
     response = client.chat.completions.create(
         model=model,
         messages=[{"role": "user", "content": prompt}],
@@ -171,13 +386,13 @@ def _call_llm_openai(prompt: str) -> str:
     return response.choices[0].message.content
 
 
-def _call_llm_openrouter(prompt: str) -> str:
+def _call_llm_openrouter(prompt: str, model: str = None, timeout: float = None, api_key: str = None) -> str:
     """Call OpenRouter API."""
-    api_key = os.getenv("OPENROUTER_API_KEY")
+    api_key = api_key or os.getenv("OPENROUTER_API_KEY")
     if not api_key:
         raise ValueError("OPENROUTER_API_KEY environment variable not set")
     
-    model = os.getenv("OPENROUTER_MODEL", "openai/gpt-3.5-turbo")
+    model = model or os.getenv("OPENROUTER_MODEL", "openai/gpt-3.5-turbo")
     base_url = "https://openrouter.ai/api/v1/chat/completions"
     
     headers = {
@@ -193,16 +408,16 @@ def _call_llm_openrouter(prompt: str) -> str:
         "temperature": 0.7,
     }
     
-    response = requests.post(base_url, headers=headers, json=payload)
+    response = requests.post(base_url, headers=headers, json=payload, timeout=_requests_timeout(timeout))
     response.raise_for_status()
     return response.json()["choices"][0]["message"]["content"]
 
 
-def _call_llm_generic(prompt: str) -> str:
+def _call_llm_generic(prompt: str, model: str = None, timeout: float = None, api_key: str = None) -> str:
     """Call a generic OpenAI-compatible API (e.g., Ollama, local models)."""
     base_url = os.getenv("LLM_API_BASE_URL", "http://localhost:11434")
-    api_key = os.getenv("LLM_API_KEY", "")  # Optional for local models
-    model = os.getenv("LLM_MODEL", "llama2")
+    api_key = api_key or os.getenv("LLM_API_KEY", "")  # Optional for local models
+    model = model or os.getenv("LLM_MODEL", "llama2")
     
     url = f"{base_url.rstrip('/')}/v1/chat/completions"
     
@@ -217,18 +432,19 @@ def _call_llm_generic(prompt: str) -> str:
     }
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
+        response = requests.post(url, headers=headers, json=payload, timeout=_requests_timeout(timeout))
         response.raise_for_status()
         return response.json()["choices"][0]["message"]["content"]
     except requests.exceptions.RequestException as e:
-        raise Exception(f"Error calling LLM API at {url}: {e}")
+        # Chained, so the HTTP status stays visible to the concurrency limiter
+        raise Exception(f"Error calling LLM API at {url}: {e}") from e
 
 
 if __name__ == "__main__":
     """Test the LLM configuration."""
     try:
-        provider = get_llm_provider()
-        print(f"Using LLM provider: {provider}")
+        provider, model = resolve_route()
+        print(f"Using LLM provider: {provider} ({model})")
         
         test_prompt = "Say hello in one sentence."
         print(f"Testing with prompt: {test_prompt}")
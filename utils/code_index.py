@@ -0,0 +1,231 @@
+"""
+Local lexical index over symbol-level code chunks.
+
+A chapter prompt used to carry the full text of every file of its
+abstraction, although usually only a few classes or functions of those files
+matter. `CodeIndex` splits every crawled file into chunks at its
+declarations (top-level classes and functions, then methods of chunks that
+are still too long; headings for Markdown), indexes their identifiers with
+BM25, and `select` picks the chunks that best match an abstraction's name and
+description within a character budget. Files the abstraction lists are
+favoured, but matching code in other files is found too. Everything runs
+locally: no embeddings, no network.
+"""
+
+import math
+import posixpath
+import re
+
+from utils.large_files import is_outline_line
+
+# Default character budget for the code in one chapter prompt
+DEFAULT_CHAPTER_CONTEXT_CHARS = 40000
+# Chunks longer than this are split again at their nested declarations
+MAX_CHUNK_LINES = 80
+# Consecutive chunks shorter than this are merged (constants, small helpers)
+MIN_CHUNK_LINES = 12
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Terms of a chunk's own declaration line count this many times
+SYMBOL_WEIGHT = 3
+# Chunks of the files an abstraction lists score this much higher...
+LISTED_FILE_BOOST = 2.0
+# ...and are worth this share of the best score even without matching terms
+LISTED_FILE_FLOOR = 0.05
+# Each slice also carries a header line in the prompt
+SLICE_OVERHEAD = 64
+
+_TEXT_EXTENSIONS = {".md", ".markdown", ".rst", ".txt"}
+# Declarations that never start a chunk; decorators and comments attach to the declaration below them
+_NOT_BOUNDARY = re.compile(r"^\s*(?:import\b|from\s+\S+\s+import\b|using\b|#include\b|#define\b|package\b|@)")
+_ATTACHED = re.compile(r"^\s*(?:@|#(?!include|define)|//|/\*|\*|--)")
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_WORD_PARTS = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "each", "for", "from", "has", "how",
+    "in", "into", "is", "it", "its", "like", "of", "on", "or", "that", "the", "their", "them",
+    "this", "to", "uses", "using", "what", "when", "which", "with", "you", "your",
+}
+
+
+def _stem(term: str) -> str:
+    if len(term) > 3 and term.endswith("s") and not term.endswith("ss"):
+        return term[:-1]
+    return term
+
+
+def tokenize(text: str):
+    """Lower-cased terms of `text`: every identifier, plus its camelCase / snake_case parts."""
+    terms = []
+    for identifier in _IDENTIFIER.findall(text):
+        parts = _WORD_PARTS.findall(identifier)
+        if len(identifier) > 1:
+            terms.append(_stem(identifier.lower()))
+        if len(parts) > 1:
+            terms += [_stem(part.lower()) for part in parts if len(part) > 1]
+    return terms
+
+
+def _is_boundary(line: str, text_file: bool) -> bool:
+    if text_file:
+        return is_outline_line(line, text_file=True)
+    return is_outline_line(line) and not _NOT_BOUNDARY.match(line)
+
+
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+
+def _split(lines, start, end, text_file, first=True):
+    """Split lines[start:end] at its least indented declarations, recursively for long pieces."""
+    if not first and end - start <= MAX_CHUNK_LINES:
+        return [(start, end)]
+    candidates = [n for n in range(start + 1, end) if lines[n].strip() and _is_boundary(lines[n], text_file)]
+    if first:
+        # The whole file: split at top-level declarations first
+        candidates = [n for n in candidates if _indent(lines[n]) == 0] or candidates
+    if not candidates:
+        if end - start <= MAX_CHUNK_LINES:
+            return [(start, end)]
+        return [(n, min(n + MAX_CHUNK_LINES, end)) for n in range(start, end, MAX_CHUNK_LINES)]
+    level = min(_indent(lines[n]) for n in candidates)
+    boundaries = [start]
+    for n in candidates:
+        if _indent(lines[n]) != level:
+            continue
+        # Keep decorators and the comment block above a declaration with it
+        while n - 1 > boundaries[-1] and _ATTACHED.match(lines[n - 1]):
+            n -= 1
+        if n > boundaries[-1]:
+            boundaries.append(n)
+    boundaries.append(end)
+    pieces = []
+    for piece_start, piece_end in zip(boundaries, boundaries[1:]):
+        if piece_end - piece_start > MAX_CHUNK_LINES and (piece_start, piece_end) != (start, end):
+            nested = _split(lines, piece_start, piece_end, text_file, first=False)
+            # A short class header (name, docstring, fields) stays with its first method
+            if len(nested) > 1 and nested[0][1] - nested[0][0] < MIN_CHUNK_LINES:
+                nested[:2] = [(nested[0][0], nested[1][1])]
+            pieces += nested
+        else:
+            pieces.append((piece_start, piece_end))
+    return pieces
+
+
+def split_chunks(text: str, path: str):
+    """
+    Split a file into symbol-level chunks.
+
+    Args:
+        text (str): File text
+        path (str): File path (its extension selects heading or declaration boundaries)
+
+    Returns:
+        list: (start line, end line) pairs, 0-based and end-exclusive, covering the whole file
+    """
+    lines = text.split("\n")
+    text_file = posixpath.splitext(path)[1].lower() in _TEXT_EXTENSIONS
+    chunks = []
+    for start, end in _split(lines, 0, len(lines), text_file):
+        # Merge runs of small chunks (constants, one-line helpers) up to a normal chunk size
+        if chunks and chunks[-1][1] == start and (
+                chunks[-1][1] - chunks[-1][0] < MIN_CHUNK_LINES or end - start < MIN_CHUNK_LINES) \
+                and end - chunks[-1][0] <= MAX_CHUNK_LINES:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+
+class CodeIndex:
+    """
+    BM25 index over the symbol-level chunks of every file in a FileStore.
+
+    Args:
+        files (FileStore): The crawled files
+        skip (iterable of int, optional): File indices not to index (e.g. collapsed duplicates)
+    """
+
+    def __init__(self, files, skip=()):
+        self.files = files
+        self.chunks = []  # (file index, start line, end line, size in chars)
+        self._postings = {}  # term -> {chunk id: term frequency}
+        self._lengths = []
+        skip = set(skip)
+        for index in range(len(files)):
+            if index in skip:
+                continue
+            path, text = files[index]
+            lines = text.split("\n")
+            text_file = posixpath.splitext(path)[1].lower() in _TEXT_EXTENSIONS
+            for start, end in split_chunks(text, path):
+                body = "\n".join(lines[start:end])
+                terms = tokenize(body)
+                # The chunk's own declaration weighs more than what it mentions
+                head = next((line for line in lines[start:end] if _is_boundary(line, text_file)), "")
+                terms += tokenize(head) * (SYMBOL_WEIGHT - 1)
+                if not terms:
+                    continue
+                chunk_id = len(self.chunks)
+                self.chunks.append((index, start, end, len(body)))
+                self._lengths.append(len(terms))
+                for term in terms:
+                    counts = self._postings.setdefault(term, {})
+                    counts[chunk_id] = counts.get(chunk_id, 0) + 1
+        self._average_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0
+
+    def score(self, query: str) -> dict:
+        """BM25 score of every chunk that shares a term with `query` (chunk id -> score)."""
+        scores = {}
+        total = len(self.chunks)
+        for term in set(tokenize(query)) - _STOPWORDS:
+            counts = self._postings.get(term)
+            if not counts:
+                continue
+            idf = math.log(1 + (total - len(counts) + 0.5) / (len(counts) + 0.5))
+            for chunk_id, frequency in counts.items():
+                length = self._lengths[chunk_id] / self._average_length
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (
+                    frequency + BM25_K1 * (1 - BM25_B + BM25_B * length))
+        return scores
+
+    def select(self, query: str, budget: int, listed_files=()):
+        """
+        Pick the chunks most relevant to `query` that fit `budget` characters.
+
+        Args:
+            query (str): Free text, e.g. an abstraction's name and description
+            budget (int): Character budget for the selected code (each slice also counts SLICE_OVERHEAD)
+            listed_files (iterable of int, optional): Files known to be related; their chunks are favoured
+
+        Returns:
+            list: (file index, start line, end line) slices, grouped by file (listed files first)
+                  and in line order, with adjacent chunks merged
+        """
+        listed_files = list(dict.fromkeys(listed_files))
+        listed = set(listed_files)
+        scores = self.score(query)
+        best = max(scores.values(), default=1.0)
+        for chunk_id, (index, _, _, _) in enumerate(self.chunks):
+            if index in listed:
+                scores[chunk_id] = scores.get(chunk_id, 0.0) * LISTED_FILE_BOOST + LISTED_FILE_FLOOR * best
+        selected = []
+        remaining = budget
+        for chunk_id in sorted(scores, key=lambda c: (-scores[c], c)):
+            size = self.chunks[chunk_id][3] + SLICE_OVERHEAD
+            if size <= remaining:
+                selected.append(chunk_id)
+                remaining -= size
+
+        # Listed files in their given order, then other files by their best chunk
+        file_order = {index: position for position, index in enumerate(listed_files)}
+        for chunk_id in selected:
+            file_order.setdefault(self.chunks[chunk_id][0], len(file_order))
+        slices = []
+        for index, start, end, _ in sorted((self.chunks[c] for c in selected),
+                                           key=lambda chunk: (file_order[chunk[0]], chunk[1])):
+            if slices and slices[-1][0] == index and slices[-1][2] == start:
+                slices[-1] = (index, slices[-1][1], end)
+            else:
+                slices.append((index, start, end))
+        return slices
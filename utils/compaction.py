@@ -0,0 +1,317 @@
+"""
+Compaction of file contents for prompts.
+
+Every prompt carries the files' license headers, comment banners, trailing
+whitespace and blank-line runs. `Compactor` removes them before the text is
+placed in a prompt, at one of three levels:
+
+- "off": the file text as crawled;
+- "whitespace": header comment blocks that repeat across files (licenses,
+  copyright banners) are dropped, trailing whitespace is removed and blank-line
+  runs are collapsed to one blank line;
+- "comments": additionally strips comments, language by language. Docstrings
+  and doc comments (`/** */`, `///`, `//!`, and comment blocks directly above
+  a declaration) are kept, as they explain what the code is for.
+
+Compacted texts are cached by content hash, so duplicate files and files that
+appear in several prompts are compacted once.
+"""
+
+import hashlib
+import io
+import posixpath
+import re
+import threading
+import tokenize
+from collections import OrderedDict
+
+from utils.large_files import is_outline_line
+
+COMPACTION_LEVELS = ("off", "whitespace", "comments")
+# Default level per node; stripping comments changes what the model reads, so it is opt-in (--compact)
+DEFAULT_LEVELS = {"abstractions": "whitespace", "relationships": "whitespace", "chapters": "whitespace"}
+# Header blocks are looked for in this many leading bytes of each file
+HEADER_SCAN_BYTES = 8192
+# A repeated header block shorter than this is not worth removing
+MIN_HEADER_CHARS = 20
+# Compacted texts kept in memory
+DEFAULT_MAX_CACHED_BYTES = 16 * 1024 * 1024
+
+_C_STYLE = {
+    ".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".hh", ".java", ".kt", ".kts", ".scala", ".go",
+    ".rs", ".swift", ".cs", ".js", ".jsx", ".ts", ".tsx", ".mjs", ".cjs", ".php", ".dart",
+    ".proto", ".groovy", ".gradle",
+}
+# Stylesheets only have /* */ comments; '//' appears in unquoted values such as url(http://...)
+_BLOCK_COMMENT_ONLY = {".css", ".scss", ".less"}
+# C-style languages where '...' is a string, not a character literal
+_SINGLE_QUOTE_STRINGS = {".js", ".jsx", ".ts", ".tsx", ".mjs", ".cjs", ".php", ".dart"}
+_BACKTICK_STRINGS = {".js", ".jsx", ".ts", ".tsx", ".mjs", ".cjs", ".go"}
+_HASH_STYLE = {
+    ".sh", ".bash", ".zsh", ".rb", ".yaml", ".yml", ".toml", ".pl", ".r", ".ps1", ".cfg",
+    ".conf", ".cmake", ".tf", ".nix", ".ex", ".exs", ".jl", "dockerfile", "makefile",
+}
+_DASH_STYLE = {".sql", ".lua", ".hs", ".elm"}
+_MARKUP = {".html", ".htm", ".xml", ".svg", ".xaml"}
+
+_HEADER_LINES = {
+    "c": re.compile(r"^\s*(?://|/\*|\*)"),
+    "hash": re.compile(r"^\s*#(?!!)"),
+    "dash": re.compile(r"^\s*--"),
+}
+_DIGITS = re.compile(r"\d+")
+_BLANK_RUNS = re.compile(r"\n{3,}")
+# Removed comments leave this marker behind until their lines are cleaned up
+_REMOVED = "\x00"
+_KEPT_C_COMMENT = re.compile(r"^(?:/\*\*(?!/)|/\*!|///|//!|//go:|// \+build)")
+_KEPT_HASH_COMMENT = re.compile(r"^#(?:!|\s*-\*-|\s*(?:type|noqa|pragma)\b)")
+
+
+def _language(path: str) -> str:
+    name = posixpath.basename(path.replace("\\", "/")).lower()
+    if name in ("dockerfile", "makefile"):
+        return name
+    return posixpath.splitext(name)[1]
+
+
+def _comment_style(language: str):
+    if language in (".py", ".pyi", ".pyx") or language in _HASH_STYLE:
+        return "hash"
+    if language in _C_STYLE or language in _BLOCK_COMMENT_ONLY:
+        return "c"
+    if language in _DASH_STYLE:
+        return "dash"
+    return None
+
+
+def _header_block(text: str, language: str):
+    """
+    The leading comment block of `text` (after a shebang line), as
+    (start offset, end offset, normalized block), or None.
+    """
+    style = _comment_style(language)
+    if style is None:
+        return None  # Prose and markup have no comment headers
+    header_line = _HEADER_LINES[style]
+    start = 0
+    if text.startswith("#!"):
+        start = text.find("\n") + 1 or len(text)
+    end = start
+    in_block = False
+    comment_lines = []
+    for line in text[start:].splitlines(keepends=True):
+        stripped = line.strip()
+        if in_block:
+            in_block = "*/" not in stripped
+        elif stripped and not header_line.match(line):
+            break
+        elif stripped.startswith("/*") and "*/" not in stripped[2:]:
+            in_block = True
+        if stripped:
+            comment_lines.append(stripped)
+        end += len(line)
+    if in_block or not comment_lines:
+        return None
+    # Copyright years differ from file to file
+    normalized = _DIGITS.sub("0", "\n".join(comment_lines))
+    if len(normalized) < MIN_HEADER_CHARS:
+        return None
+    return start, end, normalized
+
+
+def _header_key(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def find_boilerplate_headers(files) -> set:
+    """
+    Keys of the header comment blocks that repeat across files.
+
+    Args:
+        files (iterable): (path, text) pairs; the first HEADER_SCAN_BYTES of each text are enough
+
+    Returns:
+        set: Keys of header blocks found at the start of two or more files
+    """
+    seen, repeated = set(), set()
+    for path, text in files:
+        block = _header_block(text, _language(path))
+        if block is None:
+            continue
+        key = _header_key(block[2])
+        if key in seen:
+            repeated.add(key)
+        seen.add(key)
+    return repeated
+
+
+def _documents_declaration(text: str, end: int, marker: str) -> bool:
+    """True if the comment ending at `end` belongs to a comment block directly above a declaration."""
+    position = text.find("\n", end)
+    while position != -1:
+        line_end = text.find("\n", position + 1)
+        line = text[position + 1:line_end if line_end != -1 else len(text)]
+        stripped = line.strip()
+        if not stripped.startswith(marker):
+            return bool(stripped) and is_outline_line(line)
+        position = line_end
+    return False
+
+
+def _owns_line(text: str, start: int) -> bool:
+    """True if only whitespace precedes `start` on its line."""
+    return not text[text.rfind("\n", 0, start) + 1:start].strip()
+
+
+def _strip_c_comments(text: str, language: str) -> str:
+    single = r"'(?:\\.|[^'\\\n])*'" if language in _SINGLE_QUOTE_STRINGS else r"'(?:\\.|[^'\\\n]){1,4}'"
+    backtick = r"|`[^`]*`" if language in _BACKTICK_STRINGS else ""
+    pattern = re.compile(
+        r"(?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))|" + r'"(?:\\.|[^"\\\n])*"|' + single + backtick,
+        re.S,
+    )
+
+    def replace(match):
+        comment = match.group("comment")
+        if comment is None or _KEPT_C_COMMENT.match(comment):
+            return match.group(0)
+        if comment.startswith("//") and _owns_line(text, match.start()) \
+                and _documents_declaration(text, match.end(), "//"):
+            return comment
+        return _REMOVED
+
+    return pattern.sub(replace, text)
+
+
+def _strip_python_comments(text: str) -> str:
+    """Strip comments found by the tokenizer; strings (and so docstrings) are untouched."""
+    try:
+        tokens = list(tokenize.generate_tokens(io.StringIO(text).readline))
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return text  # Not valid Python; leave it as is rather than guess
+    lines = text.split("\n")
+    for token in reversed(tokens):
+        if token.type != tokenize.COMMENT:
+            continue
+        row, col = token.start
+        if _KEPT_HASH_COMMENT.match(token.string):
+            continue
+        line = lines[row - 1]
+        lines[row - 1] = line[:col] + _REMOVED + line[col + len(token.string):]
+    return "\n".join(lines)
+
+
+def _strip_line_comments(text: str, marker: str) -> str:
+    """Strip comments that take a whole line (markers inside strings cannot be told apart otherwise)."""
+    lines = text.split("\n")
+    line_end = -1
+    for number, line in enumerate(lines):
+        line_end += len(line) + 1
+        stripped = line.lstrip()
+        if not stripped.startswith(marker) or (marker == "#" and _KEPT_HASH_COMMENT.match(stripped)):
+            continue
+        if not _documents_declaration(text, line_end, marker):
+            lines[number] = _REMOVED
+    return "\n".join(lines)
+
+
+def _strip_comments(text: str, language: str) -> str:
+    if language in (".py", ".pyi", ".pyx"):
+        return _strip_python_comments(text)
+    if language in _C_STYLE:
+        return _strip_c_comments(text, language)
+    if language in _BLOCK_COMMENT_ONLY:
+        return re.sub(r"/\*.*?(?:\*/|\Z)", _REMOVED, text, flags=re.S)
+    if language in _HASH_STYLE:
+        return _strip_line_comments(text, "#")
+    if language in _DASH_STYLE:
+        return _strip_line_comments(text, "--")
+    if language in _MARKUP:
+        return re.sub(r"<!--.*?-->", _REMOVED, text, flags=re.S)
+    return text
+
+
+def compact_text(text: str, path: str, level: str = "whitespace", boilerplate=frozenset()) -> str:
+    """
+    Compact one file's text for a prompt.
+
+    Args:
+        text (str): File text
+        path (str): File path (its extension selects the comment syntax)
+        level (str): One of COMPACTION_LEVELS
+        boilerplate (set, optional): Keys of repeated header blocks to drop (see find_boilerplate_headers)
+
+    Returns:
+        str: The compacted text
+    """
+    if level == "off" or text.startswith("[Outline of "):
+        return text  # Outlines of large files are compact already
+    text = text.replace("\r\n", "\n")
+    block = _header_block(text[:HEADER_SCAN_BYTES], _language(path)) if boilerplate else None
+    if block and _header_key(block[2]) in boilerplate:
+        text = text[:block[0]] + text[block[1]:]
+    if level == "comments":
+        text = _strip_comments(text, _language(path))
+    lines = []
+    for line in text.split("\n"):
+        if _REMOVED in line:
+            line = line.replace(_REMOVED, "")
+            if not line.strip():
+                continue  # The line held nothing but comments
+        lines.append(line.rstrip())
+    return _BLANK_RUNS.sub("\n\n", "\n".join(lines)).strip("\n")
+
+
+class Compactor:
+    """
+    Compacts the files of a FileStore, caching the results by content hash.
+
+    Repeated header blocks are detected across all files of the store the first
+    time a file is compacted.
+
+    Args:
+        files (FileStore): The crawled files
+        max_cached_bytes (int): Upper bound on the compacted text kept in memory
+    """
+
+    def __init__(self, files, max_cached_bytes: int = DEFAULT_MAX_CACHED_BYTES):
+        self.files = files
+        self.max_cached_bytes = max_cached_bytes
+        self._boilerplate = None
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def boilerplate(self) -> set:
+        if self._boilerplate is None:
+            self._boilerplate = find_boilerplate_headers(
+                (self.files.path(i), self.files.raw(i)[:HEADER_SCAN_BYTES].decode("utf-8", errors="ignore"))
+                for i in range(len(self.files))
+            )
+        return self._boilerplate
+
+    def compact_slice(self, index: int, text: str, level: str = "whitespace") -> str:
+        """Compact part of the file at `index` (not cached; slices are rarely repeated)."""
+        return compact_text(text, self.files.path(index), level, self.boilerplate)
+
+    def compact(self, index: int, level: str = "whitespace") -> bytes:
+        """UTF-8 bytes of the compacted text of the file at `index`."""
+        raw = self.files.raw(index)
+        if level == "off":
+            return raw
+        path = self.files.path(index)
+        key = (hashlib.sha1(raw).hexdigest(), _language(path), level)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        compacted = compact_text(raw.decode("utf-8"), path, level, self.boilerplate).encode("utf-8")
+        with self._lock:
+            if key not in self._cache and len(compacted) <= self.max_cached_bytes:
+                self._cache[key] = compacted
+                self._cached_bytes += len(compacted)
+                while self._cached_bytes > self.max_cached_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cached_bytes -= len(evicted)
+        return compacted
@@ -0,0 +1,255 @@
+"""
+Content classifier for crawl candidates.
+
+Globs and size limits let through files that only waste context: lockfiles
+matching `*.yaml`/`*.json`, minified bundles, generated code, encoded data and
+binaries. The classifier rejects them from cheap evidence only:
+
+- the path: well-known lockfile names and the `linguist-generated` /
+  `linguist-vendored` attributes from `.gitattributes`;
+- the first `PREFIX_BYTES` of the content: NUL bytes (binary), invalid UTF-8,
+  "generated" header markers, line-length (minified) and byte-entropy
+  (encoded data) heuristics.
+
+Crawlers check the path before reading or downloading anything, and the
+prefix before reading the rest of the file, so rejected files are never read
+in full. Every rejection is recorded with its reason for the crawl stats.
+"""
+
+import codecs
+import math
+import posixpath
+import re
+import threading
+from collections import Counter
+
+from pathspec.patterns import GitWildMatchPattern
+
+# Bytes of each file inspected before deciding to read the rest
+PREFIX_BYTES = 8192
+
+LOCKFILE_NAMES = {
+    "package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml", "bun.lockb",
+    "poetry.lock", "Pipfile.lock", "uv.lock", "pdm.lock", "Cargo.lock", "Gemfile.lock",
+    "composer.lock", "go.sum", "flake.lock", "mix.lock", "pubspec.lock", "Podfile.lock",
+    "packages.lock.json", "gradle.lockfile",
+}
+
+# Standard headers that tools put at the start of a comment in generated files (checked in the
+# first lines only); comments and docstrings that merely mention generated code do not match
+_GENERATED_MARKER = re.compile(
+    r"(?m)^\s*(?:#+|//+|/\*+|\*|<!--|--|;+|\"\"\"|''')[ \t!]*(?:"
+    r"@generated\b"
+    r"|Code generated .* DO NOT EDIT\."
+    r"|(?i:generated by the protocol buffer compiler)"
+    r"|(?i:this file (?:is|was|has been) (?:automatically |auto-?)generated)"
+    r")"
+)
+_HEADER_LINES = 20
+
+# Prose keeps a paragraph per line, so line lengths say nothing about it (files without an
+# extension, like README or LICENSE, count as prose)
+PROSE_EXTENSIONS = {"", ".md", ".markdown", ".mdx", ".rst", ".txt", ".adoc", ".asciidoc", ".org", ".tex"}
+
+# Minified/bundled content: lines this long on average, or most of the text in lines
+# longer than LONG_LINE_LENGTH (one long line, like an embedded data URI, is not enough)
+MAX_AVERAGE_LINE_LENGTH = 300
+LONG_LINE_LENGTH = 500
+MAX_LONG_LINE_SHARE = 0.5
+# Prefixes shorter than this are too small to judge line lengths
+MIN_MINIFIED_CHECK_LENGTH = 1000
+# Bits per byte; source code is around 4.5-5.5, base64 and similar encodings approach 6
+MAX_ENTROPY = 5.9
+
+
+class ContentRejected(Exception):
+    """Raised by readers when a file's prefix is rejected; `reason` says why."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class GitAttributes:
+    """
+    `linguist-generated` / `linguist-vendored` lookup from .gitattributes files.
+
+    Args:
+        read_file (callable): Returns the text of a file by its path relative to the crawl
+                              root ("/" separators), or None if it does not exist. Each
+                              directory's `.gitattributes` is read once, when a path below it
+                              is first looked up.
+    """
+
+    def __init__(self, read_file):
+        self._read_file = read_file
+        self._rules = {}
+
+    @classmethod
+    def from_text(cls, text: str):
+        """Attributes from a single root `.gitattributes` (e.g. fetched from GitHub)."""
+        return cls(lambda path: text if path == ".gitattributes" else None)
+
+    def _rules_for(self, rel_dir: str):
+        if rel_dir not in self._rules:
+            rules = []
+            try:
+                text = self._read_file(posixpath.join(rel_dir, ".gitattributes") if rel_dir else ".gitattributes")
+            except Exception:
+                text = None
+            for line in (text or "").splitlines():
+                fields = line.split()
+                if not fields or fields[0].startswith("#"):
+                    continue
+                values = {}
+                for field in fields[1:]:
+                    if field.startswith("-"):
+                        values[field[1:]] = False
+                    elif field.startswith("!"):
+                        values[field[1:]] = None
+                    elif "=" in field:
+                        name, value = field.split("=", 1)
+                        values[name] = value.lower() not in ("false", "0")
+                    else:
+                        values[field] = True
+                if values:
+                    rules.append((GitWildMatchPattern(fields[0]), values))
+            self._rules[rel_dir] = rules
+        return self._rules[rel_dir]
+
+    def get(self, rel_path: str, attribute: str):
+        """Value of `attribute` for a file: True, False or None (unspecified)."""
+        parts = rel_path.split("/")
+        value = None
+        # Root first, so deeper .gitattributes files and later lines take precedence
+        for depth in range(len(parts)):
+            rel_dir = "/".join(parts[:depth])
+            relative = "/".join(parts[depth:])
+            for pattern, values in self._rules_for(rel_dir):
+                if attribute in values and pattern.match_file(relative):
+                    value = values[attribute]
+        return value
+
+
+def read_checked(stream, classifier, rel_path: str) -> bytes:
+    """
+    Read a binary stream, letting `classifier` reject it after the first PREFIX_BYTES.
+
+    Args:
+        stream: File-like object opened in binary mode
+        classifier (ContentClassifier, optional): If None, the stream is read in full
+        rel_path (str): File path, for the rejection record
+
+    Returns:
+        bytes: The whole content of an accepted file
+
+    Raises:
+        ContentRejected: The prefix was rejected; the rest of the stream is not read
+    """
+    if classifier is None:
+        return stream.read()
+    data = stream.read(PREFIX_BYTES)
+    rest = stream.read(1)
+    reason = classifier.reject_prefix(rel_path, data, complete=not rest)
+    if reason:
+        raise ContentRejected(reason)
+    if rest:
+        data += rest + stream.read()
+    return data
+
+
+def byte_entropy(data: bytes) -> float:
+    """Shannon entropy of `data` in bits per byte."""
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in Counter(data).values())
+
+
+class ContentClassifier:
+    """
+    Decides which candidate files are not worth reading and records why.
+
+    Args:
+        attributes (GitAttributes, optional): .gitattributes lookup for linguist overrides
+    """
+
+    def __init__(self, attributes: GitAttributes = None):
+        self.attributes = attributes
+        self.rejected = []
+        self._lock = threading.Lock()
+
+    def _reject(self, path: str, reason: str) -> str:
+        with self._lock:
+            self.rejected.append((path, reason))
+        return reason
+
+    def reject_path(self, rel_path: str, attributes_path: str = None, record: bool = True):
+        """
+        Reason to reject a file from its path alone, or None.
+
+        Args:
+            rel_path (str): File path, for the rejection record
+            attributes_path (str, optional): Path to look up in .gitattributes, if it is
+                                             relative to a different root than `rel_path`
+            record (bool): Record the rejection (False for dry runs such as cost estimates)
+        """
+        reason = None
+        if posixpath.basename(rel_path) in LOCKFILE_NAMES:
+            reason = "lockfile"
+        elif self.attributes is not None:
+            attributes_path = attributes_path or rel_path
+            if self.attributes.get(attributes_path, "linguist-generated"):
+                reason = "linguist-generated"
+            elif self.attributes.get(attributes_path, "linguist-vendored"):
+                reason = "linguist-vendored"
+        if reason and record:
+            self._reject(rel_path, reason)
+        return reason
+
+    def reject_prefix(self, rel_path: str, prefix: bytes, complete: bool = False):
+        """
+        Reason to reject a file from the start of its content, or None.
+
+        Args:
+            rel_path (str): File path, for the rejection record
+            prefix (bytes): Up to PREFIX_BYTES from the start of the file
+            complete (bool): True if `prefix` is the whole file
+        """
+        if b"\0" in prefix:
+            return self._reject(rel_path, "binary")
+        try:
+            text = codecs.getincrementaldecoder("utf-8")().decode(prefix, final=complete)
+        except UnicodeDecodeError:
+            return self._reject(rel_path, "not utf-8")
+
+        lines = text.split("\n")
+        if _GENERATED_MARKER.search("\n".join(lines[:_HEADER_LINES])):
+            return self._reject(rel_path, "generated")
+
+        # Line lengths are measured in characters, so text in multi-byte scripts is not penalized
+        if len(text) > MIN_MINIFIED_CHECK_LENGTH and posixpath.splitext(rel_path)[1].lower() not in PROSE_EXTENSIONS:
+            in_long_lines = sum(len(line) for line in lines if len(line) > LONG_LINE_LENGTH)
+            if (len(text) / len(lines) > MAX_AVERAGE_LINE_LENGTH
+                    or in_long_lines > MAX_LONG_LINE_SHARE * len(text)):
+                return self._reject(rel_path, "minified")
+
+        # Entropy is only meaningful for mostly-ASCII content (UTF-8 text in other scripts scores high)
+        if len(prefix) > 1000 and sum(byte >= 0x80 for byte in prefix) < len(prefix) // 10:
+            if byte_entropy(prefix) > MAX_ENTROPY:
+                return self._reject(rel_path, "encoded data")
+        return None
+
+    def stats(self) -> dict:
+        """Rejections for crawl statistics: the (path, reason) list and a count per reason."""
+        with self._lock:
+            return {
+                "rejected_files": list(self.rejected),
+                "rejection_counts": dict(Counter(reason for _, reason in self.rejected)),
+            }
+
+    def print_summary(self) -> None:
+        counts = self.stats()["rejection_counts"]
+        if counts:
+            details = ", ".join(f"{reason}: {count}" for reason, count in sorted(counts.items()))
+            print(f"Rejected {sum(counts.values())} files by content ({details})")
@@ -0,0 +1,73 @@
+"""
+Single-pass prompt context assembly.
+
+Prompt builders used to grow one string with `+=` or join freshly formatted
+per-file strings, copying every file body again for each prompt.
+`ContextBuilder` collects the pieces instead, as UTF-8 byte blocks taken
+from the `FileStore` arena (with cached per-file header + body blocks), and
+joins and decodes them once in `build()`. With a `Compactor`, file bodies are
+taken compacted (see utils/compaction.py) instead.
+"""
+
+
+class ContextBuilder:
+    """
+    Collects text and file blocks for one prompt context.
+
+    Args:
+        files (FileStore): Store the file indices refer to
+        compactor (Compactor, optional): Compacts file bodies before they are added
+        level (str): Compaction level passed to the compactor (default: "off")
+    """
+
+    def __init__(self, files, compactor=None, level: str = "off"):
+        self.files = files
+        self.compactor = compactor if level != "off" else None
+        self.level = level
+        self._parts = []
+
+    def add_text(self, text: str):
+        """Append literal text."""
+        if text:
+            self._parts.append(text.encode("utf-8"))
+        return self
+
+    def add_file(self, index: int, header: str = "", trailer: str = ""):
+        """Append one file's text, wrapped in an already formatted header and trailer."""
+        if self.compactor is None:
+            self._parts.append(self.files.block(index, header, trailer))
+            return self
+        self._parts += [header.encode("utf-8"), self.compactor.compact(index, self.level), trailer.encode("utf-8")]
+        return self
+
+    def add_lines(self, index: int, start: int, end: int, header: str = "", trailer: str = ""):
+        """Append lines `start` to `end` (0-based, end-exclusive) of one file's text."""
+        text = "\n".join(self.files.content(index).split("\n")[start:end])
+        if self.compactor is not None:
+            text = self.compactor.compact_slice(index, text, self.level)
+        self._parts += [header.encode("utf-8"), text.encode("utf-8"), trailer.encode("utf-8")]
+        return self
+
+    def add_files(self, indices, header: str, separator: str = "", trailer: str = ""):
+        """
+        Append several files, skipping out-of-range and repeated indices.
+
+        Args:
+            indices (list of int): File indices, in prompt order
+            header (str): Format string for each file's header; may use {index} and {path}
+            separator (str): Text placed between consecutive files
+            trailer (str): Text placed after each file
+        """
+        seen = set()
+        for index in indices:
+            if not (0 <= index < len(self.files)) or index in seen:
+                continue
+            if seen and separator:
+                self.add_text(separator)
+            seen.add(index)
+            self.add_file(index, header.format(index=index, path=self.files.path(index)), trailer)
+        return self
+
+    def build(self) -> str:
+        """Join all pieces and decode them in one pass."""
+        return b"".join(self._parts).decode("utf-8")
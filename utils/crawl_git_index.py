@@ -0,0 +1,331 @@
+"""
+Crawl a local git repository from its index or object database.
+
+Instead of walking the working tree, the file list and sizes come from the
+git index (the same data `git ls-files` reports), so untracked build output is
+never visited and enumeration is a single index read. With a `ref`, the files
+are read straight from the object database at that commit, which documents any
+branch, tag or commit without checking it out.
+"""
+
+import io
+import os
+import posixpath
+import stat
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import git
+
+from utils.blob_store import git_blob_sha
+from utils.content_classifier import ContentClassifier, ContentRejected, GitAttributes, read_checked
+from utils.file_records import FileRecord, collect_files
+from utils.large_files import CHUNK_BYTES, LARGE_FILE_LIMIT, outline_stream
+from utils.path_matcher import PathMatcher
+
+
+def _open_repo(directory):
+    """Open the repository containing `directory` and return (repo, prefix of directory inside it)."""
+    try:
+        repo = git.Repo(directory, search_parent_directories=True)
+    except (git.InvalidGitRepositoryError, git.NoSuchPathError):
+        raise ValueError(f"Not a git repository: {directory}")
+    if repo.bare:
+        raise ValueError(f"Bare repositories are not supported: {directory}")
+    prefix = os.path.relpath(os.path.realpath(directory), os.path.realpath(repo.working_tree_dir))
+    prefix = "" if prefix == "." else prefix.replace(os.sep, "/")
+    return repo, prefix
+
+
+def _under_prefix(path, prefix):
+    """Return `path` relative to `prefix`, or None if it lies outside of it."""
+    if not prefix:
+        return path
+    if path.startswith(prefix + "/"):
+        return path[len(prefix) + 1:]
+    return None
+
+
+def list_index_files(repo, prefix=""):
+    """
+    List regular files tracked in the git index.
+
+    Args:
+        repo (git.Repo): Repository to read the index from
+        prefix (str): Only list files below this repository-relative directory
+
+    Returns:
+        list: (repo_path, rel_path, size, binsha) tuples sorted by path. Sizes are the ones
+              recorded when the file was last staged; symlinks and submodules are skipped.
+    """
+    files = {}
+    for (path, stage), entry in repo.index.entries.items():
+        if not stat.S_ISREG(entry.mode):
+            continue
+        rel_path = _under_prefix(path, prefix)
+        # Unmerged paths have several stages; keep the lowest one
+        if rel_path is None or (path in files and files[path][4] <= stage):
+            continue
+        files[path] = (path, rel_path, entry.size, entry.binsha, stage)
+    return [item[:4] for _, item in sorted(files.items())]
+
+
+def list_commit_files(repo, commit, matcher, prefix=""):
+    """
+    List regular files in a commit's tree, pruning excluded directories.
+
+    Args:
+        repo (git.Repo): Repository holding the commit
+        commit (git.Commit): Commit whose tree is listed
+        matcher (PathMatcher): Directories it excludes are not descended
+        prefix (str): Only list files below this repository-relative directory
+
+    Returns:
+        list: (repo_path, rel_path, size, binsha) tuples in tree order.
+    """
+    tree = commit.tree
+    if prefix:
+        try:
+            tree = tree / prefix
+        except KeyError:
+            raise ValueError(f"Directory {prefix} does not exist at commit {commit.hexsha[:12]}")
+
+    def prune(item, depth):
+        if item.type != "tree":
+            return False
+        rel_dir = _under_prefix(item.path, prefix)
+        # The traversal also offers the starting tree itself, which is never pruned
+        return bool(rel_dir) and matcher.is_dir_excluded(rel_dir)
+
+    files = []
+    for item in tree.traverse(prune=prune, branch_first=False):
+        if item.type != "blob" or not stat.S_ISREG(item.mode):
+            continue
+        files.append((item.path, _under_prefix(item.path, prefix), item.size, item.binsha))
+    return files
+
+
+def iter_git_index(
+    directory,
+    ref=None,
+    include_patterns=None,
+    exclude_patterns=None,
+    max_file_size=None,
+    use_relative_paths=True,
+    max_workers=8,
+    content_filter=True,
+    outline_large_files=False,
+):
+    """
+    Generator variant of crawl_git_index that yields files as they are read.
+
+    Args:
+        Same as crawl_git_index.
+
+    Yields:
+        FileRecord: path, size, git blob SHA and text of each accepted file, in index
+                    (path) order. The text can be released and is read again on demand.
+
+    Returns:
+        dict: Crawl statistics (the generator's return value)
+    """
+    if not os.path.isdir(directory):
+        raise ValueError(f"Directory does not exist: {directory}")
+
+    repo, prefix = _open_repo(directory)
+    # Tracked files are authoritative, so .gitignore rules do not apply here
+    matcher = PathMatcher(include_patterns, exclude_patterns)
+
+    commit = None
+    if ref:
+        try:
+            commit = repo.commit(ref)
+        except (git.BadName, ValueError):
+            raise ValueError(f"Unknown git ref: {ref}")
+        entries = list_commit_files(repo, commit, matcher, prefix)
+        print(f"Reading {len(entries)} files from commit {commit.hexsha[:12]} ({ref})")
+    else:
+        entries = list_index_files(repo, prefix)
+        print(f"Reading {len(entries)} files from the git index of {repo.working_tree_dir}")
+
+    # The object database reader (a persistent `git cat-file` process) is not thread-safe
+    odb_lock = threading.Lock()
+
+    def read_blob(binsha):
+        with odb_lock:
+            return repo.odb.stream(binsha).read()
+
+    def read_file(repo_path, binsha, rel_path=None):
+        if commit is None:
+            try:
+                with open(os.path.join(repo.working_tree_dir, repo_path), "rb") as f:
+                    return read_checked(f, classifier if rel_path else None, rel_path)
+            except FileNotFoundError:
+                pass  # Deleted or sparse checkout: fall back to the staged blob
+        # `git cat-file` streams must be drained, so blobs are read whole and only then classified
+        return read_checked(io.BytesIO(read_blob(binsha)), classifier if rel_path else None, rel_path)
+
+    def read_text(repo_path, binsha, rel_path=None):
+        data = read_file(repo_path, binsha, rel_path)
+        return data.decode("utf-8-sig"), git_blob_sha(data)
+
+    def outline_file(repo_path, binsha, rel_path, size, classify=True):
+        checker = classifier if classify else None
+        if commit is None:
+            try:
+                with open(os.path.join(repo.working_tree_dir, repo_path), "rb") as f:
+                    return outline_stream(f, rel_path, size, max_file_size, checker), None
+            except FileNotFoundError:
+                pass
+        with odb_lock:
+            stream = repo.odb.stream(binsha)
+            try:
+                return outline_stream(stream, rel_path, size, max_file_size, checker), None
+            finally:
+                # Drain what the outline did not need, chunk by chunk, to keep `git cat-file` in sync
+                while stream.read(CHUNK_BYTES):
+                    pass
+
+    def read_attributes(repo_path):
+        if commit is None:
+            path = os.path.join(repo.working_tree_dir, repo_path)
+            if not os.path.isfile(path):
+                return None
+            with open(path, encoding="utf-8-sig") as f:
+                return f.read()
+        with odb_lock:
+            try:
+                blob = commit.tree / repo_path
+            except KeyError:
+                return None
+            return blob.data_stream.read().decode("utf-8-sig")
+
+    classifier = ContentClassifier(GitAttributes(read_attributes)) if content_filter else None
+
+    excluded_dirs = {}
+
+    def in_excluded_dir(rel_dir):
+        # Index entries are not pruned while listing, so check every ancestor directory once
+        if not rel_dir:
+            return False
+        if rel_dir not in excluded_dirs:
+            parent = rel_dir.rsplit("/", 1)[0] if "/" in rel_dir else ""
+            excluded_dirs[rel_dir] = in_excluded_dir(parent) or matcher.is_dir_excluded(rel_dir)
+        return excluded_dirs[rel_dir]
+
+    def finish(read):
+        future, index, repo_path, rel_path, relpath, size, binsha, outlined = read
+        try:
+            text, sha = future.result()
+        except ContentRejected as e:
+            print(f"\033[92mProgress: {index}/{len(entries)} {relpath} [skipped ({e.reason})]\033[0m")
+            return None
+        except Exception as e:
+            print(f"Warning: Could not read file {repo_path}: {e}")
+            print(f"\033[92mProgress: {index}/{len(entries)} {relpath} [skipped (read error)]\033[0m")
+            return None
+        if outlined:
+            outlined_files.append(rel_path)
+            print(f"\033[92mProgress: {index}/{len(entries)} {relpath} [outlined]\033[0m")
+            return FileRecord(relpath, size, None, text,
+                              loader=lambda: outline_file(repo_path, binsha, rel_path, size, classify=False)[0])
+        print(f"\033[92mProgress: {index}/{len(entries)} {relpath} [processed]\033[0m")
+        return FileRecord(relpath, size, sha, text, loader=lambda: read_text(repo_path, binsha)[0])
+
+    downloaded_count = skipped_count = 0
+    outlined_files = []
+    # In outline mode, files above max_file_size are reduced to outlines instead of skipped
+    size_limit = max(max_file_size, LARGE_FILE_LIMIT) if outline_large_files and max_file_size else max_file_size
+    in_flight = deque()
+    max_in_flight = max(max_workers, 1) * 4
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        for index, (repo_path, rel_path, size, binsha) in enumerate(entries, start=1):
+            relpath = rel_path.replace("/", os.sep) if use_relative_paths else os.path.join(directory, rel_path)
+            if in_excluded_dir(posixpath.dirname(rel_path)) or not matcher.should_include_file(rel_path):
+                status = "skipped (excluded)"
+            elif size_limit and size > size_limit:
+                status = "skipped (size limit)"
+            else:
+                reason = classifier.reject_path(rel_path, repo_path) if classifier else None
+                status = f"skipped ({reason})" if reason else None
+            if status:
+                skipped_count += 1
+                print(f"\033[92mProgress: {index}/{len(entries)} {relpath} [{status}]\033[0m")
+                continue
+
+            outlined = bool(max_file_size) and size > max_file_size
+            if outlined:
+                future = executor.submit(outline_file, repo_path, binsha, rel_path, size)
+            else:
+                future = executor.submit(read_text, repo_path, binsha, rel_path)
+            in_flight.append((future, index, repo_path, rel_path, relpath, size, binsha, outlined))
+            # Yield finished reads from the head of the queue to keep index order
+            while in_flight and (len(in_flight) >= max_in_flight or in_flight[0][0].done()):
+                record = finish(in_flight.popleft())
+                if record is None:
+                    skipped_count += 1
+                    continue
+                downloaded_count += 1
+                yield record
+
+        while in_flight:
+            record = finish(in_flight.popleft())
+            if record is None:
+                skipped_count += 1
+                continue
+            downloaded_count += 1
+            yield record
+
+    stats = {
+        "source": "commit" if commit else "index",
+        "commit": commit.hexsha if commit else None,
+        "total_files": len(entries),
+        "downloaded_count": downloaded_count,
+        "skipped_count": skipped_count,
+        "outlined_files": outlined_files,
+    }
+    if outlined_files:
+        print(f"Outlined {len(outlined_files)} files above the size limit")
+    if classifier is not None:
+        classifier.print_summary()
+        stats.update(classifier.stats())
+    return stats
+
+
+def crawl_git_index(
+    directory,
+    ref=None,
+    include_patterns=None,
+    exclude_patterns=None,
+    max_file_size=None,
+    use_relative_paths=True,
+    max_workers=8,
+    content_filter=True,
+    outline_large_files=False,
+):
+    """
+    Crawl the tracked files of a local git repository with the same interface as crawl_local_files.
+
+    Args:
+        directory (str): Path inside a git working tree; only files below it are crawled
+        ref (str, optional): Commit, branch or tag to read. If None, files listed in the
+                             index are read from the working tree.
+        include_patterns (set): File patterns to include (e.g. {"*.py", "*.js"})
+        exclude_patterns (set): File patterns to exclude (e.g. {"tests/*"})
+        max_file_size (int): Maximum file size in bytes
+        use_relative_paths (bool): Whether to use paths relative to directory
+        max_workers (int): Number of threads reading working tree files concurrently
+        content_filter (bool): Reject binary, minified, generated and lockfile content
+                               (see utils/content_classifier.py)
+        outline_large_files (bool): Keep files above max_file_size as outlines of their declarations,
+                                    read in bounded chunks (see utils/large_files.py), instead of skipping them
+
+    Returns:
+        dict: {"files": {filepath: content}, "stats": {...}}
+    """
+    files, stats = collect_files(iter_git_index(
+        directory, ref, include_patterns, exclude_patterns, max_file_size, use_relative_paths, max_workers,
+        content_filter, outline_large_files,
+    ))
+    return {"files": files, "stats": stats}
@@ -1,15 +1,26 @@
-import requests
 import base64
+import io
 import os
+import posixpath
+import queue
+import tarfile
 import tempfile
 import git
-import time
-import fnmatch
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import Union, Set, List, Dict, Tuple, Any
-from urllib.parse import urlparse
+from urllib.parse import urlparse, quote
 import logging
 from dotenv import load_dotenv
+from utils.blob_store import BlobStore, git_blob_sha
+from utils.http_cache import HttpMetadataCache
+from utils.github_scheduler import GitHubRequestScheduler
+from utils.path_matcher import PathMatcher
+from utils.file_records import FileRecord
+from utils.content_classifier import ContentClassifier, ContentRejected, GitAttributes, PREFIX_BYTES, read_checked
+from utils.git_history import analyze_history
+from utils.large_files import CHUNK_BYTES, LARGE_FILE_LIMIT, outline_chunks, outline_stream
 logger = logging.getLogger(__name__)
 
 
@@ -273,14 +284,73 @@ def ensure_github_url():
 
 
 
+# Rough cost model used to choose a crawl strategy
+REQUEST_LATENCY_SECONDS = 0.3  # Average round trip of one GitHub request
+DOWNLOAD_BYTES_PER_SECOND = 5 * 1024 * 1024  # Sustained download throughput
+
+# Streaming through iter_github_files
+STREAM_QUEUE_SIZE = 64  # Fetched files iter_github_files buffers ahead of its consumer
+STREAM_PUT_TIMEOUT = 0.5  # Seconds between checks whether the consumer of iter_github_files stopped
+
+
+def _read_optional_text(path):
+    """Text of a file, or None if it does not exist or is not UTF-8."""
+    try:
+        with open(path, encoding="utf-8-sig") as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def estimate_crawl_costs(dir_count, needed_files, needed_bytes, repo_size_kb, max_workers=8, tree_complete=True):
+    """
+    Estimate the cost of each crawl strategy.
+
+    Args:
+        dir_count (int): Directories the Contents API walk would list
+        needed_files (int): Matching files not already in the blob store
+        needed_bytes (int): Total size of those files
+        repo_size_kb (int): Repository size reported by the GitHub API (roughly the tarball size)
+        max_workers (int): Number of concurrent workers
+        tree_complete (bool): False if the recursive tree listing was truncated, which rules out "trees"
+
+    Returns:
+        dict: strategy name -> {"requests": int, "bytes": int, "seconds": float}
+    """
+    costs = {
+        # One listing per directory plus one download per file
+        "contents": {"requests": dir_count + needed_files, "bytes": needed_bytes},
+        # The tarball always carries the whole repository, cached or not
+        "tarball": {"requests": 1, "bytes": repo_size_kb * 1024},
+    }
+    if tree_complete:
+        # The tree listing was already fetched by the pre-flight; only blob downloads remain
+        costs["trees"] = {"requests": needed_files, "bytes": needed_bytes}
+
+    for cost in costs.values():
+        cost["seconds"] = (cost["requests"] * REQUEST_LATENCY_SECONDS / max(max_workers, 1)
+                           + cost["bytes"] / DOWNLOAD_BYTES_PER_SECOND)
+    return costs
+
 
 def crawl_github_files(
     repo_url, 
     token=None, 
+    tokens: List[str] = None,
     max_file_size: int = 1 * 1024 * 1024,  # 1 MB
     use_relative_paths: bool = False,
     include_patterns: Union[str, Set[str]] = None,
-    exclude_patterns: Union[str, Set[str]] = None
+    exclude_patterns: Union[str, Set[str]] = None,
+    use_blob_cache: bool = True,
+    use_http_cache: bool = True,
+    cache_dir: str = None,
+    max_workers: int = 8,
+    strategy: str = "auto",
+    on_file=None,
+    content_filter: bool = True,
+    outline_large_files: bool = False,
+    history_window_days: int = None,
+    stop_event: threading.Event = None
 ):
     """
     Crawl files from a specific path in a GitHub repository at a specific commit.
@@ -292,12 +362,41 @@ def crawl_github_files(
             - **Required for private repositories.**
             - **Recommended for public repos to avoid rate limits.**
             - Can be passed explicitly or set via the `GITHUB_TOKEN` environment variable.
+        tokens (list of str, optional): Pool of GitHub tokens. Each request is routed to the token with the most
+                                        remaining quota, and exhausted tokens are drained until their window resets.
+                                        `token` is added to the pool if both are given.
         max_file_size (int, optional): Maximum file size in bytes to download (default: 1 MB)
         use_relative_paths (bool, optional): If True, file paths will be relative to the specified subdirectory
         include_patterns (str or set of str, optional): Pattern or set of patterns specifying which files to include (e.g., "*.py", {"*.md", "*.txt"}).
                                                        If None, all files are included.
         exclude_patterns (str or set of str, optional): Pattern or set of patterns specifying which files to exclude.
                                                        If None, no files are excluded.
+        use_blob_cache (bool, optional): If True, reuse file contents from the on-disk blob store keyed by git blob SHA
+                                         and store newly downloaded blobs there (default: True)
+        use_http_cache (bool, optional): If True, send conditional requests (If-None-Match) for API metadata
+                                         such as branch lists and directory listings (default: True)
+        cache_dir (str, optional): Root directory of the crawl cache (default: CRAWL_CACHE_DIR env var or '.crawl_cache')
+        max_workers (int, optional): Number of concurrent request workers draining the crawl queue (default: 8)
+        strategy (str, optional): How to fetch the files (default: "auto"):
+            - "contents": walk the Contents API directory by directory
+            - "trees": list everything with one recursive Trees API call, then download blobs in parallel
+            - "tarball": stream the repository tarball once and extract the matching files
+            - "auto": run a pre-flight (repository metadata + tree) and pick the cheapest strategy
+        on_file (callable, optional): Called with a FileRecord for every fetched file as soon as it
+                                      arrives (possibly from worker threads). Streamed files are not
+                                      kept in the returned `files` dict.
+        content_filter (bool, optional): Reject binary, minified, generated and lockfile content
+                                         (see utils/content_classifier.py). Lockfiles and files marked
+                                         linguist-generated/vendored in the root .gitattributes are never
+                                         downloaded; other files are rejected after their first bytes.
+        outline_large_files (bool, optional): Keep files above max_file_size (up to LARGE_FILE_LIMIT) as outlines
+                                              of their declarations, streamed in bounded chunks
+                                              (see utils/large_files.py), instead of skipping them.
+        history_window_days (int, optional): For SSH clones, also collect per-file churn and recency over
+                                             this many days of history (see utils/git_history.py) and
+                                             return it as stats["history"]. Other strategies have no history.
+        stop_event (threading.Event, optional): Once set, no further request is made: queued downloads are
+                                                dropped and the crawl returns what it fetched so far.
 
     Returns:
         dict: Dictionary with files and statistics
@@ -308,22 +407,38 @@ def crawl_github_files(
     if exclude_patterns and isinstance(exclude_patterns, str):
         exclude_patterns = {exclude_patterns}
 
-    def should_include_file(file_path: str, file_name: str) -> bool:
-        """Determine if a file should be included based on patterns"""
-        # If no include patterns are specified, include all files
-        if not include_patterns:
-            include_file = True
-        else:
-            # Check if file matches any include pattern
-            include_file = any(fnmatch.fnmatch(file_name, pattern) for pattern in include_patterns)
+    # One precompiled matcher shared by every strategy (same semantics as crawl_local_files)
+    matcher = PathMatcher(include_patterns, exclude_patterns)
 
-        # If exclude patterns are specified, check if file should be excluded
-        if exclude_patterns and include_file:
-            # Exclude if file matches any exclude pattern
-            exclude_file = any(fnmatch.fnmatch(file_path, pattern) for pattern in exclude_patterns)
-            return not exclude_file
+    # Fetched files go into `files`, or are streamed to `on_file` as they arrive
+    files = {}
+    fetched_count = 0
+    outlined_files = []
+    blob_store = BlobStore(cache_dir) if use_blob_cache else None
+    stats_lock = threading.Lock()
 
-        return include_file
+    def stopped():
+        """Whether the caller asked the crawl to stop"""
+        return stop_event is not None and stop_event.is_set()
+
+    def is_outlined(file_size):
+        """Files above the size limit are outlined in large-file mode, up to LARGE_FILE_LIMIT"""
+        return outline_large_files and max_file_size < file_size <= max(max_file_size, LARGE_FILE_LIMIT)
+
+    def add_file(rel_path, content, size, sha=None, in_blob_store=False, outlined=False):
+        """Record one fetched file; streamed records reload released text from the blob store"""
+        nonlocal fetched_count
+        with stats_lock:
+            fetched_count += 1
+            if outlined:
+                outlined_files.append(rel_path)
+        if on_file is None:
+            files[rel_path] = content
+            return
+        loader = None
+        if in_blob_store:
+            loader = lambda: blob_store.load_text(sha, rel_path)
+        on_file(FileRecord(rel_path, size, sha, content, loader, from_cache=in_blob_store))
 
     # Detect SSH URL (git@ or .git suffix)
     is_ssh_url = repo_url.startswith("git@") or repo_url.endswith(".git")
@@ -344,10 +459,19 @@ def crawl_github_files(
             # Optionally, user can pass ref explicitly in future API
 
             # Walk directory
-            files = {}
             skipped_files = []
+            classifier = None
+            if content_filter:
+                classifier = ContentClassifier(GitAttributes(
+                    lambda path: _read_optional_text(os.path.join(tmpdirname, *path.split("/")))))
 
             for root, dirs, filenames in os.walk(tmpdirname):
+                # Prune git metadata and excluded directories before descending
+                dirs[:] = [
+                    d for d in dirs
+                    if d != ".git" and not matcher.is_dir_excluded(
+                        os.path.relpath(os.path.join(root, d), tmpdirname).replace(os.sep, "/"))
+                ]
                 for filename in filenames:
                     abs_path = os.path.join(root, filename)
                     rel_path = os.path.relpath(abs_path, tmpdirname)
@@ -358,35 +482,58 @@ def crawl_github_files(
                     except OSError:
                         continue
 
-                    if file_size > max_file_size:
+                    if file_size > max_file_size and not is_outlined(file_size):
                         skipped_files.append((rel_path, file_size))
                         print(f"Skipping {rel_path}: size {file_size} exceeds limit {max_file_size}")
                         continue
 
                     # Check include/exclude patterns
-                    if not should_include_file(rel_path, filename):
+                    if not matcher.should_include_file(rel_path.replace(os.sep, "/")):
                         print(f"Skipping {rel_path}: does not match include/exclude patterns")
                         continue
 
+                    reason = classifier.reject_path(rel_path.replace(os.sep, "/")) if classifier else None
+                    if reason:
+                        print(f"Skipping {rel_path}: {reason}")
+                        continue
+
                     # Read content
                     try:
-                        with open(abs_path, "r", encoding="utf-8-sig") as f:
-                            content = f.read()
-                        files[rel_path] = content
+                        with open(abs_path, "rb") as f:
+                            if file_size > max_file_size:
+                                outline = outline_stream(f, rel_path.replace(os.sep, "/"), file_size, max_file_size, classifier)
+                                add_file(rel_path, outline, file_size, outlined=True)
+                                print(f"Outlined {rel_path} ({file_size} bytes)")
+                                continue
+                            data = read_checked(f, classifier, rel_path.replace(os.sep, "/"))
+                        add_file(rel_path, data.decode("utf-8-sig"), file_size)
                         print(f"Added {rel_path} ({file_size} bytes)")
+                    except ContentRejected as e:
+                        print(f"Skipping {rel_path}: {e.reason}")
                     except Exception as e:
                         print(f"Failed to read {rel_path}: {e}")
 
+            if classifier:
+                classifier.print_summary()
+
+            history = None
+            if history_window_days:
+                print(f"Analyzing the last {history_window_days} days of git history...")
+                history = analyze_history(tmpdirname, history_window_days, cache_dir)
+
             return {
                 "files": files,
                 "stats": {
-                    "downloaded_count": len(files),
+                    "downloaded_count": fetched_count,
                     "skipped_count": len(skipped_files),
                     "skipped_files": skipped_files,
                     "base_path": None,
                     "include_patterns": include_patterns,
                     "exclude_patterns": exclude_patterns,
-                    "source": "ssh_clone"
+                    "source": "ssh_clone",
+                    "outlined_files": outlined_files,
+                    "history": history,
+                    **(classifier.stats() if classifier else {})
                 }
             }
 
@@ -403,14 +550,27 @@ def crawl_github_files(
     
     # Setup for GitHub API
     headers = {"Accept": "application/vnd.github.v3+json"}
-    if token:
-        headers["Authorization"] = f"token {token}"
+    token_pool = [t for t in [token] + list(tokens or []) if t]
+    token = token_pool[0] if token_pool else None
+
+    # Every request goes through one scheduler that tracks the rate-limit budget
+    # of each token and sets the Authorization header of the token it picks
+    scheduler = GitHubRequestScheduler(tokens=token_pool)
+
+    # Conditional-request cache: unchanged metadata comes back as a free 304
+    http_cache = HttpMetadataCache(cache_dir) if use_http_cache else None
+
+    def api_get(url, params=None):
+        """GET a GitHub API metadata URL, revalidating against the HTTP cache when enabled"""
+        if http_cache:
+            return http_cache.get(url, headers=headers, params=params, fetch=scheduler.get)
+        return scheduler.get(url, headers=headers, params=params)
 
     def fetch_branches(owner: str, repo: str):
         """Get brancshes of the repository"""
 
         url = f"https://api.github.com/repos/{owner}/{repo}/branches"
-        response = requests.get(url, headers=headers, timeout=(30, 30))
+        response = api_get(url)
 
         if response.status_code == 404:
             if not token:
@@ -431,10 +591,29 @@ def crawl_github_files(
         """Check the repository has the given tree"""
 
         url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{tree}"
-        response = requests.get(url, headers=headers, timeout=(30, 30))
+        response = api_get(url)
 
         return True if response.status_code == 200 else False 
 
+    def fetch_repo_info(owner: str, repo: str):
+        """Get repository metadata (size in KB, default branch, ...)"""
+
+        url = f"https://api.github.com/repos/{owner}/{repo}"
+        response = api_get(url)
+
+        return response.json() if response.status_code == 200 else {}
+
+    def fetch_tree(owner: str, repo: str, tree_ref: str):
+        """Get the full recursive tree listing at a ref, or None if it cannot be fetched"""
+
+        url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{tree_ref}"
+        response = api_get(url, params={"recursive": "1"})
+        if response.status_code != 200:
+            return None
+
+        tree = response.json()
+        return {"ref": tree_ref, "entries": tree.get("tree", []), "truncated": tree.get("truncated", False)}
+
     # Check if URL contains a specific branch/commit
     if len(path_parts) > 2 and 'tree' == path_parts[2]:
         join_parts = lambda i: '/'.join(path_parts[i:])
@@ -473,23 +652,90 @@ def crawl_github_files(
         ref = None
         specific_path = ""
     
-    # Dictionary to store path -> content mapping
-    files = {}
     skipped_files = []
+    cache_hits = 0
+
+    # Only the root .gitattributes is consulted; it is one unmetered raw download
+    classifier = None
+    if content_filter:
+        attributes_url = f"https://raw.githubusercontent.com/{owner}/{repo}/{quote(ref or 'HEAD')}/.gitattributes"
+        attributes_response = scheduler.get(attributes_url, headers=headers, paced=False)
+        attributes_text = attributes_response.text if attributes_response.status_code == 200 else ""
+        classifier = ContentClassifier(GitAttributes.from_text(attributes_text))
+
+    def to_rel_path(item_path):
+        """Calculate the path used as key in `files`, relative to the subdirectory if requested"""
+        if use_relative_paths and specific_path:
+            # Make sure the path is relative to the specified subdirectory
+            if item_path.startswith(specific_path):
+                return item_path[len(specific_path):].lstrip('/')
+        return item_path
+
+    def is_dir_excluded(item_path, rel_path):
+        """Check if a directory matches the exclude patterns and should not be crawled"""
+        return matcher.is_dir_excluded(item_path) or matcher.is_dir_excluded(rel_path)
+
+    def accept_file(item_path, rel_path, file_size, quiet=False):
+        """Apply the include/exclude patterns and the size limit to a single file"""
+        # Check if file should be included based on patterns
+        if not matcher.should_include_file(rel_path):
+            if not quiet:
+                print(f"Skipping {rel_path}: Does not match include/exclude patterns")
+            return False
+
+        # Check file size if available
+        if file_size > max_file_size and not is_outlined(file_size):
+            if not quiet:
+                skipped_files.append((item_path, file_size))
+                print(f"Skipping {rel_path}: File size ({file_size} bytes) exceeds limit ({max_file_size} bytes)")
+            return False
+
+        # Lockfiles and linguist-generated/vendored files are rejected before any download
+        reason = classifier.reject_path(rel_path, item_path, record=not quiet) if classifier else None
+        if reason:
+            if not quiet:
+                print(f"Skipping {rel_path}: {reason}")
+            return False
+        return True
+
+    def check_prefix(rel_path, data):
+        """Let the classifier reject a file from its first bytes; True if it was rejected"""
+        if classifier is None:
+            return False
+        reason = classifier.reject_prefix(rel_path, data[:PREFIX_BYTES], complete=len(data) <= PREFIX_BYTES)
+        if reason:
+            print(f"Skipping {rel_path}: {reason}")
+        return bool(reason)
+
+    # Ancestor directories of flat path listings (trees, tarball) are checked once each
+    excluded_dir_cache = {}
+    root_dir = specific_path.strip('/')
+
+    def in_excluded_dir(item_path):
+        """Check if any directory between the crawl root and `item_path` is excluded"""
+        dir_path = posixpath.dirname(item_path)
+        if not dir_path or dir_path == root_dir or not dir_path.startswith(root_dir):
+            return False
+        if dir_path not in excluded_dir_cache:
+            excluded_dir_cache[dir_path] = (in_excluded_dir(dir_path) or
+                                            is_dir_excluded(dir_path, to_rel_path(dir_path)))
+        return excluded_dir_cache[dir_path]
+
+    def in_scope(item_path):
+        """Check if a path lies under the requested subdirectory (or is the requested file)"""
+        return not root_dir or item_path == root_dir or item_path.startswith(root_dir + "/")
     
     def fetch_contents(path):
-        """Fetch contents of the repository at a specific path and commit"""
+        """
+        Fetch one directory listing of the repository at a specific path and commit.
+
+        Returns the follow-up work items for the queue: ("dir", path) for each
+        subdirectory to crawl and ("file", (item, rel_path)) for each file to download.
+        """
         url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
         params = {"ref": ref} if ref != None else {}
         
-        response = requests.get(url, headers=headers, params=params, timeout=(30, 30))
-        
-        if response.status_code == 403 and 'rate limit exceeded' in response.text.lower():
-            reset_time = int(response.headers.get('X-RateLimit-Reset', 0))
-            wait_time = max(reset_time - time.time(), 0) + 1
-            print(f"Rate limit exceeded. Waiting for {wait_time:.0f} seconds...")
-            time.sleep(wait_time)
-            return fetch_contents(path)
+        response = api_get(url, params=params)
             
         if response.status_code == 404:
             if not token:
@@ -501,11 +747,11 @@ def crawl_github_files(
             else:
                 print(f"Error 404: Path '{path}' not found in repository or insufficient permissions with the provided token.\n"
                       f"Please verify the token has access to this repository and the path exists.")
-            return
+            return []
             
         if response.status_code != 200:
             print(f"Error fetching {path}: {response.status_code} - {response.text}")
-            return
+            return []
         
         contents = response.json()
         
@@ -513,101 +759,382 @@ def crawl_github_files(
         if not isinstance(contents, list):
             contents = [contents]
         
+        work_items = []
         for item in contents:
             item_path = item["path"]
+            rel_path = to_rel_path(item_path)
+            
+            if item["type"] == "file":
+                if accept_file(item_path, rel_path, item.get("size", 0)):
+                    work_items.append(("file", (item, rel_path)))
             
-            # Calculate relative path if requested
-            if use_relative_paths and specific_path:
-                # Make sure the path is relative to the specified subdirectory
-                if item_path.startswith(specific_path):
-                    rel_path = item_path[len(specific_path):].lstrip('/')
+            elif item["type"] == "dir":
+                # Only crawl the directory if it is not excluded
+                if not is_dir_excluded(item_path, rel_path):
+                    work_items.append(("dir", item_path))
+
+        return work_items
+
+    def download_file(item, rel_path):
+        """Download the content of a single file item from a directory or tree listing"""
+        nonlocal cache_hits
+        if stopped():
+            return
+        item_path = item["path"]
+        file_size = item.get("size", 0)
+
+        blob_sha = item.get("sha")
+        if file_size > max_file_size:
+            download_outline(item, rel_path)
+            return
+
+        # Reuse the blob from the store if this exact content was downloaded before
+        if blob_store:
+            cached = blob_store.get(blob_sha)
+            if cached is not None:
+                if check_prefix(rel_path, cached):
+                    return
+                add_file(rel_path, cached.decode("utf-8", errors="replace"), file_size, blob_sha, in_blob_store=True)
+                with stats_lock:
+                    cache_hits += 1
+                print(f"Cached: {rel_path} ({file_size} bytes)")
+                return
+
+        # For files, get raw content
+        if "download_url" in item and item["download_url"]:
+            file_url = item["download_url"]
+            # Raw downloads are not metered by the REST API budget, so skip pacing.
+            # The body is streamed so the classifier can stop the download after its first bytes.
+            file_response = scheduler.get(file_url, headers=headers, paced=False, stream=True)
+            with file_response:
+                # Final size check in case content-length header is available but differs from metadata
+                content_length = int(file_response.headers.get('content-length', 0))
+                if content_length > max_file_size:
+                    skipped_files.append((item_path, content_length))
+                    print(f"Skipping {rel_path}: Content length ({content_length} bytes) exceeds limit ({max_file_size} bytes)")
+                    return
+
+                if file_response.status_code == 200:
+                    chunks = file_response.iter_content(chunk_size=PREFIX_BYTES)
+                    data = next(chunks, b"")
+                    if len(data) == PREFIX_BYTES:
+                        # Peek one more chunk so a file of exactly PREFIX_BYTES counts as complete
+                        data += next(chunks, b"")
+                    if check_prefix(rel_path, data):
+                        return
+                    data += b"".join(chunks)
+                    stored = blob_store.put(blob_sha, data) if blob_store else False
+                    add_file(rel_path, data.decode("utf-8", errors="replace"), file_size, blob_sha, in_blob_store=stored)
+                    print(f"Downloaded: {rel_path} ({file_size} bytes) ")
+                else:
+                    print(f"Failed to download {rel_path}: {file_response.status_code}")
+        else:
+            # Alternative method if download_url is not available
+            content_response = scheduler.get(item["url"], headers=headers)
+            if content_response.status_code == 200:
+                content_data = content_response.json()
+                if content_data.get("encoding") == "base64" and "content" in content_data:
+                    # Check size of base64 content before decoding
+                    if len(content_data["content"]) * 0.75 > max_file_size:  # Approximate size calculation
+                        estimated_size = int(len(content_data["content"]) * 0.75)
+                        skipped_files.append((item_path, estimated_size))
+                        print(f"Skipping {rel_path}: Encoded content exceeds size limit")
+                        return
+                        
+                    file_bytes = base64.b64decode(content_data["content"])
+                    if check_prefix(rel_path, file_bytes):
+                        return
+                    file_content = file_bytes.decode('utf-8')
+                    stored = blob_store.put(blob_sha, file_bytes) if blob_store else False
+                    add_file(rel_path, file_content, file_size, blob_sha, in_blob_store=stored)
+                    print(f"Downloaded: {rel_path} ({file_size} bytes)")
                 else:
-                    rel_path = item_path
+                    print(f"Unexpected content format for {rel_path}")
             else:
-                rel_path = item_path
-            
-            if item["type"] == "file":
-                # Check if file should be included based on patterns
-                if not should_include_file(rel_path, item["name"]):
-                    print(f"Skipping {rel_path}: Does not match include/exclude patterns")
+                print(f"Failed to get content for {rel_path}: {content_response.status_code}")
+
+    def download_outline(item, rel_path):
+        """Outline a file above the size limit from a bounded stream of its content"""
+        if stopped():
+            return
+        item_path = item["path"]
+        file_size = item.get("size", 0)
+        blob_sha = item.get("sha")
+        try:
+            if blob_store and blob_store.has(blob_sha):
+                with open(blob_store.path_for(blob_sha), "rb") as f:
+                    outline = outline_stream(f, rel_path, file_size, max_file_size, classifier)
+            elif item.get("download_url"):
+                file_response = scheduler.get(item["download_url"], headers=headers, paced=False, stream=True)
+                with file_response:
+                    if file_response.status_code != 200:
+                        print(f"Failed to download {rel_path}: {file_response.status_code}")
+                        return
+                    # Closing the response stops the download once the outline is full
+                    chunks = file_response.iter_content(chunk_size=CHUNK_BYTES)
+                    outline = outline_chunks(chunks, rel_path, file_size, max_file_size, classifier)
+            else:
+                content_response = scheduler.get(item["url"], headers=headers)
+                content_data = content_response.json() if content_response.status_code == 200 else {}
+                if content_data.get("encoding") != "base64" or "content" not in content_data:
+                    print(f"Failed to get content for {rel_path}: {content_response.status_code}")
+                    return
+                file_bytes = base64.b64decode(content_data["content"])
+                outline = outline_stream(io.BytesIO(file_bytes), rel_path, file_size, max_file_size, classifier)
+        except ContentRejected as e:
+            print(f"Skipping {rel_path}: {e.reason}")
+            return
+        add_file(rel_path, outline, file_size, outlined=True)
+        print(f"Outlined: {rel_path} ({file_size} bytes)")
+
+    def process(work_item):
+        if stopped():
+            return []
+        kind, payload = work_item
+        if kind == "dir":
+            return fetch_contents(payload)
+        download_file(*payload)
+        return []
+
+    def drain_queue(initial_items):
+        """
+        Drain an explicit work queue instead of recursing: each finished directory
+        listing enqueues its subdirectories and file downloads, and the workers
+        issue requests concurrently through the shared rate-limit-aware scheduler
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = {executor.submit(process, work_item) for work_item in initial_items}
+            try:
+                while pending and not stopped():
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for work_item in future.result():
+                            pending.add(executor.submit(process, work_item))
+            finally:
+                # On a stop or an error, queued work items are dropped; only running ones are waited for
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def tree_file_items(tree):
+        """Turn a recursive tree listing into file work items, like the contents walk would select them"""
+        tree_ref = tree["ref"]
+        work_items = []
+        for entry in tree["entries"]:
+            item_path = entry["path"]
+            if entry["type"] != "blob" or not in_scope(item_path) or in_excluded_dir(item_path):
+                continue
+            rel_path = to_rel_path(item_path)
+            item = {
+                "path": item_path,
+                "name": posixpath.basename(item_path),
+                "size": entry.get("size", 0),
+                "sha": entry["sha"],
+                "download_url": f"https://raw.githubusercontent.com/{owner}/{repo}/{quote(tree_ref)}/{quote(item_path)}",
+            }
+            if accept_file(item_path, rel_path, item["size"]):
+                work_items.append(("file", (item, rel_path)))
+        return work_items
+
+    def crawl_tarball(tree_ref):
+        """Stream the repository tarball once and keep the matching files"""
+        nonlocal cache_hits
+        url = f"https://api.github.com/repos/{owner}/{repo}/tarball/{tree_ref}"
+        response = scheduler.get(url, headers=headers, stream=True, timeout=(30, 300))
+        if response.status_code != 200:
+            print(f"Error downloading tarball of {owner}/{repo}@{tree_ref}: {response.status_code}")
+            return False
+
+        with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+            for member in archive:
+                if stopped():
+                    break
+                # Archive members are prefixed with a single "<owner>-<repo>-<sha>/" directory
+                if not member.isfile() or "/" not in member.name:
                     continue
-                
-                # Check file size if available
-                file_size = item.get("size", 0)
-                if file_size > max_file_size:
-                    skipped_files.append((item_path, file_size))
-                    print(f"Skipping {rel_path}: File size ({file_size} bytes) exceeds limit ({max_file_size} bytes)")
+                item_path = member.name.split("/", 1)[1]
+                if not in_scope(item_path) or in_excluded_dir(item_path):
                     continue
-                
-                # For files, get raw content
-                if "download_url" in item and item["download_url"]:
-                    file_url = item["download_url"]
-                    file_response = requests.get(file_url, headers=headers, timeout=(30, 30))
-                    
-                    # Final size check in case content-length header is available but differs from metadata
-                    content_length = int(file_response.headers.get('content-length', 0))
-                    if content_length > max_file_size:
-                        skipped_files.append((item_path, content_length))
-                        print(f"Skipping {rel_path}: Content length ({content_length} bytes) exceeds limit ({max_file_size} bytes)")
-                        continue
-                        
-                    if file_response.status_code == 200:
-                        files[rel_path] = file_response.text
-                        print(f"Downloaded: {rel_path} ({file_size} bytes) ")
-                    else:
-                        print(f"Failed to download {rel_path}: {file_response.status_code}")
-                else:
-                    # Alternative method if download_url is not available
-                    content_response = requests.get(item["url"], headers=headers, timeout=(30, 30))
-                    if content_response.status_code == 200:
-                        content_data = content_response.json()
-                        if content_data.get("encoding") == "base64" and "content" in content_data:
-                            # Check size of base64 content before decoding
-                            if len(content_data["content"]) * 0.75 > max_file_size:  # Approximate size calculation
-                                estimated_size = int(len(content_data["content"]) * 0.75)
-                                skipped_files.append((item_path, estimated_size))
-                                print(f"Skipping {rel_path}: Encoded content exceeds size limit")
-                                continue
-                                
-                            file_content = base64.b64decode(content_data["content"]).decode('utf-8')
-                            files[rel_path] = file_content
-                            print(f"Downloaded: {rel_path} ({file_size} bytes)")
-                        else:
-                            print(f"Unexpected content format for {rel_path}")
-                    else:
-                        print(f"Failed to get content for {rel_path}: {content_response.status_code}")
-            
-            elif item["type"] == "dir":
-                # OLD IMPLEMENTATION (comment this block to test new implementation)
-                # Always recurse into directories without checking exclusions first
-                # fetch_contents(item_path)
-
-                # NEW IMPLEMENTATION (uncomment this block to test optimized version)
-                # # Check if directory should be excluded before recursing
-                if exclude_patterns:
-                    dir_excluded = any(fnmatch.fnmatch(item_path, pattern) or
-                                    fnmatch.fnmatch(rel_path, pattern) for pattern in exclude_patterns)
-                    if dir_excluded:
+                rel_path = to_rel_path(item_path)
+                if not accept_file(item_path, rel_path, member.size):
+                    continue
+                try:
+                    # Unread member data is skipped by the stream, never decoded or stored
+                    if member.size > max_file_size:
+                        outline = outline_stream(archive.extractfile(member), rel_path, member.size,
+                                                 max_file_size, classifier)
+                        add_file(rel_path, outline, member.size, outlined=True)
+                        print(f"Outlined: {rel_path} ({member.size} bytes)")
                         continue
-                
-                # # Only recurse if directory is not excluded
-                fetch_contents(item_path)
-    
-    # Start crawling from the specified path
-    fetch_contents(specific_path)
+                    data = read_checked(archive.extractfile(member), classifier, rel_path)
+                except ContentRejected as e:
+                    print(f"Skipping {rel_path}: {e.reason}")
+                    continue
+                blob_sha = git_blob_sha(data)
+                stored = blob_store.put(blob_sha, data) if blob_store else False
+                add_file(rel_path, data.decode("utf-8", errors="replace"), member.size, blob_sha, in_blob_store=stored)
+                print(f"Extracted: {rel_path} ({member.size} bytes)")
+        return True
+
+    # --- Pre-flight: look at the repository size and tree to pick a strategy ---
+    strategy_decision = {"strategy": "contents", "predicted_requests": None}
+    tree = None
+    if strategy != "contents":
+        repo_info = fetch_repo_info(owner, repo)
+        tree_ref = ref or repo_info.get("default_branch")
+        if tree_ref:
+            tree = fetch_tree(owner, repo, tree_ref)
+
+        if tree is not None:
+            # Count what each strategy would have to do, without side effects
+            dir_count, needed_files, needed_bytes = 1, 0, 0
+            for entry in tree["entries"]:
+                item_path = entry["path"]
+                if not in_scope(item_path) or in_excluded_dir(item_path):
+                    continue
+                if entry["type"] == "tree":
+                    dir_count += 0 if is_dir_excluded(item_path, to_rel_path(item_path)) else 1
+                elif entry["type"] == "blob":
+                    size = entry.get("size", 0)
+                    if accept_file(item_path, to_rel_path(item_path), size, quiet=True):
+                        if not (blob_store and blob_store.has(entry["sha"])):
+                            needed_files += 1
+                            needed_bytes += size
+
+            costs = estimate_crawl_costs(
+                dir_count, needed_files, needed_bytes, repo_info.get("size", 0), max_workers,
+                tree_complete=not tree["truncated"],
+            )
+            if strategy == "auto":
+                chosen = min(costs, key=lambda name: costs[name]["seconds"])
+            elif strategy in costs:
+                chosen = strategy
+            else:
+                print(f"Crawl strategy '{strategy}' is not available for this repository, using 'contents'")
+                chosen = "contents"
+            strategy_decision = {"strategy": chosen, "predicted_requests": costs[chosen]["requests"], "costs": costs}
+
+            alternatives = ", ".join(
+                f"{name}: {cost['requests']} requests / {cost['bytes'] // 1024} KB / ~{cost['seconds']:.1f}s"
+                for name, cost in costs.items()
+            )
+            message = (f"Crawl strategy: {chosen} (predicted {costs[chosen]['requests']} requests; "
+                       f"repo size {repo_info.get('size', 0)} KB, {needed_files} files to fetch; {alternatives})")
+            print(message)
+            logger.info(message)
+        else:
+            print("Crawl strategy: contents (repository tree unavailable for pre-flight)")
+
+    # Start crawling from the specified path with the chosen strategy
+    if strategy_decision["strategy"] == "tarball" and crawl_tarball(tree["ref"]):
+        pass
+    elif strategy_decision["strategy"] == "trees":
+        drain_queue(tree_file_items(tree))
+    else:
+        strategy_decision["strategy"] = "contents"
+        drain_queue([("dir", specific_path)])
+
+    if outlined_files:
+        print(f"Outlined {len(outlined_files)} files above the size limit")
+    if classifier:
+        classifier.print_summary()
+
+    not_modified_count = 0
+    if http_cache:
+        http_cache.save()
+        not_modified_count = http_cache.not_modified_count
     
     return {
         "files": files,
         "stats": {
-            "downloaded_count": len(files),
+            "downloaded_count": fetched_count,
+            "cache_hits": cache_hits,
+            "not_modified_count": not_modified_count,
+            "request_count": scheduler.request_count,
+            "rate_limited_count": scheduler.rate_limited_count,
+            "token_quota": scheduler.pool.snapshot(),
+            "strategy": strategy_decision["strategy"],
+            "predicted_requests": strategy_decision["predicted_requests"],
             "skipped_count": len(skipped_files),
             "skipped_files": skipped_files,
+            "outlined_files": outlined_files,
             "base_path": specific_path if use_relative_paths else None,
             "include_patterns": include_patterns,
-            "exclude_patterns": exclude_patterns
+            "exclude_patterns": exclude_patterns,
+            **(classifier.stats() if classifier else {})
         }
     }
 
+class _CrawlStopped(BaseException):
+    """Raised in the crawl when the consumer of iter_github_files stopped; a BaseException
+    so the crawl's per-file `except Exception` handlers do not swallow it"""
+
+
+def iter_github_files(repo_url, **kwargs):
+    """
+    Generator variant of crawl_github_files that yields files as they are fetched.
+
+    The crawl runs on a background thread and hands each file over through a
+    bounded queue, so the consumer can process files while downloads are still
+    in flight, and a slow consumer holds the crawl back instead of letting
+    fetched files pile up in memory. Closing the generator early stops the crawl.
+
+    Args:
+        repo_url (str): Same as crawl_github_files
+        **kwargs: Any other crawl_github_files argument except `on_file` and `stop_event`
+
+    Yields:
+        FileRecord: path, size, git blob SHA and text of each fetched file, in arrival order.
+                    Text of files in the blob store can be released and reloaded from there.
+
+    Returns:
+        dict: Crawl statistics (the generator's return value)
+    """
+    records = queue.Queue(maxsize=STREAM_QUEUE_SIZE)
+    stop = threading.Event()
+    finished = object()
+    outcome = {}
+
+    def hand_over(record):
+        """Queue a record for the consumer, waiting for room until the consumer stops"""
+        while not stop.is_set():
+            try:
+                records.put(record, timeout=STREAM_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+        raise _CrawlStopped()
+
+    def run():
+        try:
+            outcome["result"] = crawl_github_files(repo_url, on_file=hand_over, stop_event=stop, **kwargs) or {}
+        except _CrawlStopped:
+            pass
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            try:
+                hand_over(finished)
+            except _CrawlStopped:
+                pass
+
+    worker = threading.Thread(target=run, name="github-crawl", daemon=True)
+    worker.start()
+    try:
+        while True:
+            record = records.get()
+            if record is finished:
+                break
+            yield record
+    finally:
+        # Also reached when the consumer closes the generator early: the crawl drops its queued
+        # downloads and makes no further request
+        stop.set()
+    worker.join()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"].get("stats", {})
+
+
 # Example usage
 if __name__ == "__main__":
     try:
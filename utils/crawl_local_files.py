@@ -1,132 +1,245 @@
 import os
-import fnmatch
-import pathspec
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils.blob_store import git_blob_sha
+from utils.content_classifier import ContentClassifier, ContentRejected, GitAttributes, read_checked
+from utils.file_records import FileRecord, collect_files
+from utils.large_files import LARGE_FILE_LIMIT, outline_stream
+from utils.path_matcher import PathMatcher, GitIgnoreRules
 
 
-def crawl_local_files(
+def scan_directory(directory, matcher, max_file_size=None, classifier=None):
+    """
+    Walk a directory tree with os.scandir, filtering while walking.
+
+    Excluded directories are pruned before they are descended, and files are
+    checked against the patterns as soon as they are listed. The size limit
+    reuses the DirEntry stat result instead of a separate getsize call, and
+    only files that pass the patterns are stat'ed at all. Files are yielded in
+    the same order os.walk would list them.
+
+    Args:
+        directory (str): Root directory to walk
+        matcher (PathMatcher): Compiled include/exclude/.gitignore filter
+        max_file_size (int, optional): Maximum file size in bytes
+        classifier (ContentClassifier, optional): Rejects lockfiles and linguist-generated/vendored
+                                                  files by path before they are stat'ed
+
+    Yields:
+        tuple: (abs_path, rel_path, size, status) where rel_path uses "/" separators and
+               status is None for accepted files or "skipped (...)" for rejected ones
+    """
+    # Explicit stack of (abs_dir, rel_dir) instead of recursion
+    stack = [(directory, "")]
+    while stack:
+        abs_dir, rel_dir = stack.pop()
+        try:
+            with os.scandir(abs_dir) as it:
+                entries = list(it)
+        except OSError as e:
+            print(f"Warning: Could not list directory {abs_dir}: {e}")
+            continue
+
+        subdirs = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+
+            if is_dir:
+                # Like os.walk, do not follow symlinked directories
+                if not entry.is_symlink() and not matcher.is_dir_excluded(rel_path):
+                    subdirs.append((entry.path, rel_path))
+                continue
+
+            if not matcher.should_include_file(rel_path):
+                yield entry.path, rel_path, None, "skipped (excluded)"
+                continue
+
+            reason = classifier.reject_path(rel_path) if classifier else None
+            if reason:
+                yield entry.path, rel_path, None, f"skipped ({reason})"
+                continue
+
+            try:
+                size = entry.stat().st_size
+            except OSError:
+                continue
+            if max_file_size and size > max_file_size:
+                yield entry.path, rel_path, size, "skipped (size limit)"
+                continue
+
+            yield entry.path, rel_path, size, None
+
+        # Push in reverse so subdirectories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+
+def _read_text_file(filepath, classifier=None, rel_path=None):
+    """
+    Read a file as text the way open(..., encoding="utf-8-sig") does, plus its git blob SHA.
+
+    With a classifier, only the first PREFIX_BYTES are read before it decides; rejected
+    files raise ContentRejected without being read further.
+    """
+    with open(filepath, "rb") as f:
+        data = read_checked(f, classifier, rel_path)
+    # Decode and normalize newlines like text mode, but keep the raw bytes for the hash
+    text = data.decode("utf-8-sig").replace("\r\n", "\n").replace("\r", "\n")
+    return text, git_blob_sha(data)
+
+
+def _read_attributes_file(directory, rel_path):
+    """Text of a .gitattributes file under the crawl root, or None."""
+    try:
+        with open(os.path.join(directory, *rel_path.split("/")), encoding="utf-8-sig") as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def _outline_file(filepath, max_chars, classifier=None, rel_path=None):
+    """Outline of a file above the size limit, read in bounded chunks (see utils/large_files.py)."""
+    with open(filepath, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        return outline_stream(f, rel_path or os.path.basename(filepath), size, max_chars, classifier), None
+
+
+def iter_local_files(
     directory,
     include_patterns=None,
     exclude_patterns=None,
     max_file_size=None,
     use_relative_paths=True,
+    max_workers=8,
+    content_filter=True,
+    outline_large_files=False,
 ):
     """
-    Crawl files in a local directory with similar interface as crawl_github_files.
+    Generator variant of crawl_local_files that yields files as they are read.
+
+    Accepted files are read ahead on a bounded thread pool while the walk
+    continues, and records are yielded in discovery order, so the stream is
+    deterministic. Files that cannot be read are skipped with a warning.
+
     Args:
-        directory (str): Path to local directory
-        include_patterns (set): File patterns to include (e.g. {"*.py", "*.js"})
-        exclude_patterns (set): File patterns to exclude (e.g. {"tests/*"})
-        max_file_size (int): Maximum file size in bytes
-        use_relative_paths (bool): Whether to use paths relative to directory
+        Same as crawl_local_files.
+
+    Yields:
+        FileRecord: path, size, git blob SHA and text of each accepted file. The
+                    text can be released and is re-read from disk on demand.
 
     Returns:
-        dict: {"files": {filepath: content}}
+        dict: Crawl statistics: outlined large files and the content classifier's rejections
     """
     if not os.path.isdir(directory):
         raise ValueError(f"Directory does not exist: {directory}")
 
-    files_dict = {}
+    # --- Compile include/exclude patterns once; nested .gitignore files are loaded as the walk descends ---
+    matcher = PathMatcher(include_patterns, exclude_patterns, GitIgnoreRules(directory))
+    classifier = None
+    if content_filter:
+        classifier = ContentClassifier(GitAttributes(lambda path: _read_attributes_file(directory, path)))
 
-    # --- Load .gitignore ---
-    gitignore_path = os.path.join(directory, ".gitignore")
-    gitignore_spec = None
-    if os.path.exists(gitignore_path):
+    processed_files = 0
+    outlined_files = []
+    # In outline mode, files above max_file_size are listed too and reduced to outlines
+    outline = bool(outline_large_files and max_file_size)
+    scan_limit = max(max_file_size, LARGE_FILE_LIMIT) if outline else max_file_size
+
+    def finish(read):
+        future, filepath, rel_path, relpath, size, outlined = read
         try:
-            with open(gitignore_path, "r", encoding="utf-8-sig") as f:
-                gitignore_patterns = f.readlines()
-            gitignore_spec = pathspec.PathSpec.from_lines("gitwildmatch", gitignore_patterns)
-            print(f"Loaded .gitignore patterns from {gitignore_path}")
+            text, sha = future.result()
+        except ContentRejected as e:
+            print(f"\033[92mProgress: {processed_files} {relpath} [skipped ({e.reason})]\033[0m")
+            return None
         except Exception as e:
-            print(f"Warning: Could not read or parse .gitignore file {gitignore_path}: {e}")
+            print(f"Warning: Could not read file {filepath}: {e}")
+            print(f"\033[92mProgress: {processed_files} {relpath} [skipped (read error)]\033[0m")
+            return None
+        if outlined:
+            outlined_files.append(rel_path)
+            print(f"\033[92mProgress: {processed_files} {relpath} [outlined]\033[0m")
+            return FileRecord(relpath, size, None, text,
+                              loader=lambda: _outline_file(filepath, max_file_size, None, rel_path)[0])
+        print(f"\033[92mProgress: {processed_files} {relpath} [processed]\033[0m")
+        return FileRecord(relpath, size, sha, text, loader=lambda: _read_text_file(filepath)[0])
 
-    all_files = []
-    for root, dirs, files in os.walk(directory):
-        # Filter directories using .gitignore and exclude_patterns early
-        excluded_dirs = set()
-        for d in dirs:
-            dirpath_rel = os.path.relpath(os.path.join(root, d), directory)
+    # Reads go through a bounded pool; at most a few reads per worker are in flight
+    in_flight = deque()
+    max_in_flight = max(max_workers, 1) * 4
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        for filepath, rel_path, size, status in scan_directory(directory, matcher, scan_limit, classifier):
+            processed_files += 1 # Increment processed count regardless of inclusion/exclusion
+            relpath = rel_path.replace("/", os.sep) if use_relative_paths else filepath
 
-            if gitignore_spec and gitignore_spec.match_file(dirpath_rel):
-                excluded_dirs.add(d)
+            if status:
+                # Print progress for skipped files due to exclusion or size limit
+                print(f"\033[92mProgress: {processed_files} {relpath} [{status}]\033[0m")
                 continue
 
-            if exclude_patterns:
-                for pattern in exclude_patterns:
-                    if fnmatch.fnmatch(dirpath_rel, pattern) or fnmatch.fnmatch(d, pattern):
-                        excluded_dirs.add(d)
-                        break
+            # --- File is being processed ---
+            outlined = bool(max_file_size) and size > max_file_size
+            if outlined:
+                future = executor.submit(_outline_file, filepath, max_file_size, classifier, rel_path)
+            else:
+                future = executor.submit(_read_text_file, filepath, classifier, rel_path)
+            in_flight.append((future, filepath, rel_path, relpath, size, outlined))
+            # Yield finished reads from the head of the queue to keep discovery order
+            while in_flight and (len(in_flight) >= max_in_flight or in_flight[0][0].done()):
+                record = finish(in_flight.popleft())
+                if record:
+                    yield record
 
-        for d in dirs.copy():
-            if d in excluded_dirs:
-                dirs.remove(d)
+        while in_flight:
+            record = finish(in_flight.popleft())
+            if record:
+                yield record
 
-        for filename in files:
-            filepath = os.path.join(root, filename)
-            all_files.append(filepath)
-
-    total_files = len(all_files)
-    processed_files = 0
+    stats = {"outlined_files": outlined_files}
+    if outlined_files:
+        print(f"Outlined {len(outlined_files)} files above the size limit")
+    if classifier is not None:
+        classifier.print_summary()
+        stats.update(classifier.stats())
+    return stats
 
-    for filepath in all_files:
-        relpath = os.path.relpath(filepath, directory) if use_relative_paths else filepath
-
-        # --- Exclusion check ---
-        excluded = False
-        if gitignore_spec and gitignore_spec.match_file(relpath):
-            excluded = True
-
-        if not excluded and exclude_patterns:
-            for pattern in exclude_patterns:
-                if fnmatch.fnmatch(relpath, pattern):
-                    excluded = True
-                    break
-
-        included = False
-        if include_patterns:
-            for pattern in include_patterns:
-                if fnmatch.fnmatch(relpath, pattern):
-                    included = True
-                    break
-        else:
-            included = True
-
-        processed_files += 1 # Increment processed count regardless of inclusion/exclusion
-
-        status = "processed"
-        if not included or excluded:
-            status = "skipped (excluded)"
-            # Print progress for skipped files due to exclusion
-            if total_files > 0:
-                percentage = (processed_files / total_files) * 100
-                rounded_percentage = int(percentage)
-                print(f"\033[92mProgress: {processed_files}/{total_files} ({rounded_percentage}%) {relpath} [{status}]\033[0m")
-            continue # Skip to next file if not included or excluded
-
-        if max_file_size and os.path.getsize(filepath) > max_file_size:
-            status = "skipped (size limit)"
-            # Print progress for skipped files due to size limit
-            if total_files > 0:
-                percentage = (processed_files / total_files) * 100
-                rounded_percentage = int(percentage)
-                print(f"\033[92mProgress: {processed_files}/{total_files} ({rounded_percentage}%) {relpath} [{status}]\033[0m")
-            continue # Skip large files
-
-        # --- File is being processed ---        
-        try:
-            with open(filepath, "r", encoding="utf-8-sig") as f:
-                content = f.read()
-            files_dict[relpath] = content
-        except Exception as e:
-            print(f"Warning: Could not read file {filepath}: {e}")
-            status = "skipped (read error)"
 
-        # --- Print progress for processed or error files ---
-        if total_files > 0:
-            percentage = (processed_files / total_files) * 100
-            rounded_percentage = int(percentage)
-            print(f"\033[92mProgress: {processed_files}/{total_files} ({rounded_percentage}%) {relpath} [{status}]\033[0m")
+def crawl_local_files(
+    directory,
+    include_patterns=None,
+    exclude_patterns=None,
+    max_file_size=None,
+    use_relative_paths=True,
+    max_workers=8,
+    content_filter=True,
+    outline_large_files=False,
+):
+    """
+    Crawl files in a local directory with similar interface as crawl_github_files.
+    Args:
+        directory (str): Path to local directory
+        include_patterns (set): File patterns to include (e.g. {"*.py", "*.js"})
+        exclude_patterns (set): File patterns to exclude (e.g. {"tests/*"})
+        max_file_size (int): Maximum file size in bytes
+        use_relative_paths (bool): Whether to use paths relative to directory
+        max_workers (int): Number of threads reading accepted files concurrently
+        content_filter (bool): Reject binary, minified, generated and lockfile content
+                               (see utils/content_classifier.py)
+        outline_large_files (bool): Keep files above max_file_size as outlines of their declarations,
+                                    read in bounded chunks (see utils/large_files.py), instead of skipping them
 
-    return {"files": files_dict}
+    Returns:
+        dict: {"files": {filepath: content}, "stats": {"outlined_files": [...], "rejected_files": [...], ...}}
+    """
+    files_dict, stats = collect_files(iter_local_files(
+        directory, include_patterns, exclude_patterns, max_file_size, use_relative_paths, max_workers,
+        content_filter, outline_large_files,
+    ))
+    return {"files": files_dict, "stats": stats}
 
 
 if __name__ == "__main__":
@@ -144,4 +257,4 @@ if __name__ == "__main__":
     )
     print(f"Found {len(files_data['files'])} files:")
     for path in files_data["files"]:
-        print(f"  {path}")
\ No newline at end of file
+        print(f"  {path}")
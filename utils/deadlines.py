@@ -0,0 +1,103 @@
+"""
+Deadlines for LLM calls: a per-call timeout, a per-node budget and a
+whole-run wall-clock budget.
+
+`main.py` configures the budgets once with `configure`. Every provider call
+then asks `timeout_for(node)` for its timeout: the per-call timeout, cut down
+to whatever is left of the node's and the run's budget. Once a budget is
+spent, `timeout_for` raises DeadlineExceeded instead of starting another
+call, so a run with a budget always ends, however its upstreams behave.
+"""
+
+import threading
+import time
+
+# Seconds a single LLM request may take unless configured otherwise
+DEFAULT_CALL_TIMEOUT = 300.0
+# Seconds allowed to establish a connection (within the call timeout)
+CONNECT_TIMEOUT = 10.0
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a node's or the run's time budget is spent."""
+
+
+class Deadlines:
+    """
+    Time budgets of one run.
+
+    A node's budget starts with its first LLM call and covers all of its calls,
+    retries included; the run's budget starts when the Deadlines are created.
+
+    Args:
+        run_seconds (float, optional): Wall-clock budget of the whole run (None: unlimited)
+        node_seconds (float, optional): Budget of each node (None: unlimited)
+        call_timeout (float): Timeout of a single call
+    """
+
+    def __init__(self, run_seconds: float = None, node_seconds: float = None,
+                 call_timeout: float = DEFAULT_CALL_TIMEOUT):
+        now = time.monotonic()
+        self.run_deadline = now + run_seconds if run_seconds else None
+        self.node_seconds = node_seconds or None
+        self.call_timeout = call_timeout or DEFAULT_CALL_TIMEOUT
+        self._node_deadlines = {}
+        self._lock = threading.Lock()
+
+    def _node_deadline(self, node: str):
+        if not node or self.node_seconds is None:
+            return None
+        with self._lock:
+            return self._node_deadlines.setdefault(node, time.monotonic() + self.node_seconds)
+
+    def remaining(self, node: str = None):
+        """Seconds left before the nearest of the node's and the run's deadlines (None: unlimited)."""
+        deadlines = [d for d in (self.run_deadline, self._node_deadline(node)) if d is not None]
+        if not deadlines:
+            return None
+        return min(deadlines) - time.monotonic()
+
+    def timeout_for(self, node: str = None) -> float:
+        """
+        Timeout for the next call of `node`.
+
+        Returns:
+            float: Seconds, at most the per-call timeout and at most the budget left
+
+        Raises:
+            DeadlineExceeded: If the node's or the run's budget is spent
+        """
+        remaining = self.remaining(node)
+        if remaining is None:
+            return self.call_timeout
+        if remaining <= 0:
+            scope = "run" if self.run_deadline is not None and self.run_deadline <= time.monotonic() else node
+            raise DeadlineExceeded(f"Time budget of {scope} is spent")
+        return min(self.call_timeout, remaining)
+
+    def clamp_wait(self, node: str, seconds: float) -> float:
+        """A retry wait of `seconds`, cut so it never sleeps past the node's or the run's deadline."""
+        remaining = self.remaining(node)
+        if remaining is None:
+            return seconds
+        return max(min(seconds, remaining), 0)
+
+
+_deadlines = Deadlines()
+
+
+def configure(run_seconds: float = None, node_seconds: float = None,
+              call_timeout: float = DEFAULT_CALL_TIMEOUT) -> Deadlines:
+    """Set the budgets of the run (the run's clock starts now)."""
+    global _deadlines
+    _deadlines = Deadlines(run_seconds, node_seconds, call_timeout)
+    return _deadlines
+
+
+def current() -> Deadlines:
+    return _deadlines
+
+
+def timeout_for(node: str = None) -> float:
+    """Timeout for the next call of `node` under the configured budgets (see Deadlines.timeout_for)."""
+    return _deadlines.timeout_for(node)
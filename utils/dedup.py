@@ -0,0 +1,140 @@
+"""
+Exact and near-duplicate detection for crawled files.
+
+Exact duplicates share a git blob SHA. Near-duplicates (vendored copies,
+generated stubs, per-locale variants) are found with MinHash signatures over
+5-token shingles and locality-sensitive hashing: files whose signatures share
+a band become candidates, and candidates whose estimated Jaccard similarity
+reaches the threshold are merged into one cluster.
+
+Signatures use one-permutation hashing (each shingle hash is routed to one of
+`NUM_HASHES` bins and each bin keeps its minimum), so a file is hashed in a
+single pass. Shingles are hashed with CRC-32, which keeps the clusters stable
+across runs and therefore keeps the downstream prompts (and their LLM cache
+keys) stable too.
+"""
+
+import zlib
+
+from utils.blob_store import git_blob_sha
+
+NUM_HASHES = 64
+BANDS = 8
+ROWS = NUM_HASHES // BANDS
+SHINGLE_TOKENS = 5
+# Files with fewer tokens than this are only collapsed when they are exact duplicates
+MIN_NEAR_DUPLICATE_TOKENS = 50
+# Collapsing tiny files (empty __init__.py etc.) saves nothing, so they are left alone
+MIN_DUPLICATE_BYTES = 100
+_EMPTY_BIN = 1 << 32
+
+
+def minhash_signature(data: bytes):
+    """
+    MinHash signature of a file's 5-token shingles, or None if the file is too short.
+
+    Args:
+        data (bytes): Raw file bytes
+
+    Returns:
+        tuple: NUM_HASHES integers, comparable slot by slot between files
+    """
+    tokens = data.split()
+    if len(tokens) < MIN_NEAR_DUPLICATE_TOKENS:
+        return None
+    bins = [_EMPTY_BIN] * NUM_HASHES
+    for start in range(len(tokens) - SHINGLE_TOKENS + 1):
+        value = zlib.crc32(b" ".join(tokens[start:start + SHINGLE_TOKENS]))
+        slot = value % NUM_HASHES
+        if value < bins[slot]:
+            bins[slot] = value
+    # Densify: empty bins borrow the value of the next filled bin (rotation)
+    for slot in range(NUM_HASHES):
+        if bins[slot] == _EMPTY_BIN:
+            offset = 1
+            while bins[(slot + offset) % NUM_HASHES] == _EMPTY_BIN:
+                offset += 1
+            bins[slot] = bins[(slot + offset) % NUM_HASHES] + offset * _EMPTY_BIN
+    return tuple(bins)
+
+
+def estimated_similarity(signature_a, signature_b) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(a == b for a, b in zip(signature_a, signature_b)) / NUM_HASHES
+
+
+def find_duplicates(files, near_threshold: float = 0.85):
+    """
+    Cluster exact and near-duplicate files.
+
+    Args:
+        files (FileStore): Crawled files
+        near_threshold (float): Minimum estimated Jaccard similarity for two files to count as
+                                near-duplicates. Values above 1 disable near-duplicate detection.
+
+    Returns:
+        tuple: (duplicates, stats) where duplicates maps each collapsed file index to the index of
+               its cluster's representative (the lowest index in the cluster), and stats counts
+               exact and near-duplicate members.
+    """
+    parent = list(range(len(files)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    # --- Exact duplicates: same blob SHA ---
+    exact_members = set()
+    first_by_sha = {}
+    unique = []
+    for index in range(len(files)):
+        if files.size(index) < MIN_DUPLICATE_BYTES:
+            continue
+        sha = files.sha(index) or git_blob_sha(files.raw(index))
+        if sha in first_by_sha:
+            union(first_by_sha[sha], index)
+            exact_members.add(index)
+        else:
+            first_by_sha[sha] = index
+            unique.append(index)
+
+    # --- Near duplicates: LSH over MinHash signatures of the unique files ---
+    near_members = set()
+    if near_threshold <= 1:
+        signatures = {}
+        buckets = {}
+        for index in unique:
+            signature = minhash_signature(files.raw(index))
+            if signature is None:
+                continue
+            signatures[index] = signature
+            for band in range(BANDS):
+                key = (band, signature[band * ROWS:(band + 1) * ROWS])
+                buckets.setdefault(key, []).append(index)
+
+        checked = set()
+        for members in buckets.values():
+            for position, i in enumerate(members):
+                for j in members[position + 1:]:
+                    if (i, j) in checked:
+                        continue
+                    checked.add((i, j))
+                    if estimated_similarity(signatures[i], signatures[j]) >= near_threshold:
+                        union(i, j)
+
+        near_members = {i for i in unique if find(i) != i}
+
+    duplicates = {i: find(i) for i in range(len(files)) if find(i) != i}
+    stats = {
+        "exact_duplicates": len(exact_members),
+        "near_duplicates": len(near_members),
+        "clusters": len({rep for rep in duplicates.values()}),
+    }
+    return duplicates, stats
@@ -0,0 +1,337 @@
+"""
+File importance ranking.
+
+When a repository does not fit the context budget, the prompt should carry
+the files that explain the most, not the first ones the crawl happened to
+list. `rank_files` scores every file from five signals, each normalized to
+[0, 1]:
+
+- centrality: PageRank over the import graph (Python, JS/TS, Go, Java/Kotlin,
+  Rust and C/C++ imports resolved to files of the repository);
+- entry point: well-known entry file names (`main.py`, `index.ts`, ...) and
+  `cmd/` / `bin/` directories;
+- symbols: number of declarations (log-scaled), from the same line patterns
+  as the large-file outlines;
+- depth: shallow paths score higher;
+- README references: files whose path, name or module is mentioned in a README;
+- history (git sources only): churn, recency and author count from
+  `utils/git_history.py`, which takes `HISTORY_WEIGHT` of the total.
+
+`select_by_score` then packs the best files into a character budget while
+keeping them in index order, so prompts stay deterministic.
+"""
+
+import math
+import os
+import posixpath
+import re
+
+from utils.large_files import is_outline_line
+
+WEIGHTS = {
+    "centrality": 0.35,
+    "entry_point": 0.2,
+    "symbols": 0.2,
+    "readme": 0.15,
+    "depth": 0.1,
+}
+# Share of the score taken by the git history signal when history is available
+HISTORY_WEIGHT = 0.25
+PAGERANK_DAMPING = 0.85
+PAGERANK_ITERATIONS = 30
+# Imports are read from the start of each file only
+IMPORT_SCAN_CHARS = 64 * 1024
+
+ENTRY_POINT_NAMES = {
+    "main.py", "__main__.py", "app.py", "cli.py", "manage.py", "server.py", "wsgi.py", "asgi.py",
+    "index.js", "index.ts", "main.js", "main.ts", "app.js", "app.ts", "server.js", "server.ts",
+    "main.go", "main.rs", "lib.rs", "Main.java", "Application.java", "Program.cs",
+    "main.c", "main.cc", "main.cpp", "Main.kt",
+}
+PACKAGE_ENTRY_NAMES = {"__init__.py", "mod.rs", "index.jsx", "index.tsx", "package-info.java"}
+ENTRY_POINT_DIRS = {"cmd", "bin"}
+
+_SOURCE_EXTENSIONS = (
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".mjs", ".cjs", ".go", ".java", ".kt", ".scala",
+    ".rs", ".c", ".cc", ".cpp", ".h", ".hpp", ".cs", ".rb", ".php", ".swift",
+)
+_PYTHON_IMPORT = re.compile(r"^\s*import\s+([\w.]+(?:\s*,\s*[\w.]+)*)", re.M)
+_PYTHON_FROM = re.compile(r"^\s*from\s+(\.*[\w.]*)\s+import\s+\(?\s*([\w\s,*]+)", re.M)
+_JS_IMPORT = re.compile(r"""(?:\bfrom\s+|\bimport\s*\(?\s*|\brequire\s*\(\s*)["']([^"']+)["']""")
+_GO_IMPORT_BLOCK = re.compile(r"^import\s*\(([^)]*)\)", re.M)
+_GO_IMPORT = re.compile(r"""^import\s+(?:\w+\s+)?"([^"]+)\"""", re.M)
+_QUOTED = re.compile(r'"([^"]+)"')
+_JVM_IMPORT = re.compile(r"^\s*import\s+(?:static\s+)?([\w.]+)", re.M)
+_RUST_USE = re.compile(r"^\s*(?:pub\s+)?use\s+(?:crate|super|self)?(?:::)?([\w:]+)", re.M)
+_RUST_MOD = re.compile(r"^\s*(?:pub\s+)?mod\s+(\w+)\s*;", re.M)
+_C_INCLUDE = re.compile(r'^\s*#\s*include\s+"([^"]+)"', re.M)
+
+
+def _module_name(path: str) -> str:
+    """Dotted module name of a file path ("pkg/core.py" -> "pkg.core", "pkg/__init__.py" -> "pkg")."""
+    stem, _ = posixpath.splitext(path)
+    parts = [part for part in stem.split("/") if part]
+    if len(parts) > 1 and parts[-1] in ("__init__", "index", "mod"):
+        parts.pop()
+    return ".".join(parts)
+
+
+class _ModuleIndex:
+    """Resolves import strings to file indices by module name, path suffix or directory."""
+
+    def __init__(self, paths):
+        self.by_name = {}
+        self.by_suffix = {}
+        self.by_dir = {}
+        for index, path in paths.items():
+            name = _module_name(path)
+            self.by_name.setdefault(name, []).append(index)
+            parts = name.split(".")
+            for start in range(1, len(parts)):
+                self.by_suffix.setdefault(".".join(parts[start:]), []).append(index)
+            directory = posixpath.dirname(path).split("/")
+            for start in range(len(directory)):
+                self.by_dir.setdefault(".".join(directory[start:]), []).append(index)
+
+    def module(self, name: str):
+        name = name.strip(".")
+        if not name:
+            return []
+        return self.by_name.get(name) or self.by_suffix.get(name) or []
+
+    def package(self, name: str):
+        return self.by_dir.get(name.strip("."), [])
+
+
+def _python_imports(path, text, modules):
+    package = _module_name(path).split(".")
+    if posixpath.basename(path) != "__init__.py":
+        package = package[:-1]
+    targets = []
+    for match in _PYTHON_IMPORT.finditer(text):
+        for name in match.group(1).split(","):
+            name = name.strip()
+            # "import a.b.c" may name a module or an attribute of one
+            while name and not modules.module(name):
+                name = name.rpartition(".")[0]
+            targets += modules.module(name)
+    for match in _PYTHON_FROM.finditer(text):
+        source = match.group(1)
+        level = len(source) - len(source.lstrip("."))
+        if level:
+            base = package[:len(package) - (level - 1)] if level > 1 else package
+            source = ".".join(base + [source.lstrip(".")] if source.lstrip(".") else base)
+        names = [name.strip() for name in match.group(2).replace("\n", " ").split(",")]
+        submodules = [index for name in names if name and name != "*"
+                      for index in modules.module(f"{source}.{name}")]
+        targets += submodules or modules.module(source)
+    return targets
+
+
+def _js_imports(path, text, modules):
+    targets = []
+    for spec in _JS_IMPORT.findall(text):
+        if spec.startswith("."):
+            spec = posixpath.normpath(posixpath.join(posixpath.dirname(path), spec))
+        elif spec.startswith(("@/", "~/")):
+            spec = spec[2:]
+        spec = re.sub(r"\.(js|jsx|ts|tsx|mjs|cjs)$", "", spec)
+        targets += modules.module(spec.replace("/", "."))
+    return targets
+
+
+def _go_imports(path, text, modules):
+    specs = _GO_IMPORT.findall(text)
+    for block in _GO_IMPORT_BLOCK.findall(text):
+        specs += _QUOTED.findall(block)
+    targets = []
+    for spec in specs:
+        # Go imports name a package directory; match the longest directory suffix that exists
+        parts = spec.split("/")
+        for start in range(len(parts)):
+            found = modules.package(".".join(parts[start:]))
+            if found:
+                targets += found
+                break
+    return targets
+
+
+def _jvm_imports(path, text, modules):
+    return [index for name in _JVM_IMPORT.findall(text) for index in modules.module(name)]
+
+
+def _rust_imports(path, text, modules):
+    targets = []
+    for name in _RUST_USE.findall(text):
+        name = name.replace("::", ".")
+        while name and not modules.module(name):
+            name = name.rpartition(".")[0]
+        targets += modules.module(name)
+    directory = posixpath.dirname(path)
+    for name in _RUST_MOD.findall(text):
+        targets += modules.module(_module_name(posixpath.join(directory, name + ".rs")))
+    return targets
+
+
+def _c_imports(path, text, modules):
+    targets = []
+    for spec in _C_INCLUDE.findall(text):
+        spec = posixpath.normpath(posixpath.join(posixpath.dirname(path), spec))
+        targets += modules.module(_module_name(spec)) or modules.module(_module_name(posixpath.basename(spec)))
+    return targets
+
+
+_IMPORT_PARSERS = {
+    ".py": _python_imports,
+    ".js": _js_imports, ".jsx": _js_imports, ".ts": _js_imports, ".tsx": _js_imports,
+    ".mjs": _js_imports, ".cjs": _js_imports, ".vue": _js_imports, ".svelte": _js_imports,
+    ".go": _go_imports,
+    ".java": _jvm_imports, ".kt": _jvm_imports, ".scala": _jvm_imports,
+    ".rs": _rust_imports,
+    ".c": _c_imports, ".cc": _c_imports, ".cpp": _c_imports, ".h": _c_imports, ".hpp": _c_imports,
+}
+
+
+def pagerank(edges, nodes):
+    """
+    PageRank of `nodes` over directed `edges`.
+
+    Args:
+        edges (dict): node -> list of target nodes (repeated targets add weight)
+        nodes (list): All nodes; dangling nodes spread their rank evenly
+
+    Returns:
+        dict: node -> rank, summing to 1
+    """
+    if not nodes:
+        return {}
+    count = len(nodes)
+    rank = {node: 1 / count for node in nodes}
+    for _ in range(PAGERANK_ITERATIONS):
+        incoming = {node: 0.0 for node in nodes}
+        dangling = 0.0
+        for node in nodes:
+            targets = edges.get(node)
+            if not targets:
+                dangling += rank[node]
+                continue
+            share = rank[node] / len(targets)
+            for target in targets:
+                incoming[target] += share
+        base = (1 - PAGERANK_DAMPING) / count + PAGERANK_DAMPING * dangling / count
+        rank = {node: base + PAGERANK_DAMPING * incoming[node] for node in nodes}
+    return rank
+
+
+def _normalized(values: dict) -> dict:
+    top = max(values.values(), default=0)
+    return {key: (value / top if top else 0.0) for key, value in values.items()}
+
+
+def _entry_point_score(path: str) -> float:
+    name = posixpath.basename(path)
+    if name in ENTRY_POINT_NAMES:
+        return 1.0
+    if ENTRY_POINT_DIRS & set(path.split("/")[:-1]):
+        return 0.8
+    if name in PACKAGE_ENTRY_NAMES:
+        return 0.5
+    return 0.0
+
+
+def rank_files(files, duplicates=None, history=None):
+    """
+    Score every file by importance.
+
+    Args:
+        files (FileStore): Crawled files
+        duplicates (dict, optional): Collapsed file index -> representative index; collapsed
+                                     files score 0 and imports of them count for their representative
+        history (dict, optional): path -> history score in [0, 1] (see git_history.history_scores),
+                                  with paths relative to the crawl root
+
+    Returns:
+        tuple: (scores, signals) where scores is a list of floats in [0, 1] by file index and
+               signals maps each signal name to its normalized per-index values
+    """
+    duplicates = duplicates or {}
+    paths = {index: files.path(index).replace(os.sep, "/")
+             for index in range(len(files)) if index not in duplicates}
+    modules = _ModuleIndex(paths)
+
+    edges, symbols, readme_texts = {}, {}, []
+    for index, path in paths.items():
+        text = files.raw(index).decode("utf-8", errors="replace")
+        extension = posixpath.splitext(path)[1].lower()
+        if posixpath.basename(path).lower().startswith("readme"):
+            readme_texts.append(text)
+        parser = _IMPORT_PARSERS.get(extension)
+        if parser:
+            targets = [duplicates.get(target, target) for target in parser(path, text[:IMPORT_SCAN_CHARS], modules)]
+            edges[index] = [target for target in targets if target != index]
+        if extension in _SOURCE_EXTENSIONS:
+            symbols[index] = math.log1p(sum(is_outline_line(line) for line in text.splitlines()))
+
+    readme = "\n".join(readme_texts)
+    nodes = list(paths)
+    signals = {
+        "centrality": _normalized(pagerank(edges, nodes)),
+        "entry_point": {index: _entry_point_score(path) for index, path in paths.items()},
+        "symbols": _normalized({index: symbols.get(index, 0.0) for index in nodes}),
+        "depth": {index: 1 / (1 + path.count("/")) for index, path in paths.items()},
+        "readme": {index: _readme_score(path, readme) for index, path in paths.items()},
+    }
+    weights = dict(WEIGHTS)
+    if history:
+        signals["history"] = {index: history.get(path, 0.0) for index, path in paths.items()}
+        weights = {name: weight * (1 - HISTORY_WEIGHT) for name, weight in weights.items()}
+        weights["history"] = HISTORY_WEIGHT
+
+    scores = [0.0] * len(files)
+    for index in nodes:
+        scores[index] = sum(weight * signals[name][index] for name, weight in weights.items())
+    return scores, signals
+
+
+def _readme_score(path: str, readme: str) -> float:
+    if not readme or posixpath.basename(path).lower().startswith("readme"):
+        return 0.0
+    if path in readme:
+        return 1.0
+    name = posixpath.basename(path)
+    module = _module_name(path)
+    # Generic names ("__init__.py", "utils.py") are mentioned everywhere and do not count
+    if len(module) > 4 and "." in module and module in readme:
+        return 0.6
+    if name not in PACKAGE_ENTRY_NAMES and len(posixpath.splitext(name)[0]) > 4 and name in readme:
+        return 0.6
+    return 0.0
+
+
+def select_by_score(indices, scores, sizes, budget=None):
+    """
+    Pick the highest-scoring files that fit a character budget.
+
+    Args:
+        indices (list of int): Candidate file indices
+        scores (list of float): Score per file index (see rank_files); None keeps every candidate
+        sizes (callable): Returns the context size of a file index
+        budget (int, optional): Character budget; None keeps every candidate
+
+    Returns:
+        list: The selected indices, in their original order. When not even one
+              file fits (e.g. the budget is used up), only the top-scoring file
+    """
+    if budget is None or scores is None:
+        return list(indices)
+    ranked = sorted(indices, key=lambda i: (-scores[i], i))
+    selected, used = set(), 0
+    for index in ranked:
+        size = sizes(index)
+        if used + size <= budget:
+            selected.add(index)
+            used += size
+    if not selected and ranked:
+        # Some code is still needed to identify anything
+        selected.add(ranked[0])
+    return [index for index in indices if index in selected]
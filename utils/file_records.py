@@ -0,0 +1,74 @@
+"""
+File records streamed by the crawler generators.
+
+`iter_local_files`, `iter_git_index` and `iter_github_files` yield one
+`FileRecord` per accepted file as soon as it is available, so consumers such
+as `FetchRepo` can start working before the crawl finishes and never hold a
+second full copy of the repository. The `crawl_*` functions drain the same
+streams into the `{"files": {path: content}}` dicts they always returned.
+"""
+
+
+class FileRecord:
+    """
+    One crawled file.
+
+    Args:
+        path (str): Path used as the file's key (relative to the crawl root when requested)
+        size (int): Size in bytes as reported by the source
+        sha (str, optional): Git blob SHA of the file bytes, if known
+        content (str, optional): Already loaded text
+        loader (callable, optional): Returns the text on demand; lets `release()` drop
+                                     loaded text and reload it later
+        from_cache (bool): The loader reads from the content-addressed crawl cache, so the
+                           reloaded text can never change
+    """
+
+    __slots__ = ("path", "size", "sha", "from_cache", "_content", "_loader")
+
+    def __init__(self, path, size, sha=None, content=None, loader=None, from_cache=False):
+        self.path = path
+        self.size = size
+        self.sha = sha
+        self.from_cache = from_cache
+        self._content = content
+        self._loader = loader
+
+    @property
+    def content(self):
+        """The file text, loaded on first access."""
+        if self._content is None and self._loader is not None:
+            self._content = self._loader()
+        return self._content
+
+    @property
+    def loader(self):
+        """The callable that reloads the text, or None."""
+        return self._loader
+
+    def release(self):
+        """Drop the loaded text if it can be loaded again."""
+        if self._loader is not None:
+            self._content = None
+
+    def __repr__(self):
+        return f"FileRecord({self.path!r}, size={self.size}, sha={self.sha!r})"
+
+
+def collect_files(records):
+    """
+    Drain a record stream into a path -> content dict.
+
+    Args:
+        records (generator): Stream of FileRecord objects
+
+    Returns:
+        tuple: (files dict, the generator's return value, e.g. crawl statistics)
+    """
+    files = {}
+    while True:
+        try:
+            record = next(records)
+        except StopIteration as done:
+            return files, done.value
+        files[record.path] = record.content
@@ -0,0 +1,219 @@
+"""
+Lazy content store for crawled files.
+
+`FileStore` replaces the list of `(path, content)` tuples in
+`shared["files"]`. Only paths, sizes, hashes and offsets stay in memory; file
+text lives either in the content-addressed crawl cache (for files fetched
+through the blob store) or in an anonymous spill file that is memory-mapped
+for reads. A small LRU keeps recently decoded texts, so nodes that touch the
+same files repeatedly do not decode them again.
+
+The pack file is the arena: every spilled file's UTF-8 bytes are stored once,
+back to back, and addressed through an (offset, length) table. Prompt
+contexts are assembled from these bytes by `utils/context_builder.py`, which
+reuses rendered per-file blocks (header + body) cached here.
+
+The store behaves like the old list: `len(store)`, `store[i]` returns
+`(path, content)` and iteration yields `(path, content)` tuples, so nodes keep
+referring to files by index.
+"""
+
+import mmap
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Decoded texts kept in memory (in characters, roughly bytes for source code)
+DEFAULT_MAX_CACHED_CHARS = 16 * 1024 * 1024
+
+
+class FileStore:
+    """
+    Index-addressed, on-demand file content store.
+
+    Args:
+        spill_dir (str, optional): Directory for the spill pack file (default: system temp dir)
+        max_cached_chars (int): Upper bound on the decoded text kept in the LRU
+    """
+
+    def __init__(self, spill_dir: str = None, max_cached_chars: int = DEFAULT_MAX_CACHED_CHARS):
+        self.spill_dir = spill_dir
+        self.max_cached_chars = max_cached_chars
+        self._paths = []
+        self._sizes = []
+        self._shas = []
+        # Per file either ("pack", offset, length) or ("loader", callable, length)
+        self._locations = []
+        self._pack = None
+        self._pack_size = 0
+        self._mmap = None
+        self._mapped_size = 0
+        self._lru = OrderedDict()
+        self._cached_chars = 0
+        self._blocks = OrderedDict()
+        self._cached_block_bytes = 0
+        self._lock = threading.Lock()
+        # Crawl statistics returned by the record generator, if any
+        self.stats = {}
+
+    @classmethod
+    def from_records(cls, records, **kwargs):
+        """
+        Build a store from a stream of FileRecords, releasing each record's text once stored.
+        The generator's return value (the crawl statistics) is kept in `store.stats`.
+        """
+        store = cls(**kwargs)
+        records = iter(records)
+        while True:
+            try:
+                record = next(records)
+            except StopIteration as done:
+                store.stats = done.value or {}
+                return store
+            store.add_record(record)
+
+    def add(self, path: str, content: str, size: int = None, sha: str = None) -> int:
+        """Append a file by spilling its text to the pack file. Returns the file's index."""
+        data = content.encode("utf-8")
+        with self._lock:
+            if self._pack is None:
+                self._pack = tempfile.TemporaryFile(prefix="filestore-", suffix=".pack", dir=self.spill_dir)
+            self._pack.seek(self._pack_size)
+            self._pack.write(data)
+            location = ("pack", self._pack_size, len(data))
+            self._pack_size += len(data)
+            return self._append(path, size if size is not None else len(data), sha, location)
+
+    def add_record(self, record) -> int:
+        """
+        Append a FileRecord. Records whose text can be reloaded from the crawl cache
+        keep only that reference; everything else is spilled to the pack file.
+        """
+        if record.from_cache:
+            loader = record.loader
+            # Measured while the text is at hand, so sizing the file later does not reload it
+            length = len(record.content.encode("utf-8"))
+            record.release()
+            with self._lock:
+                return self._append(record.path, record.size, record.sha, ("loader", loader, length))
+        index = self.add(record.path, record.content, record.size, record.sha)
+        record.release()
+        return index
+
+    def _append(self, path, size, sha, location) -> int:
+        self._paths.append(path)
+        self._sizes.append(size)
+        self._shas.append(sha)
+        self._locations.append(location)
+        return len(self._paths) - 1
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._paths[index], self.content(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def path(self, index: int) -> str:
+        return self._paths[index]
+
+    def paths(self) -> list:
+        return list(self._paths)
+
+    def size(self, index: int) -> int:
+        return self._sizes[index]
+
+    def sha(self, index: int):
+        return self._shas[index]
+
+    def stored_size(self, index: int) -> int:
+        """Bytes of text stored for the file (differs from `size` for outlined large files)."""
+        return self._locations[index][2]
+
+    def content(self, index: int) -> str:
+        """Text of the file at `index`, from the LRU or loaded on demand."""
+        index = range(len(self))[index]  # Normalize negative indices, raise IndexError like a list
+        with self._lock:
+            if index in self._lru:
+                self._lru.move_to_end(index)
+                return self._lru[index]
+            location = self._locations[index]
+            if location[0] == "pack":
+                text = self._read_pack(location[1], location[2]).decode("utf-8")
+        if location[0] == "loader":
+            text = location[1]()
+        self._remember(index, text)
+        return text
+
+    def raw(self, index: int) -> bytes:
+        """UTF-8 bytes of the file at `index`, read straight from the pack without decoding."""
+        index = range(len(self))[index]
+        with self._lock:
+            location = self._locations[index]
+            if location[0] == "pack":
+                return self._read_pack(location[1], location[2])
+        return self.content(index).encode("utf-8")
+
+    def block(self, index: int, header: str = "", trailer: str = "") -> bytes:
+        """
+        UTF-8 bytes of `header + file text + trailer`, cached per (index, header, trailer)
+        so files that appear in several prompts are rendered once.
+        """
+        key = (index, header, trailer)
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                return self._blocks[key]
+        rendered = b"".join((header.encode("utf-8"), self.raw(index), trailer.encode("utf-8")))
+        if len(rendered) <= self.max_cached_chars:
+            with self._lock:
+                if key not in self._blocks:
+                    self._blocks[key] = rendered
+                    self._cached_block_bytes += len(rendered)
+                while self._cached_block_bytes > self.max_cached_chars:
+                    _, evicted = self._blocks.popitem(last=False)
+                    self._cached_block_bytes -= len(evicted)
+        return rendered
+
+    def _read_pack(self, offset: int, length: int) -> bytes:
+        if length == 0:
+            return b""
+        if self._mmap is None or self._mapped_size < offset + length:
+            # The pack grew since it was mapped; remap it (called with the lock held)
+            self._pack.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._pack.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = self._pack_size
+        return self._mmap[offset:offset + length]
+
+    def _remember(self, index: int, text: str) -> None:
+        if len(text) > self.max_cached_chars:
+            return
+        with self._lock:
+            if index in self._lru:
+                return
+            self._lru[index] = text
+            self._cached_chars += len(text)
+            while self._cached_chars > self.max_cached_chars:
+                _, evicted = self._lru.popitem(last=False)
+                self._cached_chars -= len(evicted)
+
+    def close(self) -> None:
+        """Release the memory map and delete the spill file."""
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if self._pack is not None:
+                self._pack.close()
+                self._pack = None
+            self._lru.clear()
+            self._cached_chars = 0
+            self._blocks.clear()
+            self._cached_block_bytes = 0
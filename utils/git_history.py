@@ -0,0 +1,142 @@
+"""
+Per-file churn and recency from git history.
+
+Files that change often, changed recently and were touched by many authors
+are usually the ones a newcomer needs to understand first. `analyze_history`
+collects these statistics for every file in a single streamed
+`git log --numstat` pass over a time window (instead of one query per file)
+and caches them under the crawl cache keyed by the analyzed commit (HEAD, or
+the ref that was crawled), so repeated runs on the same commit do not walk the
+history again.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import os
+import subprocess
+
+from utils.blob_store import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW_DAYS = 365
+# Bounds the walk on very long histories
+MAX_COMMITS = 20000
+# Recency halves every this many days
+RECENCY_HALF_LIFE_DAYS = 90
+# Commit header lines start with a NUL byte, which cannot appear in a numstat line
+_COMMIT_MARKER = "\x00"
+
+
+def _git(directory, *args):
+    return subprocess.run(
+        ["git", "-C", directory, *args], capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def analyze_history(directory: str, window_days: int = DEFAULT_WINDOW_DAYS, cache_dir: str = None,
+                    max_commits: int = MAX_COMMITS, ref: str = None):
+    """
+    Collect per-file history statistics for the files below `directory`.
+
+    Args:
+        directory (str): Directory inside a git working tree (or a clone)
+        window_days (int): Only commits from the last `window_days` days before the analyzed commit count
+        cache_dir (str, optional): Root of the crawl cache (default: CRAWL_CACHE_DIR or '.crawl_cache')
+        max_commits (int): Upper bound on the number of commits read
+        ref (str, optional): Commit, branch or tag whose history is read (default: HEAD)
+
+    Returns:
+        dict: path relative to `directory` ("/" separators) -> {"commits": int, "lines": int,
+              "authors": int, "last_change": unix timestamp}, or None if `directory` is not in
+              a git repository with commits (or `ref` does not name a commit)
+    """
+    try:
+        # Peel tags to their commit, so the cache is keyed by what is actually analyzed
+        head = _git(directory, "rev-parse", "--verify", f"{ref or 'HEAD'}^{{commit}}")
+        prefix = _git(directory, "rev-parse", "--show-prefix")
+        head_time = int(_git(directory, "log", "-1", "--format=%ct", head))
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+    key = hashlib.sha1(f"{head}|{prefix}|{window_days}|{max_commits}".encode("utf-8")).hexdigest()
+    cache_file = os.path.join(cache_dir or DEFAULT_CACHE_DIR, "history", f"{key}.json")
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load history cache {cache_file}: {e}")
+
+    # The window is anchored at the analyzed commit's time, so the result depends only on that commit
+    since = head_time - window_days * 86400
+    command = [
+        "git", "-c", "core.quotepath=off", "-C", directory, "log", "--numstat", "--no-renames", "--relative",
+        f"--max-count={max_commits}", f"--since={since}", "--format=%x00%at%x09%aE", head, "--", ".",
+    ]
+    history = {}
+    authors = {}
+    commit_time, author = head_time, ""
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          text=True, encoding="utf-8", errors="replace") as process:
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            if line.startswith(_COMMIT_MARKER):
+                timestamp, _, author = line[1:].partition("\t")
+                commit_time = int(timestamp or head_time)
+                continue
+            fields = line.split("\t", 2)
+            if len(fields) != 3:
+                continue
+            added, deleted, path = fields
+            entry = history.setdefault(path, {"commits": 0, "lines": 0, "authors": 0, "last_change": 0})
+            entry["commits"] += 1
+            # Binary files report "-" for both counts
+            entry["lines"] += (int(added) if added.isdigit() else 0) + (int(deleted) if deleted.isdigit() else 0)
+            entry["last_change"] = max(entry["last_change"], commit_time)
+            authors.setdefault(path, set()).add(author)
+    if process.returncode not in (0, None):
+        return None
+    for path, names in authors.items():
+        history[path]["authors"] = len(names)
+
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = cache_file + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(history, f)
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        logger.warning(f"Failed to save history cache {cache_file}: {e}")
+    return history
+
+
+def history_scores(history: dict) -> dict:
+    """
+    Combine history statistics into one score per path.
+
+    Churn (commits and changed lines, log-scaled), recency (halving every
+    RECENCY_HALF_LIFE_DAYS before the newest change) and author count are each
+    normalized to [0, 1] and weighted 0.5 / 0.3 / 0.2.
+
+    Args:
+        history (dict): Output of analyze_history
+
+    Returns:
+        dict: path -> score in [0, 1]
+    """
+    if not history:
+        return {}
+    newest = max(entry["last_change"] for entry in history.values())
+    max_commits = max(math.log1p(entry["commits"]) for entry in history.values()) or 1
+    max_lines = max(math.log1p(entry["lines"]) for entry in history.values()) or 1
+    max_authors = max(math.log1p(entry["authors"]) for entry in history.values()) or 1
+    scores = {}
+    for path, entry in history.items():
+        churn = (math.log1p(entry["commits"]) / max_commits + math.log1p(entry["lines"]) / max_lines) / 2
+        recency = 0.5 ** ((newest - entry["last_change"]) / 86400 / RECENCY_HALF_LIFE_DAYS)
+        authors = math.log1p(entry["authors"]) / max_authors
+        scores[path] = 0.5 * churn + 0.3 * recency + 0.2 * authors
+    return scores
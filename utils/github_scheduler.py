@@ -0,0 +1,281 @@
+"""
+Rate-limit-aware request scheduler for the GitHub API.
+
+Every response updates the scheduler's view of `X-RateLimit-Remaining` and
+`X-RateLimit-Reset` for the token that made it. While plenty of budget is
+left, requests go out as fast as the workers issue them; once the budget runs
+low the remaining requests are spread evenly over the time left until the
+reset. Primary rate limits (no remaining budget) drain the token until its
+reset, secondary rate limits honour `Retry-After` or back off exponentially.
+
+With several tokens, each request is routed to the token with the most
+headroom, so crawl throughput scales with the number of tokens.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Secondary rate limits without Retry-After: GitHub asks for at least a minute,
+# doubled per attempt but never longer than MAX_BACKOFF seconds per wait
+BASE_BACKOFF = 60
+MAX_BACKOFF = 300
+# A streamed 403/429 body is only read for its "rate limit" message below this size
+MAX_RATE_LIMIT_BODY_BYTES = 64 * 1024
+
+
+def _mask(token) -> str:
+    """Short, non-secret label for a token in logs."""
+    return f"...{token[-4:]}" if token else "anonymous"
+
+
+class GitHubTokenPool:
+    """
+    Tracks the remaining quota of each GitHub token and hands out the one with
+    the most headroom. A pool built without tokens holds a single anonymous
+    entry, so unauthenticated crawls use the same accounting.
+    """
+
+    def __init__(self, tokens=None):
+        tokens = [t for t in dict.fromkeys(tokens or []) if t] or [None]
+        self._state = {t: {"remaining": None, "reset_at": None} for t in tokens}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._state)
+
+    @staticmethod
+    def _available(state: dict, now: float) -> bool:
+        if state["remaining"] is None or state["remaining"] > 0:
+            return True
+        # Exhausted tokens come back once their window resets
+        return state["reset_at"] is not None and state["reset_at"] <= now
+
+    def acquire(self, reserve: bool = True):
+        """
+        Pick the token with the most remaining quota.
+
+        Args:
+            reserve (bool): Count the request against the token's budget before its
+                            response arrives, so concurrent workers spread out.
+
+        Returns:
+            tuple: (token, wait_seconds). wait_seconds is 0 when a token is available,
+                   otherwise the time until the earliest exhausted token resets.
+        """
+        now = time.time()
+        with self._lock:
+            available = [t for t, s in self._state.items() if self._available(s, now)]
+            if not available:
+                earliest = min(s["reset_at"] for s in self._state.values())
+                return None, max(earliest - now, 0) + 1
+
+            def headroom(token):
+                state = self._state[token]
+                if state["remaining"] is None or (state["reset_at"] or 0) <= now:
+                    return float("inf")
+                return state["remaining"]
+
+            token = max(available, key=headroom)
+            state = self._state[token]
+            if state["reset_at"] is not None and state["reset_at"] <= now:
+                state["remaining"] = None  # Window reset; wait for fresh headers
+            if reserve and state["remaining"] is not None:
+                state["remaining"] -= 1
+            return token, 0
+
+    def update(self, token, response: requests.Response) -> None:
+        """Record the quota reported by a response made with `token`."""
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return
+        try:
+            remaining, reset = int(remaining), int(reset)
+        except ValueError:
+            return
+        with self._lock:
+            state = self._state.get(token)
+            if state is None:
+                return
+            # Responses can arrive out of order; keep the most pessimistic view per window
+            if state["reset_at"] is None or reset > state["reset_at"]:
+                state["remaining"], state["reset_at"] = remaining, reset
+            elif reset == state["reset_at"]:
+                state["remaining"] = min(state["remaining"] if state["remaining"] is not None else remaining, remaining)
+
+    def drain(self, token, reset_at: float) -> None:
+        """Take an exhausted token out of rotation until `reset_at`."""
+        with self._lock:
+            state = self._state.get(token)
+            if state is None:
+                return
+            state["remaining"], state["reset_at"] = 0, reset_at
+        if len(self._state) > 1:
+            print(f"GitHub token {_mask(token)} exhausted until {time.strftime('%H:%M:%S', time.localtime(reset_at))}, "
+                  f"routing requests to the remaining tokens")
+
+    def budget(self, now: float):
+        """
+        Aggregate (remaining, reset_at) across usable tokens, or (None, None) while
+        any token's quota is still unknown.
+        """
+        with self._lock:
+            remaining, reset_at = 0, now
+            for state in self._state.values():
+                if state["remaining"] is None or state["reset_at"] is None or state["reset_at"] <= now:
+                    return None, None
+                remaining += state["remaining"]
+                reset_at = max(reset_at, state["reset_at"])
+            return remaining, reset_at
+
+    def snapshot(self) -> dict:
+        """Per-token quota view for crawl statistics (tokens are masked)."""
+        with self._lock:
+            return {_mask(t): dict(s) for t, s in self._state.items()}
+
+
+class GitHubRequestScheduler:
+    """
+    Thread-safe GET scheduler shared by all crawl workers.
+
+    Args:
+        tokens (list of str, optional): GitHub tokens to rotate between. The
+                                        Authorization header is set per request.
+        max_retries (int): Attempts per request after being rate limited (default: 5)
+        pace_threshold (int): Start spreading requests over the reset window once
+                              fewer than this many requests remain (default: 200)
+        timeout: Default `requests` timeout for each call (default: (30, 30))
+    """
+
+    def __init__(self, tokens=None, max_retries: int = 5, pace_threshold: int = 200, timeout=(30, 30)):
+        self.pool = GitHubTokenPool(tokens)
+        self.max_retries = max_retries
+        self.pace_threshold = pace_threshold
+        self.timeout = timeout
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._blocked_until = 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        # requests.Session is not guaranteed thread-safe, so keep one per worker thread
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def get(self, url: str, headers: dict = None, params: dict = None, timeout=None,
+            stream: bool = False, paced: bool = True) -> requests.Response:
+        """
+        Scheduled GET with the same call shape as `requests.get`.
+
+        Args:
+            paced (bool): Apply API budget pacing. Pass False for hosts that are not
+                          metered by the REST API rate limit (e.g. raw.githubusercontent.com).
+        """
+        response = None
+        for attempt in range(self.max_retries + 1):
+            token = self._acquire(paced)
+            request_headers = dict(headers or {})
+            if token:
+                request_headers["Authorization"] = f"token {token}"
+
+            response = self.session.get(
+                url, headers=request_headers, params=params, timeout=timeout or self.timeout, stream=stream
+            )
+            self.pool.update(token, response)
+
+            limit = self._classify_rate_limit(response, attempt, stream)
+            if limit is None:
+                return response
+            if attempt < self.max_retries:
+                # Hand the pooled connection back before the retry (the last response goes to the caller)
+                response.close()
+
+            with self._lock:
+                self.rate_limited_count += 1
+            kind, value = limit
+            if kind == "primary":
+                # Drain this token; the next attempt picks another one or waits for a reset
+                self.pool.drain(token, value)
+                if len(self.pool) == 1:
+                    print(f"Rate limit exceeded. Waiting for {max(value - time.time(), 0) + 1:.0f} seconds...")
+            else:
+                with self._lock:
+                    self._blocked_until = max(self._blocked_until, time.time() + value)
+                print(f"Rate limit exceeded. Waiting for {value:.0f} seconds...")
+        return response
+
+    def _acquire(self, paced: bool):
+        """Block until the scheduler allows another request, then return the token to use."""
+        while True:
+            with self._lock:
+                now = time.time()
+                start = max(now, self._blocked_until)
+                if paced:
+                    start = max(start, self._next_slot)
+                    self._next_slot = start + self._pacing_interval(start)
+            if start > now:
+                time.sleep(start - now)
+
+            token, wait_time = self.pool.acquire(reserve=paced)
+            if wait_time == 0:
+                with self._lock:
+                    self.request_count += 1
+                return token
+            print(f"All GitHub tokens exhausted. Waiting for {wait_time:.0f} seconds...")
+            time.sleep(wait_time)
+
+    def _pacing_interval(self, now: float) -> float:
+        """Seconds to leave between paced requests given the remaining budget."""
+        remaining, reset_at = self.pool.budget(now)
+        if remaining is None or remaining >= self.pace_threshold:
+            return 0.0
+        window = max(reset_at - now, 0.0)
+        return window / max(remaining, 1)
+
+    @staticmethod
+    def _classify_rate_limit(response: requests.Response, attempt: int, stream: bool = False):
+        """
+        Return None if the response is not rate limited, ("primary", reset_at) when
+        the token's quota is used up, or ("secondary", wait_seconds) otherwise.
+
+        Retry-After is honoured first; without it (or without a usable
+        X-RateLimit-Reset), the wait backs off exponentially up to MAX_BACKOFF.
+        The body of a streamed response is only read if it is known to be small.
+        """
+        if response.status_code not in (403, 429):
+            return None
+
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return "secondary", max(float(retry_after), 1.0)
+            except ValueError:
+                pass
+
+        backoff = min(BASE_BACKOFF * (2 ** attempt), MAX_BACKOFF)
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                return "primary", float(response.headers["X-RateLimit-Reset"]) + 1
+            except (KeyError, ValueError):
+                return "secondary", backoff
+
+        if stream:
+            try:
+                body_size = int(response.headers["Content-Length"])
+            except (KeyError, ValueError):
+                return None
+            if body_size > MAX_RATE_LIMIT_BODY_BYTES:
+                return None
+        if "rate limit" in response.text.lower():
+            return "secondary", backoff
+
+        return None
@@ -0,0 +1,198 @@
+"""
+Conditional-request cache for GitHub API metadata.
+
+Stores the ETag / Last-Modified validators and body of successful GET
+responses per URL. Repeated requests send `If-None-Match` /
+`If-Modified-Since`; GitHub answers unchanged resources with
+`304 Not Modified`, which does not count against the rate limit, and the
+stored body is replayed to the caller as a normal 200 response.
+
+The JSON index holds only the validators; each body is a file of its own
+(large recursive tree listings included), and the least recently used bodies
+are evicted once they exceed a total size cap.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from utils.blob_store import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Total size of the stored response bodies; least recently used ones are evicted beyond it
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+# Larger bodies are not cached at all
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+
+class HttpMetadataCache:
+    """
+    Per-URL ETag/Last-Modified cache: a JSON index of validators plus one file per body.
+
+    Args:
+        cache_dir (str, optional): Root of the crawl cache (default: CRAWL_CACHE_DIR or '.crawl_cache')
+        max_bytes (int): Upper bound on the total size of the stored bodies
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        root = cache_dir or DEFAULT_CACHE_DIR
+        self.cache_file = os.path.join(root, "http_metadata.json")
+        self.body_dir = os.path.join(root, "http")
+        self.max_bytes = max_bytes
+        self.entries = self._load()
+        self.not_modified_count = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+                # Entries of the older format carried their body inline; they are refetched
+                return {key: entry for key, entry in entries.items() if "body_size" in entry}
+            except Exception as e:
+                logger.warning(f"Failed to load HTTP metadata cache: {e}")
+        return {}
+
+    def _body_path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.body_dir, digest[:2], digest[2:])
+
+    def _write_body(self, key: str, body: bytes) -> bool:
+        path = self._body_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            logger.warning(f"Failed to write HTTP cache body for {key}: {e}")
+            return False
+
+    def _read_body(self, key: str):
+        try:
+            with open(self._body_path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _evict(self) -> None:
+        """Drop the least recently used bodies beyond max_bytes (lock held)."""
+        total = sum(entry["body_size"] for entry in self.entries.values())
+        for key in sorted(self.entries, key=lambda k: self.entries[k].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(key)["body_size"]
+            try:
+                os.remove(self._body_path(key))
+            except OSError:
+                pass
+
+    def save(self) -> None:
+        """Persist the index to disk if anything changed, evicting bodies beyond the size cap."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._evict()
+            try:
+                os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+                tmp_file = self.cache_file + ".tmp"
+                with open(tmp_file, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_file, self.cache_file)
+                self._dirty = False
+            except Exception as e:
+                logger.warning(f"Failed to save HTTP metadata cache: {e}")
+
+    @staticmethod
+    def cache_key(url: str, params: dict = None) -> str:
+        if not params:
+            return url
+        return f"{url}?{urlencode(sorted(params.items()))}"
+
+    def get(self, url: str, headers: dict = None, params: dict = None, timeout=(30, 30), fetch=None):
+        """
+        Conditional GET. Behaves like `requests.get` and returns a Response.
+
+        Args:
+            url (str): Request URL
+            headers (dict, optional): Request headers (validators are added to a copy)
+            params (dict, optional): Query parameters
+            timeout: Passed through to the underlying request
+            fetch (callable, optional): Function used to perform the GET (default: requests.get)
+
+        Returns:
+            requests.Response: The live response, or the cached body replayed as a 200
+                               when the server answered 304 Not Modified.
+        """
+        fetch = fetch or requests.get
+        key = self.cache_key(url, params)
+        with self._lock:
+            entry = self.entries.get(key)
+        if entry and not os.path.exists(self._body_path(key)):
+            entry = None  # Body evicted or removed; revalidating would leave nothing to replay
+
+        request_headers = dict(headers or {})
+        if entry:
+            if entry.get("etag"):
+                request_headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                request_headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = fetch(url, headers=request_headers, params=params, timeout=timeout)
+
+        if response.status_code == 304 and entry:
+            body = self._read_body(key)
+            if body is not None:
+                with self._lock:
+                    self.not_modified_count += 1
+                    entry["last_used"] = time.time()
+                    self._dirty = True
+                logger.info(f"HTTP cache: 304 Not Modified for {key}")
+                return self._replay(entry, body, response)
+            # The body vanished since the check above: ask again without validators
+            return fetch(url, headers=headers, params=params, timeout=timeout)
+
+        if response.status_code == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            body = response.content
+            if (etag or last_modified) and len(body) <= min(MAX_BODY_BYTES, self.max_bytes) \
+                    and self._write_body(key, body):
+                with self._lock:
+                    self.entries[key] = {
+                        "etag": etag,
+                        "last_modified": last_modified,
+                        "content_type": response.headers.get("Content-Type"),
+                        "body_size": len(body),
+                        "last_used": time.time(),
+                    }
+                    self._dirty = True
+        return response
+
+    @staticmethod
+    def _replay(entry: dict, body: bytes, not_modified: requests.Response) -> requests.Response:
+        """Build a 200 response from a cache entry, keeping the fresh 304 headers (rate limits etc.)."""
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body
+        response.encoding = "utf-8"
+        response.url = not_modified.url
+        response.headers = CaseInsensitiveDict(not_modified.headers)
+        response.headers.pop("Content-Length", None)
+        if entry.get("content_type"):
+            response.headers["Content-Type"] = entry["content_type"]
+        response.from_cache = True
+        return response
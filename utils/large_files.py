@@ -0,0 +1,107 @@
+"""
+Compact outlines of files above the size limit.
+
+Files larger than `max_file_size` are often a project's central modules, so
+instead of dropping them the crawlers can keep an outline: the file is
+streamed in `CHUNK_BYTES` chunks, each chunk is reduced to its declaration
+lines (imports, classes, functions, types, constants, headings), and the
+outline stops growing once it reaches the prompt budget. Only one chunk and
+the outline are in memory at a time, whatever the size of the file.
+"""
+
+import codecs
+import posixpath
+import re
+
+from utils.content_classifier import PREFIX_BYTES, ContentRejected
+
+# Files above this size are still skipped, even in outline mode (bounds download time)
+LARGE_FILE_LIMIT = 64 * 1024 * 1024
+CHUNK_BYTES = 64 * 1024
+# Kept lines are shortened to this many characters
+MAX_OUTLINE_LINE = 200
+
+_DECLARATION = re.compile(
+    r"^\s*(?:(?:export|default|public|private|protected|internal|static|async|abstract|final|"
+    r"sealed|override|virtual|inline|extern|pub(?:\([\w:]+\))?|unsafe)\s+)*"
+    r"(?:def|class|function|func|fn|interface|struct|enum|trait|impl|module|namespace|type|"
+    r"package|import|from\s+\S+\s+import|using|#include|#define|@\w+|"
+    r"(?:const|let|var|val)\s+\w+\s*[:=]|"
+    r"[A-Z][A-Z0-9_]+\s*(?::[^=]+)?=)"
+)
+# Java/C#/C++ style signatures: modifiers, a return type, a name and an opening parenthesis
+_SIGNATURE = re.compile(r"^\s*(?:public|private|protected|internal|static)\b[^;=]*\(")
+_HEADING = re.compile(r"^#{1,6}\s")
+_DOC_START = re.compile(r"^\s*(?:\"\"\"|'''|///?|/\*\*|#|\*\s)")
+_TEXT_EXTENSIONS = {".md", ".markdown", ".rst", ".txt"}
+
+
+def is_outline_line(line: str, text_file: bool = False) -> bool:
+    """True if `line` declares something worth keeping in an outline."""
+    if text_file:
+        return bool(_HEADING.match(line))
+    return bool(_DECLARATION.match(line) or _SIGNATURE.match(line))
+
+
+def outline_chunks(chunks, path: str, size: int, max_chars: int, classifier=None) -> str:
+    """
+    Build an outline from a stream of byte chunks.
+
+    Args:
+        chunks (iterable): Byte chunks of the file, in order. Iteration stops as soon as
+                           the outline is full, so the rest of the file is never read.
+        path (str): File path (its extension selects heading or declaration outlines)
+        size (int): Size of the whole file in bytes, for the outline header
+        max_chars (int): Budget for the outline text
+        classifier (ContentClassifier, optional): Rejects the file from its first chunk
+
+    Returns:
+        str: The outline, every kept line prefixed with its line number
+
+    Raises:
+        ContentRejected: The classifier rejected the first chunk
+    """
+    text_file = posixpath.splitext(path)[1].lower() in _TEXT_EXTENSIONS
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parts = [f"[Outline of {path}: {size} bytes, larger than the file size limit. "
+             f"Only declarations are kept, prefixed with their line numbers.]\n"]
+    used = len(parts[0])
+    line_number = 0
+    pending = ""
+    keep_doc = False
+
+    for chunk_index, chunk in enumerate(chunks):
+        if chunk_index == 0 and classifier is not None:
+            reason = classifier.reject_prefix(path, chunk[:PREFIX_BYTES])
+            if reason:
+                raise ContentRejected(reason)
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()  # The last line may continue in the next chunk
+        if len(pending) > CHUNK_BYTES:
+            # Only the start of a line is ever kept; do not let one huge line grow unbounded
+            pending = pending[:MAX_OUTLINE_LINE]
+        for line in lines:
+            line_number += 1
+            line = line.rstrip("\r")
+            # The first doc line after a declaration says what it is for
+            declaration = is_outline_line(line, text_file)
+            keep = declaration or (keep_doc and bool(_DOC_START.match(line)))
+            keep_doc = declaration
+            if not keep:
+                continue
+            entry = f"{line_number}: {line[:MAX_OUTLINE_LINE]}\n"
+            if used + len(entry) > max_chars:
+                parts.append(f"[... outline truncated at line {line_number}]\n")
+                return "".join(parts)
+            parts.append(entry)
+            used += len(entry)
+
+    line = pending + decoder.decode(b"", final=True)
+    if line and is_outline_line(line, text_file) and used + len(line) < max_chars:
+        parts.append(f"{line_number + 1}: {line[:MAX_OUTLINE_LINE]}\n")
+    return "".join(parts)
+
+
+def outline_stream(stream, path: str, size: int, max_chars: int, classifier=None) -> str:
+    """Outline a binary file-like object, reading it `CHUNK_BYTES` at a time. See outline_chunks."""
+    return outline_chunks(iter(lambda: stream.read(CHUNK_BYTES), b""), path, size, max_chars, classifier)
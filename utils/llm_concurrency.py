@@ -0,0 +1,199 @@
+"""
+Adaptive concurrency limits (AIMD) for LLM calls.
+
+A fixed number of parallel requests is either too timid or gets throttled,
+depending on the provider's load and the account's tier. `AIMDLimiter` caps
+the requests in flight to one provider and adapts the cap like TCP congestion
+control: every healthy response adds 1/limit (about +1 per round of `limit`
+requests), while a throttling response (HTTP 429 / 503), a timeout or a
+latency spike halves it. Only one cut is made per round: responses to
+requests sent before the last cut do not cut again.
+
+Every adjustment is recorded in the "concurrency_limit" metric series of the
+provider (see utils/llm_metrics.py).
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import llm_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 32
+# Multiplicative decrease on congestion
+DECREASE_FACTOR = 0.5
+# A response slower than this many times its usual latency counts as congestion
+DEFAULT_LATENCY_SPIKE_FACTOR = 2.0
+# Weight of the newest latency in the moving average
+LATENCY_SMOOTHING = 0.2
+# Latencies needed before spikes are detected
+MIN_LATENCY_SAMPLES = 3
+# HTTP statuses with which providers signal overload
+THROTTLE_STATUSES = {429, 503}
+
+
+def status_code(error):
+    """
+    HTTP status behind an exception raised by a provider client, or None.
+
+    Looks through the exception chain for `requests` errors (response.status_code),
+    OpenAI SDK errors (status_code) and google-genai errors (code).
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        for value in (getattr(error, "status_code", None),
+                      getattr(getattr(error, "response", None), "status_code", None),
+                      getattr(error, "code", None)):
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def _is_timeout(error) -> bool:
+    name = type(error).__name__
+    return isinstance(error, TimeoutError) or "Timeout" in name
+
+
+class AIMDLimiter:
+    """
+    Additive-increase / multiplicative-decrease limit on concurrent calls.
+
+    Args:
+        name (str): Label for logs and metrics (e.g. the provider)
+        initial (float): Starting limit
+        minimum (float): Lower bound of the limit
+        maximum (float): Upper bound of the limit
+        spike_factor (float): Latency above spike_factor x the usual latency counts as congestion
+    """
+
+    def __init__(self, name: str, initial: float = DEFAULT_INITIAL_LIMIT, minimum: float = DEFAULT_MIN_LIMIT,
+                 maximum: float = DEFAULT_MAX_LIMIT, spike_factor: float = DEFAULT_LATENCY_SPIKE_FACTOR):
+        self.name = name
+        self.minimum = max(minimum, 1)
+        self.maximum = max(maximum, self.minimum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.spike_factor = spike_factor
+        self.in_flight = 0
+        self._latency = {}  # key -> (moving average, samples)
+        self._last_cut = float("-inf")
+        self._condition = threading.Condition()
+        llm_metrics.record("concurrency_limit", self.limit, name, "initial")
+
+    def acquire(self, timeout: float = None) -> float:
+        """
+        Wait for a free slot.
+
+        Args:
+            timeout (float, optional): Seconds to wait at most (None: no limit)
+
+        Returns:
+            float: Start time of the call (pass it to `release`)
+
+        Raises:
+            TimeoutError: If no slot freed up within `timeout`
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < math.floor(self.limit), timeout):
+                raise TimeoutError(f"No free LLM request slot for {self.name} within {timeout:.1f}s "
+                                   f"({self.in_flight} in flight, limit {self.limit:.1f})")
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started: float, error: Exception = None, latency_key=None) -> None:
+        """
+        Free the slot of a finished call and adapt the limit to its outcome.
+
+        Args:
+            started (float): Value returned by `acquire`
+            error (Exception, optional): The call's error, if it failed
+            latency_key (optional): Calls with the same key have comparable latencies (e.g. model and prompt size)
+        """
+        now = time.monotonic()
+        latency = now - started
+        with self._condition:
+            self.in_flight -= 1
+            reason = None
+            if error is not None:
+                status = status_code(error)
+                if status in THROTTLE_STATUSES:
+                    reason = f"HTTP {status}"
+                elif _is_timeout(error):
+                    reason = "timeout"
+            else:
+                average, samples = self._latency.get(latency_key, (latency, 0))
+                if samples >= MIN_LATENCY_SAMPLES and latency > self.spike_factor * average:
+                    reason = f"latency {latency:.1f}s vs {average:.1f}s"
+                else:
+                    # Spikes stay out of the average, so a slow phase keeps being recognized
+                    self._latency[latency_key] = (average + LATENCY_SMOOTHING * (latency - average), samples + 1)
+
+            if reason is not None:
+                # One cut per round: requests sent before the last cut saw the old limit
+                if started >= self._last_cut:
+                    self._adjust(max(self.limit * DECREASE_FACTOR, self.minimum), reason)
+                    self._last_cut = now
+            elif error is None and self.limit < self.maximum and self.in_flight + 1 >= math.floor(self.limit):
+                # Grow only while the limit is actually in use
+                self._adjust(min(self.limit + 1 / self.limit, self.maximum), None)
+            self._condition.notify_all()
+
+    def _adjust(self, limit: float, reason: str) -> None:
+        old, self.limit = self.limit, limit
+        if reason is None:
+            llm_metrics.increment("concurrency_increases", self.name)
+            # Record whole steps only, so the history stays short
+            if math.floor(limit) == math.floor(old):
+                return
+        else:
+            llm_metrics.increment("concurrency_decreases", self.name)
+            logger.info(f"CONCURRENCY: {self.name} limit {old:.1f} -> {limit:.1f} ({reason})")
+        llm_metrics.record("concurrency_limit", round(limit, 2), self.name, reason or "increase")
+
+    @contextmanager
+    def slot(self, timeout: float = None, latency_key=None):
+        """Context manager around `acquire` / `release` for one call."""
+        started = self.acquire(timeout)
+        try:
+            yield
+        except BaseException as e:
+            self.release(started, e, latency_key)
+            raise
+        self.release(started, None, latency_key)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _env_number(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name) or default)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={os.getenv(name)!r}, using {default}")
+        return default
+
+
+def get_limiter(provider: str) -> AIMDLimiter:
+    """
+    The limiter of `provider`, created on first use from LLM_CONCURRENCY (initial
+    limit), LLM_MIN_CONCURRENCY, LLM_MAX_CONCURRENCY and LLM_LATENCY_SPIKE_FACTOR.
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = AIMDLimiter(
+                provider,
+                initial=_env_number("LLM_CONCURRENCY", DEFAULT_INITIAL_LIMIT),
+                minimum=_env_number("LLM_MIN_CONCURRENCY", DEFAULT_MIN_LIMIT),
+                maximum=_env_number("LLM_MAX_CONCURRENCY", DEFAULT_MAX_LIMIT),
+                spike_factor=_env_number("LLM_LATENCY_SPIKE_FACTOR", DEFAULT_LATENCY_SPIKE_FACTOR),
+            )
+        return _limiters[provider]
@@ -0,0 +1,304 @@
+"""
+Hedged LLM requests and circuit breakers.
+
+A single slow or stuck upstream used to stall the whole run. `FailoverCaller`
+sends each prompt to its primary route (provider, model) and, if no answer
+arrived after the given percentile of that route's observed latency, sends a
+duplicate to a secondary route and takes whichever answers first. A primary
+that fails outright is failed over to the secondary at once.
+
+Each route also has a circuit breaker: after `failure_threshold` consecutive
+failures (HTTP 429 aside, which only means slowing down) it opens and the
+route is skipped (the secondary is called directly) for `cooldown` seconds;
+then a single trial call is let through, which closes the breaker again on
+success.
+
+A call can be given a timeout: every request gets the time left of it, and
+the caller stops waiting (and cancels a hedge that has not started) once it
+has passed.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils import llm_metrics
+from utils.llm_concurrency import status_code
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEDGE_PERCENTILE = 95
+# Hedge delay used until a route has MIN_LATENCY_SAMPLES observed latencies
+DEFAULT_INITIAL_HEDGE_DELAY = 60.0
+# Never hedge sooner than this, however fast a route usually answers
+DEFAULT_MIN_HEDGE_DELAY = 2.0
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_BREAKER_COOLDOWN = 60.0
+# Latencies kept per route
+LATENCY_WINDOW = 100
+MIN_LATENCY_SAMPLES = 5
+
+
+class CircuitOpenError(Exception):
+    """Raised when every route of a call has an open circuit breaker."""
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={value!r}, using {default}")
+        return default
+
+
+def _label(route) -> str:
+    return f"{route[0]}/{route[1]}"
+
+
+class LatencyTracker:
+    """
+    Recent latencies of successful calls per key.
+
+    Args:
+        window (int): Number of latencies kept per key
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key, percentile: float, min_samples: int = MIN_LATENCY_SAMPLES):
+        """The `percentile`-th percentile latency for `key`, or None with fewer than `min_samples` samples."""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        rank = min(int(len(samples) * percentile / 100), len(samples) - 1)
+        return samples[rank]
+
+
+class CircuitBreaker:
+    """
+    Per-route circuit breakers.
+
+    A route's breaker is "closed" (calls go through) until `failure_threshold`
+    consecutive calls fail; it is then "open" (calls are refused) for `cooldown`
+    seconds, after which it is "half-open": one trial call goes through, and its
+    outcome closes or re-opens the breaker.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open a breaker
+        cooldown (float): Seconds a breaker stays open
+    """
+
+    def __init__(self, failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+                 cooldown: float = DEFAULT_BREAKER_COOLDOWN):
+        self.failure_threshold = max(int(failure_threshold), 1)
+        self.cooldown = cooldown
+        self._state = {}  # route -> {"failures": int, "opened_at": float or None, "trial": permit or None}
+        self._lock = threading.Lock()
+
+    def _route_state(self, route) -> dict:
+        return self._state.setdefault(route, {"failures": 0, "opened_at": None, "trial": None})
+
+    def state(self, route) -> str:
+        with self._lock:
+            state = self._route_state(route)
+            if state["opened_at"] is None:
+                return "closed"
+            return "open" if time.monotonic() - state["opened_at"] < self.cooldown else "half-open"
+
+    def allow(self, route):
+        """
+        Whether a call may go to `route` now.
+
+        Returns:
+            False if the breaker refuses the call; otherwise a truthy permit. The
+            permit of a half-open breaker's trial call must end with
+            record_success, record_failure or release.
+        """
+        with self._lock:
+            state = self._route_state(route)
+            if state["opened_at"] is None:
+                return True
+            if time.monotonic() - state["opened_at"] < self.cooldown or state["trial"] is not None:
+                return False
+            state["trial"] = object()
+            return state["trial"]
+
+    def release(self, route, permit) -> None:
+        """End a call that had no verdict on the route (e.g. rate limited or cancelled), freeing its trial slot."""
+        with self._lock:
+            state = self._route_state(route)
+            if permit is not True and state["trial"] is permit:
+                state["trial"] = None
+
+    def record_success(self, route) -> None:
+        with self._lock:
+            self._state[route] = {"failures": 0, "opened_at": None, "trial": None}
+
+    def record_failure(self, route) -> bool:
+        """Count a failed call; True if this failure opened the breaker."""
+        with self._lock:
+            state = self._route_state(route)
+            state["failures"] += 1
+            reopened = state["trial"] is not None
+            state["trial"] = None
+            if reopened or (state["opened_at"] is None and state["failures"] >= self.failure_threshold):
+                state["opened_at"] = time.monotonic()
+                return True
+            return False
+
+
+class FailoverCaller:
+    """
+    Calls a provider function with hedging and circuit breakers.
+
+    Args:
+        call (callable): call(provider, model, prompt, timeout) -> response text
+        percentile (float): Hedge after this percentile of the primary route's observed latency
+        initial_delay (float): Hedge delay (seconds) while a route has too few latency samples
+        min_delay (float): Lower bound of the hedge delay (seconds)
+        breaker (CircuitBreaker, optional): Shared breakers (default: a new CircuitBreaker)
+    """
+
+    def __init__(self, call, percentile: float = DEFAULT_HEDGE_PERCENTILE,
+                 initial_delay: float = DEFAULT_INITIAL_HEDGE_DELAY,
+                 min_delay: float = DEFAULT_MIN_HEDGE_DELAY, breaker: CircuitBreaker = None):
+        self.call = call
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies = LatencyTracker()
+
+    @classmethod
+    def from_env(cls, call):
+        """
+        Build a caller configured by LLM_HEDGE_PERCENTILE, LLM_HEDGE_INITIAL_DELAY,
+        LLM_HEDGE_MIN_DELAY, LLM_BREAKER_FAILURES and LLM_BREAKER_COOLDOWN.
+        """
+        return cls(
+            call,
+            percentile=_env_float("LLM_HEDGE_PERCENTILE", DEFAULT_HEDGE_PERCENTILE),
+            initial_delay=_env_float("LLM_HEDGE_INITIAL_DELAY", DEFAULT_INITIAL_HEDGE_DELAY),
+            min_delay=_env_float("LLM_HEDGE_MIN_DELAY", DEFAULT_MIN_HEDGE_DELAY),
+            breaker=CircuitBreaker(
+                failure_threshold=_env_float("LLM_BREAKER_FAILURES", DEFAULT_FAILURE_THRESHOLD),
+                cooldown=_env_float("LLM_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN),
+            ),
+        )
+
+    def hedge_delay(self, route, node: str = None) -> float:
+        """Seconds to wait for `route` before sending the duplicate request."""
+        observed = self.latencies.percentile((node, route), self.percentile)
+        if observed is None:
+            return self.initial_delay
+        return max(observed, self.min_delay)
+
+    def _attempt(self, route, prompt: str, node: str, end: float = None, permit=True) -> str:
+        start = time.monotonic()
+        try:
+            if end is not None and end <= start:
+                raise TimeoutError(f"No time left to call {_label(route)}")
+            text = self.call(route[0], route[1], prompt, None if end is None else end - start)
+        except Exception as e:
+            # Rate limiting means slow down (the concurrency limiter does), not that the route is down
+            if status_code(e) == 429:
+                self.breaker.release(route, permit)
+                raise
+            if self.breaker.record_failure(route):
+                llm_metrics.increment("breaker_opened", node)
+                logger.warning(f"Circuit breaker opened for {_label(route)} after: {e}")
+                print(f"LLM route {_label(route)} is failing; routing around it for {self.breaker.cooldown:.0f}s")
+            raise
+        self.latencies.record((node, route), time.monotonic() - start)
+        self.breaker.record_success(route)
+        return text
+
+    def __call__(self, prompt: str, primary, secondary=None, node: str = None, timeout: float = None):
+        """
+        Send `prompt` to `primary`, hedged by or failed over to `secondary`.
+
+        Args:
+            prompt (str): The prompt
+            primary (tuple): (provider, model) to call first
+            secondary (tuple, optional): (provider, model) for the hedge or failover request
+            node (str, optional): Calling node, for latency tracking and metrics
+            timeout (float, optional): Seconds to wait for an answer from any route (None: no limit)
+
+        Returns:
+            tuple: ((provider, model) that answered, response text)
+
+        Raises:
+            CircuitOpenError: If the breakers of all routes are open
+            TimeoutError: If no route answered within `timeout`
+            Exception: The last route's error if every request failed
+        """
+        if secondary == primary:
+            secondary = None
+        end = None if timeout is None else time.monotonic() + timeout
+        permit = self.breaker.allow(primary)
+        if not permit:
+            permit = self.breaker.allow(secondary) if secondary is not None else False
+            if not permit:
+                raise CircuitOpenError(f"Circuit breaker open for {_label(primary)}"
+                                       + (f" and {_label(secondary)}" if secondary else ""))
+            llm_metrics.increment("breaker_skips", node)
+            logger.info(f"BREAKER: {_label(primary)} is open, calling {_label(secondary)}")
+            return secondary, self._attempt(secondary, prompt, node, end, permit)
+        if secondary is None:
+            return primary, self._attempt(primary, prompt, node, end, permit)
+
+        # The losing request cannot be cancelled mid-flight; it finishes in the background,
+        # bounded by its own timeout
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm-hedge")
+        routes, permits = {}, {primary: permit}
+        try:
+            routes[executor.submit(self._attempt, primary, prompt, node, end, permit)] = primary
+            pending = set(routes)
+            hedge_at = time.monotonic() + self.hedge_delay(primary, node)
+            hedged = False
+            error = None
+            while True:
+                # Wake up for the hedge, for the timeout, or when a request finishes
+                wake_times = [t for t in (None if hedged else hedge_at, end) if t is not None]
+                wake_in = max(min(wake_times) - time.monotonic(), 0) if wake_times else None
+                done, pending = wait(pending, timeout=wake_in, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        if routes[future] == secondary:
+                            llm_metrics.increment("hedge_wins", node)
+                        return routes[future], future.result()
+                    error = future.exception()
+                if not hedged and (not pending or time.monotonic() >= hedge_at):
+                    hedged = True
+                    permits[secondary] = self.breaker.allow(secondary)
+                    if permits[secondary]:
+                        llm_metrics.increment("hedges" if pending else "failovers", node)
+                        logger.info(f"HEDGE: {node or 'default'} {_label(primary)} "
+                                    f"{'still pending' if pending else 'failed'}, sending to {_label(secondary)}")
+                        future = executor.submit(self._attempt, secondary, prompt, node, end, permits[secondary])
+                        routes[future] = secondary
+                        pending.add(future)
+                if not pending:
+                    raise error
+                if end is not None and time.monotonic() >= end:
+                    raise TimeoutError(f"No answer from {_label(primary)} or {_label(secondary)} within {timeout:.1f}s")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            # A hedge cancelled before it started never reports to its breaker
+            for future, route in routes.items():
+                if future.cancelled():
+                    self.breaker.release(route, permits[route])
@@ -0,0 +1,255 @@
+"""
+Pools of API keys per LLM provider.
+
+In batch runs the per-key quota is the main throughput limit, so a provider
+can be given several keys, e.g. `OPENROUTER_API_KEYS=key1,key2,key3` (the
+single-key variable `OPENROUTER_API_KEY` still works and joins the pool).
+`LLMKeyPool` hands each request the key with the most headroom: fewest
+requests in flight, then fewest requests in the last minute, then the one
+used least recently. A key answered with HTTP 429 cools down for its
+`Retry-After` (or LLM_KEY_COOLDOWN seconds). A key rejected with 401/403
+rests for LLM_KEY_AUTH_COOLDOWN seconds for that model only (providers also
+answer 403 to a single model or a moderation hit), and only while another key
+can take over; the last usable key keeps being used, so retries still reach
+the provider. With `LLM_KEY_RPM` set, a key that sent that many requests in
+the last minute waits for its window too.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from utils import llm_metrics
+from utils.llm_concurrency import status_code
+
+logger = logging.getLogger(__name__)
+
+# Provider -> variable holding its key (the pool also reads the variable + "S")
+KEY_VARIABLES = {
+    "GEMINI": "GEMINI_API_KEY",
+    "OPENROUTER": "OPENROUTER_API_KEY",
+    "OPENAI": "OPENAI_API_KEY",
+    "GENERIC": "LLM_API_KEY",
+}
+DEFAULT_RATE_LIMIT_COOLDOWN = 60.0
+# Rejected keys are as good as gone for a run
+DEFAULT_AUTH_COOLDOWN = 3600.0
+AUTH_STATUSES = {401, 403}
+# Requests are counted over this window for LLM_KEY_RPM
+RATE_WINDOW = 60.0
+
+
+def _mask(key) -> str:
+    """Short, non-secret label for a key in logs and metrics."""
+    return f"...{key[-4:]}" if key else "no key"
+
+
+def keys_from_env(provider: str) -> list:
+    """
+    API keys configured for `provider`: the comma-separated `<VARIABLE>S` list
+    followed by `<VARIABLE>`, without duplicates.
+    """
+    variable = KEY_VARIABLES.get(provider)
+    if variable is None:
+        return []
+    keys = []
+    for value in (os.getenv(variable + "S", ""), os.getenv(variable, "")):
+        for key in value.split(","):
+            if key.strip() and key.strip() not in keys:
+                keys.append(key.strip())
+    return keys
+
+
+def retry_after(error):
+    """Seconds from the `Retry-After` header of the response behind `error`, or None."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers is not None:
+            try:
+                return float(headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                pass
+        error = error.__cause__ or error.__context__
+    return None
+
+
+class KeyUnavailableError(Exception):
+    """Raised when every key of a pool is cooling down (or at its rate) for longer than a call may wait."""
+
+
+class LLMKeyPool:
+    """
+    Spreads requests over a provider's API keys with per-key accounting.
+
+    A pool without keys hands out None (for providers that need no key, like a
+    local server or Vertex AI).
+
+    Args:
+        provider (str): Provider name, for logs and metrics
+        keys (list of str): API keys
+        rpm (int, optional): Requests per key per minute (None: not limited)
+        cooldown (float): Seconds a rate-limited key rests without a Retry-After
+        auth_cooldown (float): Seconds a rejected key rests for the rejected model
+    """
+
+    def __init__(self, provider: str, keys, rpm: int = None, cooldown: float = DEFAULT_RATE_LIMIT_COOLDOWN,
+                 auth_cooldown: float = DEFAULT_AUTH_COOLDOWN):
+        self.provider = provider
+        self.rpm = rpm or None
+        self.cooldown = cooldown
+        self.auth_cooldown = auth_cooldown
+        self._state = {
+            key: {"in_flight": 0, "recent": deque(), "last_used": 0.0, "cooldown_until": 0.0,
+                  "rejected_until": {}}
+            for key in dict.fromkeys(keys)
+        }
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._state)
+
+    def _free_at(self, state: dict, now: float, model: str = None) -> float:
+        """When the key can take a request for `model` (now or earlier if it can right away)."""
+        while state["recent"] and state["recent"][0] <= now - RATE_WINDOW:
+            state["recent"].popleft()
+        free_at = max(state["cooldown_until"], state["rejected_until"].get(model, 0.0))
+        if self.rpm and len(state["recent"]) >= self.rpm:
+            free_at = max(free_at, state["recent"][-self.rpm] + RATE_WINDOW)
+        return free_at
+
+    def acquire(self, timeout: float = None, exclude=(), model: str = None):
+        """
+        Take the key with the most headroom, waiting for one if all are resting.
+
+        Args:
+            timeout (float, optional): Seconds to wait at most (None: no limit)
+            exclude (iterable, optional): Keys not to use (e.g. ones that just failed)
+            model (str, optional): Model the request is for (keys rejected for it are skipped)
+
+        Returns:
+            str: The key (None for a pool without keys)
+
+        Raises:
+            KeyUnavailableError: If no key becomes usable in time
+        """
+        if not self._state:
+            return None
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                candidates = {key: self._free_at(state, now, model) for key, state in self._state.items()
+                              if key not in exclude}
+                if not candidates:
+                    raise KeyUnavailableError(f"No other {self.provider} API key to try")
+                usable = [key for key, free_at in candidates.items() if free_at <= now]
+                if usable:
+                    key = min(usable, key=lambda k: (self._state[k]["in_flight"], len(self._state[k]["recent"]),
+                                                     self._state[k]["last_used"]))
+                    state = self._state[key]
+                    state["in_flight"] += 1
+                    state["recent"].append(now)
+                    state["last_used"] = now
+                    return key
+                next_free = min(candidates.values())
+                if give_up_at is not None and next_free > give_up_at:
+                    raise KeyUnavailableError(
+                        f"All {self.provider} API keys are resting; the next is usable in {next_free - now:.0f}s")
+                self._condition.wait(next_free - now)
+
+    def release(self, key, error: Exception = None, model: str = None) -> bool:
+        """
+        Return a key after its request, resting it if the provider throttled or rejected it.
+
+        A rejected key only rests for `model`, and only if another key is not
+        rejected for that model too.
+
+        Returns:
+            bool: True if the key was put to rest (the request may be retried with another key)
+        """
+        if key not in self._state:
+            return False
+        status = status_code(error) if error is not None else None
+        label = f"{self.provider} key {_mask(key)}"
+        llm_metrics.increment("requests", label)
+        with self._condition:
+            state = self._state[key]
+            state["in_flight"] -= 1
+            rest = None
+            now = time.monotonic()
+            if status == 429:
+                rest = retry_after(error) or self.cooldown
+                state["cooldown_until"] = max(state["cooldown_until"], now + rest)
+            elif status in AUTH_STATUSES and any(
+                    other["rejected_until"].get(model, 0.0) <= now
+                    for other_key, other in self._state.items() if other_key != key):
+                rest = self.auth_cooldown
+                state["rejected_until"][model] = max(state["rejected_until"].get(model, 0.0), now + rest)
+            self._condition.notify_all()
+        if rest is None:
+            return False
+        llm_metrics.increment("rate_limited" if status == 429 else "rejected", label)
+        scope = "" if status == 429 or model is None else f" for {model}"
+        logger.warning(f"{label} got HTTP {status}; resting it{scope} for {rest:.0f}s")
+        if len(self._state) > 1:
+            print(f"{label} got HTTP {status}; resting it{scope} for {rest:.0f}s and using the other keys")
+        return True
+
+    @contextmanager
+    def key(self, timeout: float = None, exclude=(), model: str = None):
+        """Context manager around `acquire` / `release`; yields the key."""
+        key = self.acquire(timeout, exclude, model)
+        try:
+            yield key
+        except BaseException as e:
+            self.release(key, e, model)
+            raise
+        self.release(key, model=model)
+
+    def snapshot(self) -> dict:
+        """Per-key accounting (keys are masked)."""
+        now = time.monotonic()
+        with self._condition:
+            return {
+                _mask(key): {"in_flight": state["in_flight"], "last_minute": len(state["recent"]),
+                             "resting_for": max(state["cooldown_until"] - now, 0),
+                             "rejected_for": sorted(str(model) for model, until in state["rejected_until"].items()
+                                                    if until > now)}
+                for key, state in self._state.items()
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _env_number(name: str, default):
+    try:
+        return float(os.getenv(name)) if os.getenv(name) else default
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={os.getenv(name)!r}")
+        return default
+
+
+def get_key_pool(provider: str) -> LLMKeyPool:
+    """
+    The key pool of `provider`, created on first use from its key variables,
+    LLM_KEY_RPM, LLM_KEY_COOLDOWN and LLM_KEY_AUTH_COOLDOWN.
+    """
+    with _pools_lock:
+        if provider not in _pools:
+            keys = keys_from_env(provider)
+            rpm = _env_number("LLM_KEY_RPM", None)
+            _pools[provider] = LLMKeyPool(
+                provider, keys, rpm=int(rpm) if rpm else None,
+                cooldown=_env_number("LLM_KEY_COOLDOWN", DEFAULT_RATE_LIMIT_COOLDOWN),
+                auth_cooldown=_env_number("LLM_KEY_AUTH_COOLDOWN", DEFAULT_AUTH_COOLDOWN),
+            )
+            if len(keys) > 1:
+                print(f"Using a pool of {len(keys)} {provider} API keys.")
+        return _pools[provider]
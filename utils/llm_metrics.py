@@ -0,0 +1,98 @@
+"""
+Run-wide counters for LLM calls.
+
+`call_llm` and its helpers count events per node (e.g. cascade calls and
+escalations) and record series of values with their time (e.g. a provider's
+concurrency limit); `summary` turns them into per-node rates and current
+values that `main.py` prints at the end of a run. The scope of a metric is
+usually a node, but can be any label, such as a provider.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(lambda: defaultdict(int))  # metric -> node -> count
+_series = defaultdict(lambda: defaultdict(list))  # metric -> node -> [(seconds, value, note)]
+_start = time.monotonic()
+# Entries of a series shown by print_summary
+PRINTED_SERIES_ENTRIES = 10
+
+
+def increment(metric: str, node: str = None, amount: int = 1) -> None:
+    """Add `amount` to `metric` for `node`."""
+    with _lock:
+        _counters[metric][node or "default"] += amount
+
+
+def record(metric: str, value, node: str = None, note: str = None) -> None:
+    """Append `value` to the series `metric` of `node`, with the time since the run started."""
+    with _lock:
+        _series[metric][node or "default"].append((round(time.monotonic() - _start, 2), value, note))
+
+
+def series(metric: str, node: str = None) -> list:
+    """The (seconds, value, note) entries of a series."""
+    with _lock:
+        return list(_series[metric].get(node or "default", ()))
+
+
+def get(metric: str, node: str = None) -> int:
+    with _lock:
+        return _counters[metric].get(node or "default", 0)
+
+
+def snapshot() -> dict:
+    """Copy of all counters: {metric: {node: count}}."""
+    with _lock:
+        return {metric: dict(nodes) for metric, nodes in _counters.items()}
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _series.clear()
+
+
+def summary() -> dict:
+    """
+    Per-node metrics for the run.
+
+    Returns:
+        dict: node -> {metric: count or latest value of a series, ...}, plus "escalation_rate"
+              for nodes that cascaded
+    """
+    nodes = defaultdict(dict)
+    for metric, counts in snapshot().items():
+        for node, count in counts.items():
+            nodes[node][metric] = count
+    with _lock:
+        for metric, entries in _series.items():
+            for node, values in entries.items():
+                nodes[node][metric] = values[-1][1]
+    for values in nodes.values():
+        if values.get("cascade_calls"):
+            values["escalation_rate"] = values.get("cascade_escalations", 0) / values["cascade_calls"]
+    return dict(nodes)
+
+
+def print_summary() -> None:
+    """
+    Print one line per node with its metrics, and the latest entries of its
+    series that changed (nothing if no metric was recorded).
+    """
+    with _lock:
+        histories = {(metric, node): list(values) for metric, entries in _series.items()
+                     for node, values in entries.items() if len(values) > 1}
+    for node, values in sorted(summary().items()):
+        parts = [f"{metric}={value:.0%}" if metric.endswith("_rate") else f"{metric}={value}"
+                 for metric, value in sorted(values.items())]
+        print(f"LLM metrics for {node}: {', '.join(parts)}")
+        for (metric, series_node), entries in sorted(histories.items()):
+            if series_node != node:
+                continue
+            shown = [f"{seconds:.0f}s {value}" + (f" ({note})" if note else "")
+                     for seconds, value, note in entries[-PRINTED_SERIES_ENTRIES:]]
+            skipped = len(entries) - len(shown)
+            print(f"  {metric} history: " + (f"... {skipped} earlier, " if skipped else "") + ", ".join(shown))
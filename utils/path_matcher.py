@@ -0,0 +1,246 @@
+"""
+Compiled include/exclude/.gitignore matcher shared by all crawlers.
+
+Glob patterns are compiled once per pattern set (into string prefix/suffix
+checks plus a single regular expression), so filtering a path costs a few
+C-level string operations instead of one `fnmatch` call per pattern. Both
+crawlers use the same semantics:
+
+- A pattern without "/" matches the file (or directory) name at any depth,
+  e.g. "*.py", "Dockerfile".
+- A pattern with "/" matches the path relative to the crawl root, where "*"
+  also matches "/", e.g. "tests/*", "*node_modules/*".
+- A directory is pruned before it is descended if an exclude pattern matches
+  its path or name, or if a pattern ending in "*" matches "<dir>/" (so every
+  file below it would be excluded anyway).
+- Files and directories ignored by .gitignore rules are excluded as well;
+  `GitIgnoreRules` applies nested `.gitignore` files and `.git/info/exclude`
+  with git's precedence, and ignored directories are pruned like excluded ones.
+"""
+
+import fnmatch
+import os
+import re
+
+import pathspec
+
+
+_WILDCARDS = re.compile(r"[*?\[]")
+
+
+class _CompiledPatterns:
+    """
+    A set of glob patterns compiled for fast matching against relative paths.
+
+    Common shapes are reduced to C-level string checks ("*.py" -> suffix,
+    "docs/*" -> prefix, "*test*" -> substring, "Dockerfile" -> exact name);
+    everything else is folded into a single alternation regex.
+    """
+
+    def __init__(self, patterns):
+        suffixes, prefixes, name_prefixes, contains = [], [], [], []
+        names, paths, regex_parts = set(), set(), []
+        for pattern in sorted(patterns):
+            is_name_pattern = "/" not in pattern
+            core = pattern.strip("*")
+            if not core or _WILDCARDS.search(core):
+                translated = fnmatch.translate(pattern)
+                if is_name_pattern and not pattern.startswith("*"):
+                    # Name patterns match the last path component at any depth
+                    translated = f"(?:.*/)?(?:{translated})"
+                regex_parts.append(translated)
+            elif pattern.startswith("*") and pattern.endswith("*"):
+                contains.append(core)
+            elif pattern.startswith("*"):
+                suffixes.append(core)
+            elif pattern.endswith("*"):
+                (name_prefixes if is_name_pattern else prefixes).append(core)
+            else:
+                (names if is_name_pattern else paths).add(core)
+        self.suffixes = tuple(suffixes)
+        self.prefixes = tuple(prefixes)
+        self.name_prefixes = tuple(name_prefixes)
+        self.contains = tuple(contains)
+        self.names = names
+        self.paths = paths
+        self.regex = re.compile("|".join(regex_parts), re.DOTALL) if regex_parts else None
+
+    def match(self, path: str) -> bool:
+        if self.suffixes and path.endswith(self.suffixes):
+            return True
+        if self.prefixes and path.startswith(self.prefixes):
+            return True
+        if self.contains and any(part in path for part in self.contains):
+            return True
+        if self.names or self.name_prefixes:
+            name = path.rsplit("/", 1)[-1]
+            if name in self.names or (self.name_prefixes and name.startswith(self.name_prefixes)):
+                return True
+        if self.paths and path in self.paths:
+            return True
+        return self.regex is not None and self.regex.match(path) is not None
+
+
+def _compile(patterns, prefix_only: bool = False):
+    """Compile glob patterns for matching against a full relative path, or None if there are none."""
+    patterns = [p for p in (patterns or []) if not prefix_only or p.endswith("*")]
+    return _CompiledPatterns(patterns) if patterns else None
+
+
+def _read_ignore_file(path: str):
+    """Parse one gitignore-style file into a PathSpec, or None if missing, empty or unreadable."""
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            spec = pathspec.PathSpec.from_lines("gitwildmatch", f.readlines())
+    except Exception as e:
+        print(f"Warning: Could not read or parse .gitignore file {path}: {e}")
+        return None
+    if not spec.patterns:
+        return None
+    print(f"Loaded .gitignore patterns from {path}")
+    return spec
+
+
+def load_gitignore(directory: str):
+    """Load `<directory>/.gitignore` as a PathSpec, or None if missing or unreadable."""
+    return _read_ignore_file(os.path.join(directory, ".gitignore"))
+
+
+def _spec_decision(spec, path: str):
+    """
+    Apply one ignore file to `path`: True if ignored, False if re-included by a
+    negated pattern, None if no pattern matches. The last matching pattern wins.
+    """
+    for pattern in reversed(spec.patterns):
+        if pattern.include is not None and pattern.match_file(path):
+            return pattern.include
+    return None
+
+
+class GitIgnoreRules:
+    """
+    Hierarchical .gitignore rules for a directory tree, following git's precedence.
+
+    Every directory's `.gitignore` applies to paths below it, with deeper files
+    overriding shallower ones. When the crawl root lies inside a git working
+    tree, the `.gitignore` files between the repository root and the crawl root
+    and `.git/info/exclude` apply as well, with lower priority. Per-directory
+    specs are loaded lazily the first time a path below them is checked and
+    cached, so each ignore file is read once per crawl. The `.git` directory
+    itself is always ignored.
+
+    Paths are relative to the crawl root with "/" separators; directories are
+    passed with a trailing "/".
+
+    Args:
+        root (str): Crawl root directory
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._specs = {}
+        self._outer = self._load_outer_specs()
+
+    def _load_outer_specs(self):
+        """Load the ignore files that apply from outside the crawl root, highest priority first."""
+        root = os.path.abspath(self.root)
+        current, prefix, candidates = root, "", []
+        while True:
+            git_dir = os.path.join(current, ".git")
+            if current != root:
+                candidates.append((prefix, os.path.join(current, ".gitignore")))
+            if os.path.exists(git_dir):
+                candidates.append((prefix, os.path.join(git_dir, "info", "exclude")))
+                break
+            parent = os.path.dirname(current)
+            if parent == current:
+                # Not inside a git working tree: only the crawl root's own files apply
+                return []
+            prefix = f"{os.path.basename(current)}/{prefix}"
+            current = parent
+        specs = []
+        for prefix, path in candidates:
+            spec = _read_ignore_file(path)
+            if spec is not None:
+                specs.append((prefix, spec))
+        return specs
+
+    def spec_for(self, rel_dir: str):
+        """The parsed `.gitignore` of a directory relative to the root (cached), or None."""
+        if rel_dir not in self._specs:
+            self._specs[rel_dir] = _read_ignore_file(os.path.join(self.root, rel_dir, ".gitignore"))
+        return self._specs[rel_dir]
+
+    def match_file(self, path: str) -> bool:
+        """Check whether a relative path (directories with a trailing "/") is ignored."""
+        is_dir = path.endswith("/")
+        parts = path.rstrip("/").split("/")
+        if is_dir and parts[-1] == ".git":
+            return True
+        # Deepest directory first: the closest .gitignore takes precedence
+        for depth in range(len(parts) - 1, -1, -1):
+            spec = self.spec_for("/".join(parts[:depth]))
+            if spec is None:
+                continue
+            decision = _spec_decision(spec, "/".join(parts[depth:]) + ("/" if is_dir else ""))
+            if decision is not None:
+                return decision
+        for prefix, spec in self._outer:
+            decision = _spec_decision(spec, prefix + path)
+            if decision is not None:
+                return decision
+        return False
+
+
+class PathMatcher:
+    """
+    Precompiled file filter.
+
+    Args:
+        include_patterns (str or set of str, optional): Files to include. If empty, all files are included.
+        exclude_patterns (str or set of str, optional): Files and directories to exclude.
+        gitignore_spec (pathspec.PathSpec or GitIgnoreRules, optional): .gitignore rules relative
+                                                                        to the crawl root.
+    """
+
+    def __init__(self, include_patterns=None, exclude_patterns=None, gitignore_spec=None):
+        if isinstance(include_patterns, str):
+            include_patterns = {include_patterns}
+        if isinstance(exclude_patterns, str):
+            exclude_patterns = {exclude_patterns}
+        self.include_patterns = include_patterns
+        self.exclude_patterns = exclude_patterns
+        self.gitignore_spec = gitignore_spec
+        self._include = _compile(include_patterns)
+        self._exclude = _compile(exclude_patterns)
+        self._exclude_prefix = _compile(exclude_patterns, prefix_only=True)
+
+    def is_ignored(self, path: str, is_dir: bool = False) -> bool:
+        """Check the .gitignore rules for a relative path."""
+        if self.gitignore_spec is None:
+            return False
+        # Gitignore patterns match a directory by its path with a trailing "/"
+        return bool(self.gitignore_spec.match_file(path + "/" if is_dir else path))
+
+    def is_excluded(self, path: str) -> bool:
+        """Check if a file path matches an exclude pattern."""
+        return self._exclude is not None and self._exclude.match(path)
+
+    def is_included(self, path: str) -> bool:
+        """Check if a file path matches an include pattern (always True without include patterns)."""
+        return self._include is None or self._include.match(path)
+
+    def should_include_file(self, path: str) -> bool:
+        """Full file-level decision: included, not excluded and not ignored."""
+        return self.is_included(path) and not self.is_excluded(path) and not self.is_ignored(path)
+
+    def is_dir_excluded(self, dir_path: str) -> bool:
+        """Check if a directory should be pruned instead of descended."""
+        dir_path = dir_path.rstrip("/")
+        if self.is_excluded(dir_path):
+            return True
+        if self._exclude_prefix is not None and self._exclude_prefix.match(dir_path + "/"):
+            return True
+        return self.is_ignored(dir_path, is_dir=True)